@@ -30,15 +30,37 @@
 
 import markup3dmodule
 import polygon3dmodule
+import mesh3dmodule
+import obj3dmodule
+import pipeline3dmodule
+import shard3dmodule
+import texture3dmodule
+import cityjson3dmodule
+import cache3dmodule
 from lxml import etree
 import os
+import re
+import sys
+import json
 import argparse
-import glob
+import csv
 import numpy as np
 import itertools
+import multiprocessing
+import time
+try:
+	import pyarrow
+	import pyarrow.parquet
+	import pyarrow.feather
+except ImportError:
+	pyarrow = None
+try:
+	import resource
+except ImportError:
+	resource = None
 
 #-- ARGUMENTS
-# -i -- input directory (it will read and convert ALL CityGML files in a directory)
+# -i -- input directory (it will read and convert ALL CityGML files in a directory, and the CityJSON files)
 # -o -- output directory (it will output the generated OBJs in that directory in the way that Delft.gml becomes Delft.obj)
 #-- SETTINGS of the converter (can be combined):
 # -s 0 (default) -- converts all geometries in one class in one file under the same object (plain OBJ file).
@@ -47,9 +69,42 @@ import itertools
 # -g 0 (default) -- keeps all objects in the same bin.
 # -g 1 -- it creates one object for every building.
 # -v 1 -- validation
-# -p 1 -- skip triangulation and write polygons. Polys with interior not supported.
+# -p 1 -- skip triangulation and write polygons. The interior rings are joined to the exterior with bridge (keyhole) edges.
 # -t 1 -- translation (reduction) of coordinates so the smallest vertex (one with the minimum coordinates) is at (0, 0)
 # -a 1 or 2 or 3 -- this is a very custom setting for adding the texture based on attributes, here you can see the settings for my particular case of the solar radiation. By default it is off.
+# --weld-tolerance 0.001 -- vertices closer than the tolerance (in the units of the CRS) are welded into one vertex. By default only identical vertices are merged.
+# --global-weld 1 -- vertices are shared across buildings with one vertex table per class for the whole file. By default each building has its own vertices.
+# --weld-memory 1024 -- size cap (MB, estimated) of the spatial hash of the global welding, above which the vertices are deduplicated with an external sort.
+# --simplify 1 -- merges adjacent coplanar polygons of each building and semantic class before the triangulation.
+# --precision 3 -- writes the coordinates with this number of decimals, e.g. 3 for millimetres. By default 12 significant digits are written.
+# --metrics 1 -- writes a table with the area, normal, azimuth and tilt of each polygon. With 2 only the table is written, without the OBJs.
+# --triangulator earcut -- triangulates with earcut (requires mapbox_earcut) instead of Triangle (default).
+# --budget 5 -- triangulates the large polygons in a separate process within this time budget (s). The polygons which run out of time or fail are triangulated with earcut or as a fan, and reported.
+# --benchmark 1 -- triangulates the polygons of each file with all backends and compares their time and output, without writing the OBJs.
+# --pipeline 1 -- parses the next file and writes the OBJs in background threads, overlapping the disk and the CPU time.
+# --workers 4 -- triangulates in this number of worker processes. By default the triangulation is done in the main process.
+# --queue-size 16 -- bound of the queues of the pipeline: OBJ files waiting to be written and city objects waiting for the workers.
+# --auto 2048 -- scans the files first and chooses the workers, the pipeline and the queue size within this memory budget (MB), unless they are given. The plan and its estimate are compared with the actual time and memory in auto-plan.csv.
+# --textures 1 -- converts the textures and materials of the appearances to texture coordinates and a material library (MTL).
+# --theme name -- theme of the appearances to convert. By default the first theme found.
+# --atlas 4096 -- packs the texture images of each file into atlases of this size in pixels (requires Pillow).
+# --blocks 1 -- writes also an LOD1 block model (e.g. Delft-LOD1.obj): a prism of the footprint of each building up to its measured height or highest roof point.
+# --vertex-cache 1 -- reorders the triangles of each object for the post-transform vertex cache of the GPUs (Forsyth's algorithm) and renumbers the vertices of each building in the order they are first used, and reports the ACMR before and after.
+# --watertight 1 -- checks if the faces of each building form a closed shell and writes a report. With 2 the buildings which are not watertight are skipped, with 3 they are written to a separate OBJ.
+# --index 1 -- writes an index of the buildings next to each OBJ (e.g. Delft.index.json), with the byte ranges of their vertices and faces, their bounding box and classes. Requires -g 1.
+# --cache 1 -- saves the triangulated geometry of each file with the building, semantic class and attributes of each face in a cache (e.g. Delft.cache), from which the OBJs can be exported again with other options.
+# --export 1 -- writes the OBJs from the caches in the input directory instead of converting the CityGML files, with the options -s, -g, -a, -t, --precision and --index.
+# --coincident 1 -- removes the coincident faces with opposite orientations, e.g. the party walls of adjacent buildings. With 2 they are kept and only reported.
+# --lod 2 -- extracts only the geometries in this level of detail. With auto the highest level of detail of each object is extracted. By default all are extracted.
+# --plan 8 -- splits the input into this number of shards, and writes their manifests to the output directory, without converting.
+# --shard /path/shard-0003.json -- converts one planned shard (-i and -o are not needed), with the same options for all shards.
+# --merge 1 -- merges the outputs of the converted shards in the output directory into the final OBJs (-i is not needed).
+
+#-- Number of polygons of which the metrics are computed at once
+METRICS_BATCH = 100000
+
+#-- Number of points from which a polygon is triangulated in the watchdog process, within the time budget
+BUDGET_POINTS = 1000
 
 #-- Text to be printed at the beginning of each OBJ
 header = """# Converted from CityGML to OBJ with CityGML2OBJs.
@@ -59,29 +114,34 @@ header = """# Converted from CityGML to OBJ with CityGML2OBJs.
 
 """
 
-def get_index(point, list_vertices, shift=0):
+def get_index(point, list_vertices, shift, grid):
 	"""Index the vertices.
-	The third option is for incorporating a local index (building-level) to the global one (dataset-level)."""
+	The third option is for incorporating a local index (building-level) to the global one (dataset-level).
+	The fourth option is the spatial hash of list_vertices, which finds the point and welds the points within the weld tolerance."""
 	global vertices
-	"""Unique identifier and indexer of vertices."""
-	if point in list_vertices:
-		return list_vertices.index(point) + 1 + shift, list_vertices
-	else:
-		list_vertices.append(point)
-		return list_vertices.index(point) + 1 + shift, list_vertices
-
-def write_vertices(list_vertices, cla):
-	"""Write the vertices in the OBJ format."""
-	global vertices_output
-	for each in list_vertices:
-		vertices_output[cla].append("v" + " " + str(each[0]) + " " + str(each[1]) + " " + str(each[2]) + "\n")
-
-
-def remove_reccuring(list_vertices):
+	global welded
+	idx = mesh3dmodule.weld_lookup(point, grid, list_vertices, WELD)
+	if idx is None:
+		idx = mesh3dmodule.weld_insert(point, grid, list_vertices, WELD)
+	elif list_vertices[idx] != point:
+		#-- A near-identical point has been snapped to an existing vertex
+		welded += 1
+	return idx + 1 + shift, list_vertices
+
+def remove_reccuring(list_vertices, tolerance=None):
 	"""Removes recurring vertices, which messes up the triangulation.
+	With a tolerance, vertices closer than the tolerance to a previous one are considered recurring.
 	Inspired by http://stackoverflow.com/a/1143432"""
 	# last_point = list_vertices[-1]
 	list_vertices_without_last = list_vertices[:-1]
+	if tolerance:
+		grid = {}
+		found = []
+		for item in list_vertices_without_last:
+			if mesh3dmodule.weld_lookup(item, grid, found, tolerance) is None:
+				mesh3dmodule.weld_insert(item, grid, found, tolerance)
+				yield item
+		return
 	found = set()
 	for item in list_vertices_without_last:
 		if str(item) not in found:
@@ -89,19 +149,40 @@ def remove_reccuring(list_vertices):
 			found.add(str(item))
 
 
-def poly_to_obj(poly, cl, material=None):
-	"""Main conversion function of one polygon to one or more faces in OBJ,
-	in a specific semantic class. Supports assigning a material."""
-	global local_vertices
-	global vertices
-	global face_output
-	#-- Decompose the polygon into exterior and interior
-	e, i = markup3dmodule.polydecomposer(poly)
-	#-- Points forming the exterior LinearRing
-	epoints = markup3dmodule.GMLpoints(e[0])
+def benchmark(objects):
+	"""Triangulates all polygons of the objects with each available backend and prints the comparison."""
+	polygons = []
+	for o in objects:
+		for poly in object_polygons(o, object_lod(o)):
+			e, i = parse_polygon(poly)
+			if len(e) > 3:
+				polygons.append((e, i))
+	backends = sorted(polygon3dmodule.TRIANGULATORS)
+	if polygon3dmodule.mapbox_earcut is None:
+		backends.remove('earcut')
+		print "\tmapbox_earcut is not installed, only Triangle is benchmarked."
+	print "\tTriangulating %d polygon(s) with each backend..." % len(polygons)
+	results = polygon3dmodule.benchmark_triangulation(polygons, backends)
+	print "\t%-10s %10s %12s %8s %10s" % ('backend', 'seconds', 'triangles', 'failed', 'coverage')
+	for backend in backends:
+		elapsed, ntris, nfailed, coverage = results[backend]
+		print "\t%-10s %10.3f %12d %8d %10.6f" % (backend, elapsed, ntris, nfailed, coverage)
+
+def parse_polygon(poly):
+	"""Extracts the exterior and interior rings of a polygon, cleaned of the recurring points."""
+	if isinstance(poly, cityjson3dmodule.Surface):
+		#-- The rings of a CityJSON surface are indices of the vertices of the file
+		rings = poly.points()
+		epoints = rings[0]
+		i = rings[1:]
+	else:
+		#-- Decompose the polygon into exterior and interior
+		e, i = markup3dmodule.polydecomposer(poly)
+		#-- Points forming the exterior LinearRing
+		epoints = markup3dmodule.GMLpoints(e[0])
 	#-- Clean recurring points, except the last one
 	last_ep = epoints[-1]
-	epoints_clean = list(remove_reccuring(epoints))
+	epoints_clean = list(remove_reccuring(epoints, WELD))
 	epoints_clean.append(last_ep)
 	# print epoints
 	# print epoints_clean
@@ -109,79 +190,891 @@ def poly_to_obj(poly, cl, material=None):
 	#-- LinearRing(s) forming the interior
 	irings = []
 	for iring in i:
-		ipoints = markup3dmodule.GMLpoints(iring)
+		if isinstance(poly, cityjson3dmodule.Surface):
+			ipoints = iring
+		else:
+			ipoints = markup3dmodule.GMLpoints(iring)
 		#-- Clean them in the same manner as the exterior ring
 		last_ip = ipoints[-1]
-		ipoints_clean = list(remove_reccuring(ipoints))
+		ipoints_clean = list(remove_reccuring(ipoints, WELD))
 		ipoints_clean.append(last_ip)		
 		irings.append(ipoints_clean)
-	#-- If the polygon validation option is enabled
-	if VALIDATION:
-		#-- Check the polygon
-		valid = polygon3dmodule.isPolyValid(epoints_clean, True)
-		if valid:
-			for iring in irings:
-				if not polygon3dmodule.isPolyValid(iring, False):
-					valid = False
-		#-- If everything is valid send them to the Delaunay triangulation
-		if valid:
-			if SKIPTRI:
-				#-- Triangulation is skipped, polygons are converted directly to faces
-				#-- The last point is removed since it's equal to the first one
-				t = [epoints_clean[:-1]]
-			else:
-				#-- Triangulate polys
-				# t = polygon3dmodule.triangulation(epoints, irings)
+	return epoints_clean, irings
+
+
+def prepare_object(ob, polys, parsed_ahead=None):
+	"""Starts the conversion of a city object: its polygons are parsed and validated with parse_object(), and the
+	triangles of the previous object are released."""
+	global parsed
+	global invalid
+	global triangles
+	global current_object
+	current_object = ob
+	triangles = {}
+	parsed, invalid = parse_object(ob, polys, parsed_ahead)
+
+
+def parse_object(ob, polys, parsed_ahead=None):
+	"""Parses all polygons of a city object (or of a prototype of implicit geometries) at once, and if the validation is
+	invoked validates all their rings in one batch. The invalid polygons are stored in the validation report with their
+	gml:id and the reasons. Polygons already parsed by geometry() are taken from parsed_ahead.
+	Returns the parsed polygons and the set of the invalid ones."""
+	global validation_report
+	global ninvalid
+	parsed = {}
+	invalid = set()
+	rings = []
+	owners = []
+	for poly in polys:
+		if parsed_ahead is not None:
+			if poly not in parsed_ahead:
+				continue
+			parsed[poly] = parsed_ahead[poly]
+		else:
+			try:
+				parsed[poly] = parse_polygon(poly)
+			except Exception:
+				#-- Left to poly_to_obj, which fails as it did before
+				continue
+		if VALIDATION:
+			epoints_clean, irings = parsed[poly]
+			rings.append(epoints_clean)
+			owners.append((poly, 'exterior'))
+			for idx, iring in enumerate(irings):
+				rings.append(iring)
+				owners.append((poly, 'interior %d' % idx))
+	if not VALIDATION or not rings:
+		return parsed, invalid
+	for (poly, ring), reasons in zip(owners, polygon3dmodule.validate_rings(rings)):
+		if not reasons:
+			continue
+		invalid.add(poly)
+		polyid = polygon_id(poly)
+		for reason in reasons:
+			validation_report.append([str(ob), polyid, ring, reason])
+	ninvalid += len(invalid)
+	return parsed, invalid
+
+
+def object_lod(o):
+	"""Level of detail of the geometries to extract from the city object, None for all."""
+	if LODSELECT == 'auto':
+		if CITYJSON:
+			return o.highest_lod()
+		return markup3dmodule.highestLOD(o, index)
+	return LODSELECT
+
+
+def object_polygons(o, lod=None):
+	"""Polygons of a city object of CityGML (gml:Polygon elements) or of CityJSON (surfaces), with a lod only the ones in that level of detail."""
+	if CITYJSON:
+		return o.polygons(lod)
+	return markup3dmodule.polygonFinder(o, index, lod)
+
+
+def object_id(o):
+	"""Identifier of a city object, an empty string if it has none."""
+	if CITYJSON:
+		return o.id
+	oid = o.xpath("@g:id", namespaces={'g' : ns_gml})
+	if oid:
+		return oid[0]
+	return ''
+
+
+def polygon_id(poly):
+	"""Identifier of a polygon, an empty string if it has none. The surfaces of CityJSON are identified by their city object
+	and the numbers of their geometry and of the surface in it."""
+	if isinstance(poly, cityjson3dmodule.Surface):
+		return poly.id
+	polyid = poly.xpath("@g:id", namespaces={'g' : ns_gml})
+	if polyid:
+		return polyid[0]
+	return ''
+
+
+def geometry(objects):
+	"""Yields the city objects with their level of detail and polygons, parsed and triangulated ahead:
+	(object, lod, polygons, parsed, triangles).
+	With the workers the triangulation of the next objects runs in the pool while the current one is converted,
+	otherwise the polygons are parsed and triangulated later in prepare_object() and rings_to_obj()."""
+	if POOL is None or SKIPTRI or SIMPLIFY or METRICS == 2:
+		for o in objects:
+			lod = object_lod(o)
+			yield o, lod, object_polygons(o, lod), None, None
+		return
+	def jobs():
+		for o in objects:
+			lod = object_lod(o)
+			polys = object_polygons(o, lod)
+			parsed_ahead = {}
+			for poly in polys:
 				try:
-					t = polygon3dmodule.triangulation(epoints_clean, irings)
-				except:
-					t = []
-			#-- Process the triangles/polygons
-			for tri in t:
-				#-- Face marker
-				f = "f "
-				#-- For each point in the triangle/polygon (face) get the index "v" or add it to the index
-				for ep in range(0, len(tri)):
-					v, local_vertices[cl] = get_index(tri[ep], local_vertices[cl], len(vertices[cl]))
-					f += str(v) + " "
-				#-- Add the material if invoked
-				if material:
-					face_output[cl].append("usemtl " + str(mtl(material, min_value, max_value, res)) + str("\n"))
-				#-- Store all together
-				face_output[cl].append(f + "\n")
+					parsed_ahead[poly] = parse_polygon(poly)
+				except Exception:
+					continue
+			#-- The large polygons are left to the watchdog
+			keys = [poly for poly in polys if poly in parsed_ahead and not (BUDGET and polygon_points(*parsed_ahead[poly]) >= BUDGET_POINTS)]
+			yield (o, lod, polys, parsed_ahead, keys), [parsed_ahead[poly] for poly in keys]
+	for (o, lod, polys, parsed_ahead, keys), t in pipeline3dmodule.ordered_map(POOL, pipeline3dmodule.triangulate_rings, jobs(), QUEUE, polygon3dmodule.BACKEND):
+		yield o, lod, polys, parsed_ahead, dict(zip(keys, t))
+
+
+def pretriangulated(tris):
+	"""Stores the triangles computed by the workers for the current object in the caches used by rings_to_obj().
+	The polygons which failed are triangulated again by rings_to_obj()."""
+	for poly, t in tris.items():
+		if t is None:
+			continue
+		if poly in shared:
+			shared_triangles.setdefault(poly, t)
 		else:
-			# Get the gml:id of the Polygon if it exists
-			polyid = poly.xpath("@g:id", namespaces={'g' : ns_gml})
-			if polyid:
-				polyid = polyid[0]
-				print "\t\t!! Detected an invalid polygon (%s). Skipping..." %polyid
+			triangles[poly] = t
+
+
+def obj_chunks(head, list_vertices, faces, list_texcoords, index_path=None, classes=None):
+	"""Produces the text of an OBJ: the header, the vertices, the texture coordinates and the faces.
+	With index_path the index of its objects (see obj3dmodule.object_index()) is written there as JSON, with the classes of the objects."""
+	if ATTRIBUTE or TEXTURES:
+		faces = obj3dmodule.group_materials(faces)
+	def parts():
+		yield ''.join(head)
+		yield "\n" + obj3dmodule.format_vertices(list_vertices, PRECISION)
+		yield obj3dmodule.format_texcoords(list_texcoords)
+		yield "\n" + obj3dmodule.format_faces(faces)
+	#-- Byte offsets of the lines of each part, for the index
+	starts = [[0]]
+	for text in parts():
+		yield text
+		if index_path is not None:
+			starts.append(obj3dmodule.line_offsets(text, starts[-1][-1]))
+	if index_path is not None:
+		index = {'obj' : os.path.basename(index_path)[:-len(".index.json")] + ".obj", 'vertices' : len(list_vertices), 'objects' : obj3dmodule.object_index(faces, starts[4], starts[2], list_vertices, classes)}
+		with open(index_path, "w") as index_file:
+			json.dump(index, index_file)
+
+
+def parsed_sources(sources, ranges):
+	"""Reads and parses the CityGML file(s), decompressing them on the fly, and yields them as (name, path, tree, range),
+	where range is the [start, end) range of the cityObjectMembers to convert, or None for all.
+	The CityJSON files are read into a cityjson3dmodule.CityModel instead of a tree."""
+	for (name, path, member), objects in zip(sources, ranges):
+		with markup3dmodule.GMLopen(path, member) as source:
+			if markup3dmodule.isCityJSON(path, member):
+				tree = cityjson3dmodule.read(source)
 			else:
-				print "\t\t!! Detected an invalid polygon. Skipping..."
-			
+				tree = etree.parse(source)
+		yield name, path, tree, objects
+
+
+def poly_to_obj(poly, cl, material=None):
+	"""Main conversion function of one polygon to one or more faces in OBJ,
+	in a specific semantic class. Supports assigning a material."""
+	global pending
+	global pending_kept
+	#-- The polygons of the object are already parsed and validated in prepare_object()
+	if poly in parsed:
+		epoints_clean, irings = parsed[poly]
+	else:
+		epoints_clean, irings = parse_polygon(poly)
+	#-- Invalid polygons are skipped, the valid ones are sent to the Delaunay triangulation
+	if VALIDATION and poly in invalid:
+		return
+	#-- Coincident faces are counted, and removed unless they are only reported
+	if COINCIDENT and poly in coincident:
+		ncoincident[cl] = ncoincident.get(cl, 0) + 1
+		if COINCIDENT == 1:
+			return
+	#-- With the simplification the polygons are collected and merged when the object is finished
+	#-- The textured polygons are not merged, since their texture coordinates would be lost
+	if SIMPLIFY and not (TEXTURES and poly in appearance):
+		pending.setdefault(cl, []).append((epoints_clean, irings, material))
+		return
+	#-- Their points are kept in the merged polygons, so they are not left with T-junctions
+	if SIMPLIFY:
+		pending_kept.append((epoints_clean, irings))
+	rings_to_obj(epoints_clean, irings, cl, material, poly)
+
+
+def rings_to_obj(epoints_clean, irings, cl, material=None, key=None):
+	"""Converts the exterior and interior rings of a polygon to one or more faces in OBJ.
+	The triangles are cached under the key (the polygon), so a polygon written in several classes or
+	referenced by several objects is triangulated once."""
+	global local_vertices
+	global local_grid
+	global vertices
+	global face_output
+	global ntriangles
+	#-- With the global welding the vertices are indexed directly in the dataset-level list
+	if local_vertices[cl] is vertices[cl]:
+		shift = 0
+	else:
+		shift = len(vertices[cl])
+	if SKIPTRI:
+		#-- Triangulation is skipped, polygons are converted directly to faces
+		#-- The last point is removed since it's equal to the first one, and the holes are joined to the exterior with bridge edges
+		t = [polygon3dmodule.keyhole(epoints_clean, irings)]
+	elif key is not None and key in triangles:
+		t = triangles[key]
+	elif key is not None and key in shared_triangles:
+		t = shared_triangles[key]
 	else:
-		#-- Do exactly the same, but without the validation
+		#-- Triangulate polys
+		t = triangulate(epoints_clean, irings, key)
+		if key in shared:
+			shared_triangles[key] = t
+		elif key is not None:
+			triangles[key] = t
+	if not SKIPTRI:
+		ntriangles += len(t)
+	#-- Add the material if invoked, once for all faces of the polygon. The faces are grouped by material when the OBJ is written
+	if material and t:
+		face_output[cl].append("usemtl " + str(mtl(material, min_value, max_value, res)) + str("\n"))
+	#-- Or the material of the appearance, with the texture coordinates of the rings
+	ring_points = None
+	if TEXTURES and t:
+		name, image, ring_points, ring_uvs = polygon_appearance(key)
+		face_output[cl].append("usemtl " + name + "\n")
+	#-- The points of a CityJSON surface are the vertices of the file, which are already unique, so they are indexed by their number
+	ids = None
+	if isinstance(key, cityjson3dmodule.Surface) and not WELD and t:
+		ids = iter(key.vertex_ids([point for tri in t for point in tri]))
+	#-- Process the triangles/polygons
+	for tri in t:
+		#-- Face, formatted when the OBJ is written
+		f = []
+		#-- For each point in the triangle/polygon (face) get the index "v" or add it to the index
+		for ep in range(0, len(tri)):
+			if ids is not None:
+				vi = next(ids)
+			else:
+				vi = None
+			if vi is not None:
+				v = file_vertex(vi, key.vertices, cl)
+			else:
+				v, local_vertices[cl] = get_index(tri[ep], local_vertices[cl], shift, local_grid[cl])
+			f.append(v)
+		#-- The welding can snap the corners of a sliver triangle to one vertex
+		if len(set(f)) < 3:
+			continue
+		#-- Index "vt" of the texture coordinates of each point
+		if ring_points:
+			f = obj3dmodule.TexturedFace(f, [get_texcoord(uv, image, cl) for uv in polygon3dmodule.texture_coordinates(tri, ring_points, ring_uvs)])
+		#-- Store all together
+		face_output[cl].append(f)
+
+
+def polygon_points(epoints_clean, irings):
+	"""Number of points of the rings of a polygon."""
+	return len(epoints_clean) + sum(len(iring) for iring in irings)
+
+
+def triangulate(epoints_clean, irings, key=None, ob=None):
+	"""Triangulates a polygon with the backend. Without the budget a polygon which fails gets no triangles.
+	With the budget the large polygons are triangulated in the watchdog process within the time budget, and the polygons
+	which fail or run out of time are triangulated with earcut, or as a fan if earcut fails too or is the backend and the
+	polygon is convex without holes, otherwise they get no triangles. They are recorded in the report of the triangulation
+	with the polygon (key) and the object (ob), by default the one of prepare_object()."""
+	if not BUDGET:
 		try:
+			return polygon3dmodule.triangulation(epoints_clean, irings)
+		except:
+			return []
+	npoints = polygon_points(epoints_clean, irings)
+	try:
+		if npoints >= BUDGET_POINTS:
+			return WATCHDOG.run(BUDGET, polygon3dmodule.triangulation, epoints_clean, irings, polygon3dmodule.BACKEND)
+		return polygon3dmodule.triangulation(epoints_clean, irings)
+	except multiprocessing.TimeoutError:
+		reason = "over the time budget of %s s" % BUDGET
+	except Exception as e:
+		reason = "%s: %s" % (type(e).__name__, e)
+	t = []
+	fallback = 'none'
+	for backend in ['earcut', 'fan']:
+		if backend == polygon3dmodule.BACKEND or (backend == 'earcut' and polygon3dmodule.mapbox_earcut is None):
+			continue
+		try:
+			if backend == 'earcut':
+				t = polygon3dmodule.triangulation_earcut(epoints_clean, irings)
+			else:
+				t = polygon3dmodule.triangulation_fan(epoints_clean, irings)
+			fallback = backend
+			break
+		except Exception:
+			continue
+	if key is None:
+		polyid = ''
+	else:
+		polyid = polygon_id(key)
+	if ob is None:
+		ob = current_object
+	triangulation_report.append([str(ob), polyid, npoints, reason, fallback, len(t)])
+	return t
+
+
+def file_vertex(vi, file_vertices, cl):
+	"""Index (one-based) of the vertex vi of the CityJSON file in the vertices of the class, added if it is not there yet.
+	The vertices of CityJSON are shared by all objects of the file, like with the global welding."""
+	global vertex_map
+	if vi not in vertex_map[cl]:
+		vertex_map[cl][vi] = mesh3dmodule.weld_insert(file_vertices[vi].tolist(), local_grid[cl], local_vertices[cl]) + 1
+	return vertex_map[cl][vi]
+
+
+def implicit_to_obj(implicit, cl):
+	"""Converts an instance of an implicit geometry to faces in OBJ.
+	The prototype is triangulated once and cached, and each instance transforms its vertices at once."""
+	global local_vertices
+	global local_grid
+	global vertices
+	global face_output
+	global prototypes
+	global ninstances
+	prototype, matrix, referencepoint = markup3dmodule.implicitGeometry(implicit, index)
+	if prototype is None:
+		return
+	if prototype not in prototypes:
+		#-- Vertices (in local coordinates) and faces of the prototype
+		pvertices = []
+		pgrid = {}
+		pfaces = []
+		pid = prototype.xpath("@g:id", namespaces={'g' : ns_gml})
+		if pid:
+			pid = pid[0]
+		else:
+			pid = ''
+		polys = markup3dmodule.polygonFinder(prototype, index)
+		#-- The polygons of the prototype are kept apart from the ones of the object being converted
+		pparsed, pinvalid = parse_object(pid, polys)
+		for poly in polys:
+			if poly not in pparsed or (VALIDATION and poly in pinvalid):
+				continue
+			epoints_clean, irings = pparsed[poly]
 			if SKIPTRI:
-				t = [epoints_clean[:-1]]
+				t = [polygon3dmodule.keyhole(epoints_clean, irings)]
 			else:
-				t = polygon3dmodule.triangulation(epoints_clean, irings)
-		except:
-			t = []
-		for tri in t:
-			f = "f "
-			for ep in range(0, len(tri)):
-				v, local_vertices[cl] = get_index(tri[ep], local_vertices[cl], len(vertices[cl]))
-				f += str(v) + " "   
-			if material:
-				face_output[cl].append("usemtl " + str(mtl(material, min_value, max_value, res)) + str("\n"))
-			face_output[cl].append(f + "\n")
+				t = triangulate(epoints_clean, irings, poly, pid)
+			for tri in t:
+				face = []
+				for point in tri:
+					idx = mesh3dmodule.weld_lookup(point, pgrid, pvertices)
+					if idx is None:
+						idx = mesh3dmodule.weld_insert(point, pgrid, pvertices)
+					face.append(idx)
+				pfaces.append(face)
+		prototypes[prototype] = (np.array(pvertices, dtype=np.float64).reshape(-1, 3), pfaces)
+	pvertices, pfaces = prototypes[prototype]
+	if not pfaces:
+		return
+	ninstances += 1
+	#-- Transform all vertices of the prototype at once
+	matrix = np.array(matrix)
+	world = (np.dot(pvertices, matrix[:3, :3].T) + matrix[:3, 3] + np.array(referencepoint)).tolist()
+	if local_vertices[cl] is vertices[cl]:
+		shift = 0
+	else:
+		shift = len(vertices[cl])
+	indices = []
+	for point in world:
+		v, local_vertices[cl] = get_index(point, local_vertices[cl], shift, local_grid[cl])
+		indices.append(v)
+	#-- The appearances of the prototypes are not converted
+	if TEXTURES:
+		face_output[cl].append("usemtl default\n")
+	for face in pfaces:
+		f = [indices[idx] for idx in face]
+		if len(set(f)) >= 3:
+			face_output[cl].append(f)
+
+
+def check_watertight(ob, start):
+	"""Checks if the faces of a building, the ones added to the plain OBJ since start, form a closed 2-manifold shell and reports it.
+	The faces of the buildings which are not watertight are removed from all classes (option 2), or moved to the class Open (option 3).
+	Returns True if the building was removed."""
+	global nwatertight
+	faces = [f for f in face_output['All'][start['All']:] if isinstance(f, list)]
+	nedges, boundary, nonmanifold, conflicts = mesh3dmodule.edge_topology(faces)
+	closed = len(faces) > 0 and not (boundary or nonmanifold or conflicts)
+	watertight_report.append([str(ob), len(faces), nedges, boundary, nonmanifold, conflicts, int(closed)])
+	if closed:
+		nwatertight += 1
+		return False
+	if WATERTIGHT == 3:
+		for line in face_output['All'][start['All']:]:
+			face_output['Open'].append(open_face(line))
+	if WATERTIGHT in (2, 3):
+		for cl in start:
+			del face_output[cl][start[cl]:]
+			#-- The vertices of the building are dropped, unless they are already in the dataset-level list
+			if cl in local_vertices and local_vertices[cl] is not vertices[cl]:
+				local_vertices[cl] = []
+				local_grid[cl] = {}
+	return WATERTIGHT == 2
+
+
+def block_to_obj(b, polys, cl):
+	"""Converts a building to an LOD1 block in the class: a prism of its footprint (see polygon3dmodule.footprint()), the union
+	of its GroundSurface polygons or without them the convex hull of its points, from its lowest ground point up to its
+	bldg:measuredHeight, or without it up to its highest roof point. Only the footprint is triangulated, for the caps."""
+	global local_vertices
+	global face_output
+	classes = classify_polygons(b)
+	rings = [parsed[p] for p in polys if p in parsed and not (VALIDATION and p in invalid)]
+	ground = [parsed[p] for p in polys if p in parsed and classes.get(p) == 'GroundSurface']
+	roof = [parsed[p] for p in polys if p in parsed and classes.get(p) == 'RoofSurface']
+	points = [point for e, i in rings for point in e]
+	if not points:
+		return
+	base = min(point[2] for e, i in (ground or rings) for point in e)
+	height = object_attribute(b, 'measuredHeight', ns_bldg)
+	if height:
+		top = base + height
+	else:
+		top = max(point[2] for e, i in (roof or rings) for point in e)
+	if top <= base:
+		return
+	triangles = []
+	for exterior, interiors in polygon3dmodule.footprint(ground, points):
+		cap = triangulate([[x, y, top] for x, y in exterior + exterior[:1]], [[[x, y, top] for x, y in r + r[:1]] for r in interiors])
+		for tri in cap:
+			tri = [[point[0], point[1], top] for point in tri]
+			#-- The roof faces up and the bottom down
+			if (tri[1][0] - tri[0][0]) * (tri[2][1] - tri[0][1]) - (tri[1][1] - tri[0][1]) * (tri[2][0] - tri[0][0]) < 0:
+				tri.reverse()
+			triangles.append(tri)
+			triangles.append([[point[0], point[1], base] for point in reversed(tri)])
+		triangles.extend(polygon3dmodule.extrude(exterior, interiors, base, top))
+	if local_vertices[cl] is vertices[cl]:
+		shift = 0
+	else:
+		shift = len(vertices[cl])
+	for tri in triangles:
+		f = []
+		for point in tri:
+			v, local_vertices[cl] = get_index(point, local_vertices[cl], shift, local_grid[cl])
+			f.append(v)
+		if len(set(f)) >= 3:
+			face_output[cl].append(f)
+
+
+def optimise_vertex_cache(start, renumber=True):
+	"""Reorders the triangles of the current object, the ones added to each class since start, for the vertex cache
+	(see mesh3dmodule.vertex_cache_order()). With renumber the vertices of the object in its local list are renumbered in the
+	order they are first used, the ones in the dataset-level list keep their numbers.
+	Returns the order of the faces of the plain OBJ, to keep the cache in step."""
+	order = None
+	for cl in start:
+		lines, faces_order, ntris, before, after = mesh3dmodule.vertex_cache_order(face_output[cl][start[cl]:])
+		acmr['triangles'] += ntris
+		acmr['before'] += before
+		acmr['after'] += after
+		if renumber and local_vertices[cl] is not vertices[cl]:
+			lines, old = mesh3dmodule.renumber_first_use(lines, len(vertices[cl]), len(local_vertices[cl]))
+			local_vertices[cl] = [local_vertices[cl][k] for k in old]
+		face_output[cl][start[cl]:] = lines
+		if cl == 'All':
+			order = faces_order
+	return order
+
+
+def open_face(face):
+	"""Copies a face of the plain OBJ of the current building to the class Open, with the indices of its vertices
+	(and texture coordinates) in that class."""
+	if not isinstance(face, list):
+		return face
+	if local_vertices['All'] is vertices['All']:
+		shift = 0
+	else:
+		shift = len(vertices['All'])
+	moved = [get_index(local_vertices['All'][v - 1 - shift], vertices['Open'], 0, grid['Open'])[0] for v in face]
+	if isinstance(face, obj3dmodule.TexturedFace):
+		moved = obj3dmodule.TexturedFace(moved, [get_texcoord(texcoords['All'][t - 1], texcoords['All'][t - 1][2], 'Open') for t in face.texcoords])
+	return moved
+
+
+def find_coincident(objects):
+	"""Finds the coincident polygons with opposite orientations in the objects, through a hash map of their vertices.
+	With the welding tolerance the vertices are snapped to a grid of that size.
+	Returns {polygon: (its object, the coincident polygon, its object)}."""
+	owners = []
+	def polygons():
+		seen = set()
+		for o in objects:
+			oid = object_id(o)
+			for poly in object_polygons(o, object_lod(o)):
+				if poly in seen:
+					continue
+				seen.add(poly)
+				try:
+					e, i = parse_polygon(poly)
+				except Exception:
+					continue
+				owners.append((oid, poly))
+				yield e, i
+	found = {}
+	for a, b in polygon3dmodule.coincident_pairs(polygons(), WELD):
+		found[owners[a][1]] = (owners[a][0], owners[b][1], owners[b][0])
+		found[owners[b][1]] = (owners[b][0], owners[a][1], owners[a][0])
+	return found
+
+
+def polygon_appearance(poly):
+	"""Material of a polygon from the appearances: its name, and for a texture the image, the points of the rings
+	and their texture coordinates. Polygons without an appearance get the default material."""
+	if poly is None or poly not in appearance:
+		return 'default', None, None, None
+	material, rings = appearance[poly]
+	if rings is None:
+		return material_name(material), None, None, None
+	ring_points = []
+	ring_uvs = []
+	e, i = markup3dmodule.polydecomposer(poly)
+	for ring in e[:1] + i:
+		linear = ring.find('.//{%s}LinearRing' % ns_gml)
+		if linear is None or linear.get('{%s}id' % ns_gml) not in rings:
+			continue
+		points = markup3dmodule.GMLpoints(ring)
+		uvs = rings[linear.get('{%s}id' % ns_gml)]
+		if points is None or len(points) != len(uvs):
+			continue
+		ring_points.extend(points)
+		ring_uvs.extend(uvs)
+	#-- A texture without texture coordinates cannot be mapped
+	if not ring_points:
+		return 'default', None, None, None
+	return material_name(material), material[1], ring_points, ring_uvs
+
+
+def material_name(material):
+	"""Name of a material of the appearances in the material library, derived from the image of a texture."""
+	global materials
+	if material not in materials:
+		kind, value = material
+		if kind == 'texture':
+			name = 'tex_' + re.sub(r'[^A-Za-z0-9]+', '_', value).strip('_')
+		else:
+			name = 'x3d'
+		#-- Unique names
+		used = set(materials.values())
+		unique = name
+		count = 1
+		while unique in used or unique == 'default' or unique.startswith('atlas_'):
+			unique = '%s_%d' % (name, count)
+			count += 1
+		materials[material] = unique
+	return materials[material]
+
+
+def get_texcoord(uv, image, cl):
+	"""Index (one-based) of the texture coordinates of an image in the list of the class, added if they are not there yet."""
+	global texcoords
+	global texcoord_index
+	key = (image, round(uv[0], 9), round(uv[1], 9))
+	if key not in texcoord_index[cl]:
+		texcoords[cl].append([uv[0], uv[1], image])
+		texcoord_index[cl][key] = len(texcoords[cl])
+	return texcoord_index[cl][key]
+
+
+def write_materials(source):
+	"""Writes the material library of the appearances of the file. With the atlases the images are packed into them,
+	and the texture coordinates and the materials of the faces are remapped."""
+	global texcoords
+	global face_output
+	#-- The images are relative to the CityGML file
+	paths = {}
+	for kind, value in materials:
+		if kind == 'texture':
+			if '://' in value:
+				paths[value] = value
+			else:
+				paths[value] = os.path.normpath(os.path.join(os.path.dirname(source), value))
+	placements = {}
+	atlases = []
+	if ATLAS and paths:
+		#-- Repeated textures (with texture coordinates outside [0, 1]) cannot be packed
+		uvs = {}
+		for cl in texcoords:
+			for u, v, image in texcoords[cl]:
+				uvs.setdefault(image, []).append((u, v))
+		candidates = sorted(image for image in paths if image in uvs and os.path.exists(paths[image]) and texture3dmodule.packable(uvs[image]))
+		atlases, packed = texture3dmodule.build_atlases([paths[image] for image in candidates], ATLAS, RESULT + FILENAME + "-atlas")
+		for image, placement in zip(candidates, packed):
+			if placement is not None:
+				placements[image] = placement
+		renamed = {}
+		for image in placements:
+			renamed["usemtl " + materials[('texture', image)] + "\n"] = "usemtl atlas_%d\n" % placements[image][0]
+		for cl in texcoords:
+			texcoords[cl] = [texture3dmodule.atlas_uv(uv, placements[uv[2]]) if uv[2] in placements else uv for uv in texcoords[cl]]
+			face_output[cl] = [line if isinstance(line, list) else renamed.get(line, line) for line in face_output[cl]]
+	with open(RESULT + FILENAME + ".mtl", "w") as mtl_file:
+		mtl_file.write("newmtl default\nKa 0.2 0.2 0.2\nKd 0.8 0.8 0.8\n\n")
+		for a, atlas in enumerate(atlases):
+			mtl_file.write("newmtl atlas_%d\nKa 1 1 1\nKd 1 1 1\nmap_Kd %s\n\n" % (a, atlas))
+		for material, name in sorted(materials.items(), key=lambda item: item[1]):
+			kind, value = material
+			if kind == 'texture':
+				if value in placements:
+					continue
+				if '://' in value:
+					image = value
+				else:
+					image = os.path.relpath(paths[value], RESULT)
+				mtl_file.write("newmtl %s\nKa 1 1 1\nKd 1 1 1\nmap_Kd %s\n\n" % (name, image))
+			else:
+				diffuse, specular, emissive, ambient, shininess, transparency = value
+				mtl_file.write("newmtl %s\n" % name)
+				mtl_file.write("Ka %g %g %g\n" % tuple(ambient * c for c in diffuse))
+				mtl_file.write("Kd %g %g %g\nKs %g %g %g\nKe %g %g %g\n" % (diffuse + specular + emissive))
+				mtl_file.write("Ns %g\nd %g\n\n" % (shininess * 1000.0, 1.0 - transparency))
+	return len(materials), len(placements), len(atlases)
+
+
+def flush_simplified():
+	"""Merges the coplanar polygons collected for the current object, class by class, and converts them to OBJ.
+	Only polygons with the same material are merged, and the points shared with the other faces of the object are kept.
+	The triangles of the polygons before and after the merging are estimated the same way, without the triangulation
+	(see polygon3dmodule.triangle_count())."""
+	global pending
+	global pending_kept
+	global ntriangles_before
+	global ntriangles_after
+	global nsimplify_failed
+	for cl in pending:
+		materials = []
+		for epoints_clean, irings, material in pending[cl]:
+			if material not in materials:
+				materials.append(material)
+		for material in materials:
+			polygons = [(e, i) for e, i, m in pending[cl] if m == material]
+			outside = [(e, i) for other in pending for e, i, m in pending[other] if other != cl or m != material]
+			for e, i in polygons:
+				ntriangles_before += polygon3dmodule.triangle_count(e, i)
+			simplified, failed = polygon3dmodule.simplify_coplanar(polygons, outside=outside + pending_kept)
+			nsimplify_failed += failed
+			for e, i in simplified:
+				ntriangles_after += polygon3dmodule.triangle_count(e, i)
+				rings_to_obj(e, i, cl, material)
+	pending = {}
+	pending_kept = []
+
+
+def classify_polygons(cityobject):
+	"""Semantic class of each polygon of a building, from the thematic boundary it belongs to.
+	Openings are nested in the boundaries, so they override the class of their boundary.
+	The surfaces of CityJSON have their class in their semantics."""
+	classes = {}
+	if CITYJSON:
+		for p in cityobject.polygons():
+			if p.semantics is not None and p.semantics.get('type') in semanticSurfaces:
+				classes[p] = p.semantics['type']
+		return classes
+	for child in cityobject.iter():
+		if not isinstance(child.tag, basestring) or not child.tag.startswith('{%s}' % ns_bldg):
+			continue
+		cl = child.tag[child.tag.index('}') + 1:]
+		if cl in semanticSurfaces:
+			for p in markup3dmodule.polygonFinder(child, index):
+				classes[p] = cl
+	return classes
+
+
+def collect_metrics(ob, polys, classes, default_class):
+	"""Queues the parsed polygons of an object for the metrics, which are computed in batches."""
+	global metrics_pending
+	for poly in polys:
+		if poly not in parsed:
+			continue
+		epoints_clean, irings = parsed[poly]
+		metrics_pending.append((str(ob), polygon_id(poly), classes.get(poly, default_class), epoints_clean, irings))
+	if len(metrics_pending) >= METRICS_BATCH:
+		flush_metrics()
+
+
+def flush_metrics():
+	"""Computes the metrics of the queued polygons at once, and appends them to the columns of the table."""
+	global metrics_pending
+	if not metrics_pending:
+		return
+	areas, normals, azimuths, tilts = polygon3dmodule.surface_metrics([(m[3], m[4]) for m in metrics_pending])
+	metrics['object'].extend([m[0] for m in metrics_pending])
+	metrics['polygon'].extend([m[1] for m in metrics_pending])
+	metrics['class'].extend([m[2] for m in metrics_pending])
+	metrics['area'].append(areas)
+	metrics['nx'].append(normals[:, 0])
+	metrics['ny'].append(normals[:, 1])
+	metrics['nz'].append(normals[:, 2])
+	metrics['azimuth'].append(azimuths)
+	metrics['tilt'].append(tilts)
+	metrics_pending = []
+
+
+def write_metrics(path):
+	"""Writes the table of the metrics as CSV, and as Parquet and Feather if pyarrow is available."""
+	flush_metrics()
+	columns = ['object', 'polygon', 'class', 'area', 'nx', 'ny', 'nz', 'azimuth', 'tilt']
+	table = {}
+	for column in columns:
+		if column in ('object', 'polygon', 'class'):
+			table[column] = metrics[column]
+		elif metrics[column]:
+			table[column] = np.concatenate(metrics[column])
+		else:
+			table[column] = np.zeros(0)
+	with open(path + ".csv", "wb") as metrics_file:
+		writer = csv.writer(metrics_file)
+		writer.writerow(columns)
+		writer.writerows(itertools.izip(*[table[column] if column in ('object', 'polygon', 'class') else table[column].tolist() for column in columns]))
+	if pyarrow is not None:
+		arrow_table = pyarrow.table([table[column] for column in columns], names=columns)
+		pyarrow.parquet.write_table(arrow_table, path + ".parquet")
+		pyarrow.feather.write_feather(arrow_table, path + ".feather")
+
+
+def peak_memory():
+	"""Peak memory (MB) of the main process so far, None where it is not available.
+	It is a running maximum over the whole run, and the workers and the watchdog are not included."""
+	if resource is None:
+		return None
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	#-- In bytes on macOS, in kB elsewhere
+	if sys.platform == 'darwin':
+		peak /= 1024
+	return peak // 1024
+
+
+def object_attribute(o, name, namespace=None):
+	"""Value of a numeric attribute of a city object (e.g. yearlyIrradiation), None if it has not.
+	In CityGML the attribute is in the namespace, the one of CityGML by default."""
+	value = None
+	if CITYJSON:
+		value = o.attributes.get(name)
+	else:
+		for ch in o.getchildren():
+			if ch.tag == "{%s}%s" % (namespace or ns_citygml, name):
+				value = ch.text
+	if value is None:
+		return None
+	return float(value)
+
+
+def polygon_attribute(poly, name):
+	"""Value of a numeric attribute of a polygon (e.g. irradiation), None if it has not."""
+	value = None
+	if isinstance(poly, cityjson3dmodule.Surface):
+		if poly.semantics is not None:
+			value = poly.semantics.get(name)
+	else:
+		for ch in poly.getchildren():
+			if ch.tag == "{%s}%s" % (ns_citygml, name):
+				value = ch.text
+	if value is None:
+		return None
+	return float(value)
+
+
+def new_faces(cl, start):
+	"""Number of faces of the class from the position start of its lines."""
+	return sum(1 for line in face_output[cl][start:] if isinstance(line, list))
+
+
+def write_cache(path):
+	"""Writes the faces of the buildings and of the other objects of the current file to its cache (see cache3dmodule),
+	with the object, semantic class and attributes of each face, so the OBJs can be exported again with other options."""
+	records = cache_faces['All'] + cache_faces['Other']
+	columns = {}
+	columns['object'] = [r[0] for r in records]
+	columns['class'] = [r[1] for r in records]
+	columns['irradiation'] = [np.nan if r[2] is None else r[2] for r in records]
+	columns['totalIrradiation'] = [np.nan if r[3] is None else r[3] for r in records]
+	meta = {'source' : FILENAME, 'classes' : semanticSurfaces, 'triangulated' : not SKIPTRI}
+	meta['objects'] = [o[0] for o in cache_objects]
+	meta['types'] = [o[1] for o in cache_objects]
+	meta['yearlyIrradiation'] = [o[2] for o in cache_objects]
+	meta['polygons'] = [o[3] for o in cache_objects]
+	parts = []
+	for cl in ['All', 'Other']:
+		parts.append((vertices[cl], [line for line in face_output[cl] if isinstance(line, list)]))
+	cache3dmodule.write(path, parts, columns, meta)
+
+
+def export_cache(name, path):
+	"""Writes the OBJs of a file from its cache with the current options (-s, -g, -a, -t, --precision and --index),
+	without parsing or triangulating it. The vertices are numbered in the order they are first used, as in the conversion."""
+	cache_vertices, indices, offsets, columns, meta = cache3dmodule.read(path)
+	objects = meta['objects']
+	face_objects = np.asarray(columns['object'])
+	face_classes = np.asarray(columns['class'])
+	buildings = np.asarray([t == 'Building' for t in meta['types']], dtype=bool)[face_objects] if objects else np.zeros(0, dtype=bool)
+	yearly = meta['yearlyIrradiation']
+	#-- Classes of the polygons of the buildings for the index
+	object_classes = dict(zip(objects, meta['polygons']))
+	selections = [('All', buildings)]
+	if SEMANTICS:
+		for k, cl in enumerate(meta['classes']):
+			selections.append((cl, buildings & (face_classes == k)))
+	selections.append(('Other', ~buildings))
+	outputs = []
+	for cl, mask in selections:
+		selected = np.flatnonzero(mask)
+		if not len(selected):
+			continue
+		flat, lengths = cache3dmodule.face_vertices(indices, offsets, selected)
+		used, local = cache3dmodule.compact(flat)
+		local = local.tolist()
+		ends = np.cumsum(lengths).tolist()
+		lines = []
+		current = None
+		for f, o, start, end in itertools.izip(selected.tolist(), face_objects[selected].tolist(), [0] + ends[:-1], ends):
+			#-- Only the buildings are objects
+			if OBJECTS and cl != 'Other' and o != current:
+				lines.append('o ' + objects[o] + '\n')
+				current = o
+			if ATTRIBUTE:
+				if cl == 'All' or (cl == 'RoofSurface' and ATTRIBUTE == 3):
+					material = yearly[o]
+				elif cl == 'RoofSurface':
+					material = columns[{1 : 'irradiation', 2 : 'totalIrradiation'}[ATTRIBUTE]][f]
+					if np.isnan(material):
+						material = None
+				else:
+					material = None
+				if material:
+					lines.append("usemtl " + str(mtl(material, min_value, max_value, res)) + "\n")
+			lines.append(local[start:end])
+		if cl == 'Other':
+			head = []
+		else:
+			head = [header]
+			if ATTRIBUTE:
+				head.append("mtllib colormap.mtl\n")
+		outputs.append((cl, head, np.array(cache_vertices[used], dtype=np.float64), lines))
+	#-- Translate the vertices of all OBJs so the smallest one is at zero
+	if TRANSLATE and outputs:
+		used_vertices = np.concatenate([o[2] for o in outputs])
+		smallest_vtx = used_vertices[np.lexsort(used_vertices.T[::-1])[0]]
+		for o in outputs:
+			o[2][:] -= smallest_vtx
+	for cl, head, list_vertices, lines in outputs:
+		if cl == 'All':
+			adj_suffix = ""
+		else:
+			adj_suffix = "-" + str(cl)
+		if INDEX:
+			index_path = RESULT + name + adj_suffix + ".index.json"
+		else:
+			index_path = None
+		WRITER.write(RESULT + name + adj_suffix + ".obj", obj_chunks, head, list_vertices, lines, [], index_path, object_classes)
+	return len(outputs)
 
 #-- Parse command-line arguments
 PARSER = argparse.ArgumentParser(description='Convert a CityGML to OBJ.')
 PARSER.add_argument('-i', '--directory',
-	help='Directory containing CityGML file(s).', required=True)
+	help='Directory containing CityGML file(s).', required=False)
 PARSER.add_argument('-o', '--results',
-	help='Directory where the OBJ file(s) should be written.', required=True)
+	help='Directory where the OBJ file(s) should be written.', required=False)
 PARSER.add_argument('-s', '--semantics',
 	help='Write one OBJ (0) or multiple OBJ per semantic class (1). 0 is default.', required=False)
 PARSER.add_argument('-g', '--grouping',
@@ -194,9 +1087,87 @@ PARSER.add_argument('-t', '--translate',
 	help='Translates all vertices, so that the smallest vertex is at zero. No translation is default.', required=False)
 PARSER.add_argument('-p', '--polypreserve',
 	help='Skip the triangulation (preserve polygons). Triangulation is default.', required=False)
+PARSER.add_argument('--weld-tolerance',
+	help='Welds vertices closer than this distance into one vertex. Only identical vertices are merged by default.', required=False)
+PARSER.add_argument('--global-weld',
+	help='Shares the vertices across all buildings in the file (1). Vertices are shared only within a building (0) by default.', required=False)
+PARSER.add_argument('--weld-memory',
+	help='Size cap in MB (estimated) of the spatial hash of the global welding before falling back to an external sort. 1024 is default.', required=False)
+PARSER.add_argument('--simplify',
+	help='Merges adjacent coplanar polygons before the triangulation (1). No simplification is default.', required=False)
+PARSER.add_argument('--precision',
+	help='Number of decimals of the coordinates, e.g. 3 for millimetres. 12 significant digits are written by default.', required=False)
+PARSER.add_argument('--metrics',
+	help='Writes a table with the area, normal, azimuth and tilt of each polygon (1), or only the table without the OBJs (2). No table is default.', required=False)
+PARSER.add_argument('--triangulator',
+	help='Triangulation backend: triangle or earcut. Triangle is default.', required=False)
+PARSER.add_argument('--budget',
+	help='Time budget in seconds for the triangulation of a large polygon, which runs in a separate process. The failed polygons are triangulated with a fallback and reported. No budget is default.', required=False)
+PARSER.add_argument('--benchmark',
+	help='Compares the triangulation backends on the polygons of each file (1), without writing the OBJs. No benchmark is default.', required=False)
+PARSER.add_argument('--pipeline',
+	help='Parses the next file and writes the OBJs in the background (1). Sequential processing is default.', required=False)
+PARSER.add_argument('--workers',
+	help='Number of worker processes for the triangulation. Triangulation in the main process is default.', required=False)
+PARSER.add_argument('--queue-size',
+	help='Bound of the queues of the pipeline and of the workers. 16 is default.', required=False)
+PARSER.add_argument('--auto',
+	help='Memory budget in MB within which the workers, the pipeline and the queue size are chosen from a scan of the files. No planning is default.', required=False)
+PARSER.add_argument('--textures',
+	help='Converts the textures and materials of the appearances (1). No appearances are converted by default.', required=False)
+PARSER.add_argument('--theme',
+	help='Theme of the appearances to convert. The first theme found is default.', required=False)
+PARSER.add_argument('--atlas',
+	help='Packs the texture images into atlases of this size in pixels. No atlases are made by default.', required=False)
+PARSER.add_argument('--blocks',
+	help='Writes also an LOD1 block model with a prism of the footprint of each building (1). No block model is default.', required=False)
+PARSER.add_argument('--vertex-cache',
+	help='Reorders the triangles of each object for the vertex cache and renumbers the vertices in the order they are used (1). The faces are in the order of the polygons by default.', required=False)
+PARSER.add_argument('--watertight',
+	help='Checks if each building is a closed shell and writes a report (1), and skips (2) or writes separately (3) the buildings which are not. No check is default.', required=False)
+PARSER.add_argument('--index',
+	help='Writes an index of the buildings (byte ranges, bounding box, classes) next to each OBJ (1), requires -g 1. No index is default.', required=False)
+PARSER.add_argument('--cache',
+	help='Saves the triangulated geometry of each file in a cache for the export (1). No cache is default.', required=False)
+PARSER.add_argument('--export',
+	help='Writes the OBJs from the caches in the input directory (1) instead of converting the CityGML files.', required=False)
+PARSER.add_argument('--coincident',
+	help='Removes the coincident faces with opposite orientations (1), or only reports them (2). They are kept by default.', required=False)
+PARSER.add_argument('--lod',
+	help='Extracts only the geometries in this level of detail (0-4), or the highest one of each object (auto). All geometries are extracted by default.', required=False)
+PARSER.add_argument('--plan',
+	help='Splits the input into this number of shards and writes their manifests to the output directory.', required=False)
+PARSER.add_argument('--shard',
+	help='Manifest of the shard to convert, written by --plan.', required=False)
+PARSER.add_argument('--merge',
+	help='Merges the converted shards planned in the output directory (1).', required=False)
 ARGS = vars(PARSER.parse_args())
-DIRECTORY = os.path.join(ARGS['directory'], '')
-RESULT = os.path.join(ARGS['results'], '')
+
+PLAN = ARGS['plan']
+if PLAN:
+	PLAN = int(PLAN)
+else:
+	PLAN = None
+
+SHARD = ARGS['shard']
+
+MERGE = ARGS['merge']
+if MERGE == '1':
+	MERGE = True
+elif MERGE == '0':
+	MERGE = False
+else:
+	MERGE = False
+
+#-- The input and the output of a shard are in its manifest
+if not ARGS['directory'] and not (SHARD or MERGE):
+	PARSER.error("the input directory (-i) is required")
+if not ARGS['results'] and not SHARD:
+	PARSER.error("the output directory (-o) is required")
+if ARGS['directory']:
+	DIRECTORY = os.path.join(ARGS['directory'], '')
+if ARGS['results']:
+	RESULT = os.path.join(ARGS['results'], '')
 
 SEMANTICS = ARGS['semantics']
 if SEMANTICS == '1':
@@ -243,6 +1214,8 @@ else:
 	TRANSLATE = False
 if TRANSLATE:
 	global smallest_point
+	if SHARD:
+		PARSER.error("the translation (-t 1) is not supported for shards, since each shard would be translated separately")
 
 SKIPTRI = ARGS['polypreserve']
 if SKIPTRI == '1':
@@ -252,6 +1225,214 @@ elif SKIPTRI == '0':
 else:
 	SKIPTRI = False
 
+WELD = ARGS['weld_tolerance']
+if WELD:
+	WELD = float(WELD)
+	if WELD <= 0.0:
+		WELD = None
+else:
+	WELD = None
+
+GLOBALWELD = ARGS['global_weld']
+if GLOBALWELD == '1':
+	GLOBALWELD = True
+elif GLOBALWELD == '0':
+	GLOBALWELD = False
+else:
+	GLOBALWELD = False
+
+WELDMEMORY = ARGS['weld_memory']
+if WELDMEMORY:
+	WELDMEMORY = float(WELDMEMORY) * 1024 * 1024
+else:
+	WELDMEMORY = 1024.0 * 1024 * 1024
+
+SIMPLIFY = ARGS['simplify']
+if SIMPLIFY == '1':
+	SIMPLIFY = True
+elif SIMPLIFY == '0':
+	SIMPLIFY = False
+else:
+	SIMPLIFY = False
+
+PRECISION = ARGS['precision']
+if PRECISION:
+	PRECISION = int(PRECISION)
+else:
+	PRECISION = None
+
+METRICS = ARGS['metrics']
+if METRICS == '1':
+	METRICS = 1
+elif METRICS == '2':
+	METRICS = 2
+elif METRICS == '0':
+	METRICS = False
+else:
+	METRICS = False
+
+TRIANGULATOR = ARGS['triangulator']
+if TRIANGULATOR:
+	if TRIANGULATOR not in polygon3dmodule.TRIANGULATORS:
+		PARSER.error("unknown triangulator %s, use one of: %s" % (TRIANGULATOR, ', '.join(sorted(polygon3dmodule.TRIANGULATORS))))
+	if TRIANGULATOR == 'earcut' and polygon3dmodule.mapbox_earcut is None:
+		PARSER.error("the earcut triangulator requires the mapbox_earcut package")
+	polygon3dmodule.BACKEND = TRIANGULATOR
+
+BUDGET = ARGS['budget']
+if BUDGET:
+	BUDGET = float(BUDGET)
+else:
+	BUDGET = None
+
+BENCHMARK = ARGS['benchmark']
+if BENCHMARK == '1':
+	BENCHMARK = True
+elif BENCHMARK == '0':
+	BENCHMARK = False
+else:
+	BENCHMARK = False
+
+TEXTURES = ARGS['textures']
+if TEXTURES == '1':
+	TEXTURES = True
+elif TEXTURES == '0':
+	TEXTURES = False
+else:
+	TEXTURES = False
+if TEXTURES and ATTRIBUTE:
+	PARSER.error("the textures cannot be combined with the colour attributes (-a)")
+if TEXTURES and SHARD:
+	PARSER.error("the textures are not supported for shards")
+
+THEME = ARGS['theme']
+
+ATLAS = ARGS['atlas']
+if ATLAS and TEXTURES:
+	ATLAS = int(ATLAS)
+	if texture3dmodule.Image is None:
+		PARSER.error("the atlases require the Pillow package")
+else:
+	ATLAS = None
+
+BLOCKS = ARGS['blocks']
+if BLOCKS == '1':
+	BLOCKS = True
+elif BLOCKS == '0':
+	BLOCKS = False
+else:
+	BLOCKS = False
+
+VERTEXCACHE = ARGS['vertex_cache']
+if VERTEXCACHE == '1':
+	VERTEXCACHE = True
+elif VERTEXCACHE == '0':
+	VERTEXCACHE = False
+else:
+	VERTEXCACHE = False
+if VERTEXCACHE and SKIPTRI:
+	PARSER.error("the vertex cache optimisation reorders triangles, which are not made with -p 1")
+
+WATERTIGHT = ARGS['watertight']
+if WATERTIGHT == '1':
+	WATERTIGHT = 1
+elif WATERTIGHT == '2':
+	WATERTIGHT = 2
+elif WATERTIGHT == '3':
+	WATERTIGHT = 3
+elif WATERTIGHT == '0':
+	WATERTIGHT = False
+else:
+	WATERTIGHT = False
+if WATERTIGHT and METRICS == 2:
+	PARSER.error("the watertightness is checked on the faces of the OBJs, which are not made with --metrics 2")
+
+INDEX = ARGS['index']
+if INDEX == '1':
+	INDEX = True
+elif INDEX == '0':
+	INDEX = False
+else:
+	INDEX = False
+if INDEX and not OBJECTS:
+	PARSER.error("the index of the buildings requires their objects (-g 1)")
+if INDEX and SHARD:
+	PARSER.error("the index is not supported for shards, since the merge moves the vertices and faces")
+
+CACHE = ARGS['cache']
+if CACHE == '1':
+	CACHE = True
+elif CACHE == '0':
+	CACHE = False
+else:
+	CACHE = False
+if CACHE and SIMPLIFY:
+	PARSER.error("the cache keeps the class of each face, which is lost when the coplanar polygons are merged (--simplify)")
+if CACHE and TEXTURES:
+	PARSER.error("the texture coordinates are not stored in the cache")
+if CACHE and METRICS == 2:
+	PARSER.error("the cache is made of the faces of the OBJs, which are not made with --metrics 2")
+if CACHE and SHARD:
+	PARSER.error("the cache is not supported for shards")
+
+EXPORT = ARGS['export']
+if EXPORT == '1':
+	EXPORT = True
+elif EXPORT == '0':
+	EXPORT = False
+else:
+	EXPORT = False
+if EXPORT and (CACHE or SHARD or PLAN or MERGE):
+	PARSER.error("the export cannot be combined with --cache, --plan, --shard or --merge")
+if EXPORT and TEXTURES:
+	PARSER.error("the texture coordinates are not stored in the cache")
+
+COINCIDENT = ARGS['coincident']
+if COINCIDENT == '1':
+	COINCIDENT = 1
+elif COINCIDENT == '2':
+	COINCIDENT = 2
+elif COINCIDENT == '0':
+	COINCIDENT = False
+else:
+	COINCIDENT = False
+
+LODSELECT = ARGS['lod']
+if LODSELECT == 'auto':
+	LODSELECT = 'auto'
+elif LODSELECT in ['0', '1', '2', '3', '4']:
+	LODSELECT = int(LODSELECT)
+elif LODSELECT:
+	PARSER.error("the level of detail should be 0, 1, 2, 3, 4 or auto")
+else:
+	LODSELECT = None
+
+PIPELINE = ARGS['pipeline']
+if PIPELINE == '1':
+	PIPELINE = True
+elif PIPELINE == '0':
+	PIPELINE = False
+else:
+	PIPELINE = False
+
+WORKERS = ARGS['workers']
+if WORKERS:
+	WORKERS = int(WORKERS)
+else:
+	WORKERS = 0
+
+QUEUE = ARGS['queue_size']
+if QUEUE:
+	QUEUE = max(int(QUEUE), 1)
+else:
+	QUEUE = 16
+
+AUTO = ARGS['auto']
+if AUTO:
+	AUTO = float(AUTO) * 1024 * 1024
+else:
+	AUTO = None
+
 #-----------------------------------------------------------------
 #-- Attribute stuff
 
@@ -287,26 +1468,109 @@ def mtl(att, min_value, max_value, res):
 #-----------------------------------------------------------------
 
 #-- Start of the program
-print "CityGML2OBJ. Searching for CityGML files..."
-
-#-- Find all CityGML files in the directory
-os.chdir(DIRECTORY)
-#-- Supported extensions
-types = ('*.gml', '*.GML', '*.xml', '*.XML')
-files_found = []
-for files in types:
-	files_found.extend(glob.glob(files))
-for f in files_found:
-	FILENAME = f[:f.rfind('.')]
-	FULLPATH = os.path.join(DIRECTORY, f)
-
-	#-- Reading and parsing the CityGML file(s)
-	CITYGML = etree.parse(FULLPATH)
+#-- Merge the outputs of the shards into the final OBJs
+if MERGE:
+	print "CityGML2OBJ. Merging the shards in", RESULT
+	merged, skipped = shard3dmodule.merge(RESULT)
+	print "\tMerged", len(merged), "file(s)."
+	for name in skipped:
+		print "\tSkipped", name, "which cannot be merged."
+	sys.exit()
+
+#-- Write the OBJs from the caches of converted files, without parsing and triangulating them again
+if EXPORT:
+	print "CityGML2OBJ. Exporting the caches in", DIRECTORY
+	RESULT = os.path.join(os.path.abspath(RESULT), '')
+	if PIPELINE:
+		WRITER = pipeline3dmodule.Writer(QUEUE)
+	else:
+		WRITER = pipeline3dmodule.Writer()
+	for FILENAME, path in cache3dmodule.caches(DIRECTORY):
+		print FILENAME
+		print "	%d OBJ file(s) exported." % export_cache(FILENAME, path)
+	WRITER.close()
+	sys.exit()
+
+if SHARD:
+	#-- Convert the files (or their ranges of city objects) listed in the manifest of the shard
+	print "CityGML2OBJ. Converting the shard", SHARD
+	SHARD = os.path.abspath(SHARD)
+	manifest = shard3dmodule.read_manifest(SHARD)
+	files_found = [(part['name'], part['path'], part['member']) for part in manifest['sources']]
+	object_ranges = [part['objects'] for part in manifest['sources']]
+	RESULT = shard3dmodule.start_shard(SHARD)
+else:
+	print "CityGML2OBJ. Searching for CityGML files..."
+
+	#-- Find all CityGML files in the directory, also compressed ones and the ones in ZIP archives
+	os.chdir(DIRECTORY)
+	#-- Absolute paths, since the reader of the pipeline does not follow the changes of the working directory
+	files_found = markup3dmodule.GMLsources(os.getcwd())
+	object_ranges = [None] * len(files_found)
+	RESULT = os.path.abspath(RESULT)
+	RESULT = os.path.join(RESULT, '')
+
+#-- Split the input into shards, which are converted independently with --shard and merged with --merge
+if PLAN:
+	manifests = shard3dmodule.write_manifests(shard3dmodule.plan(files_found, PLAN), RESULT)
+	print "\tPlanned", len(manifests), "shard(s) of", len(files_found), "file(s) in", RESULT
+	sys.exit()
+
+#-- Scan the files and choose the workers, the pipeline and the queue size within the memory budget, unless they are given
+if AUTO:
+	print "\tScanning", len(files_found), "file(s) for the plan..."
+	scans = [markup3dmodule.scanSource(path, member) for name, path, member in files_found]
+	estimates = [pipeline3dmodule.estimate(scan) for scan in scans]
+	workers, pipeline, queue = pipeline3dmodule.tune(estimates, AUTO, multiprocessing.cpu_count())
+	if ARGS['workers'] is None:
+		WORKERS = workers
+	if ARGS['pipeline'] is None:
+		PIPELINE = pipeline
+	if ARGS['queue_size'] is None:
+		QUEUE = queue
+	planned_memory, planned_time = pipeline3dmodule.forecast(estimates, WORKERS, PIPELINE)
+	print "\tPlan: %d worker(s), pipeline %s, queue size %d." % (WORKERS, "on" if PIPELINE else "off", QUEUE)
+	print "\tEstimated peak memory %d MB of %d MB, and time %.0f s." % (planned_memory / 1048576, AUTO / 1048576, planned_time)
+	for (name, path, member), (memory, triangulation, rest) in zip(files_found, estimates):
+		if pipeline3dmodule.BASEbytes + memory > AUTO:
+			print "\t\t%s needs about %d MB, above the budget." % (name, (pipeline3dmodule.BASEbytes + memory) / 1048576)
+	#-- Time of each file and peak memory of the main process so far, by file, compared with the estimates at the end
+	plan_report = {}
+	run_start = time.time()
+
+#-- Worker processes of the triangulation, started before the threads of the pipeline
+if WORKERS:
+	POOL = multiprocessing.Pool(WORKERS)
+else:
+	POOL = None
+#-- And the process in which the large polygons are triangulated within the time budget
+if BUDGET:
+	#-- With the pipeline its threads run when a process has to be replaced, so spares are started now instead of forking then
+	if PIPELINE:
+		WATCHDOG = pipeline3dmodule.Watchdog(pipeline3dmodule.WATCHDOGspares, False)
+	else:
+		WATCHDOG = pipeline3dmodule.Watchdog()
+#-- Writer of the OBJs, and the reader which parses the next file while the current one is converted
+if PIPELINE:
+	WRITER = pipeline3dmodule.Writer(QUEUE)
+	sources = pipeline3dmodule.prefetch(parsed_sources(files_found, object_ranges), 1)
+else:
+	WRITER = pipeline3dmodule.Writer()
+	sources = parsed_sources(files_found, object_ranges)
+
+file_start = time.time()
+for FILENAME, FULLPATH, CITYGML, OBJECTRANGE in sources:
+
+	#-- CityJSON is converted from its city objects and vertices, without a tree
+	CITYJSON = isinstance(CITYGML, cityjson3dmodule.CityModel)
 	#-- Getting the root of the XML tree
-	root = CITYGML.getroot()
+	if CITYJSON:
+		root = None
+	else:
+		root = CITYGML.getroot()
 	#-- Determine CityGML version
 	# If 1.0
-	if root.tag == "{http://www.opengis.net/citygml/1.0}CityModel":
+	if root is not None and root.tag == "{http://www.opengis.net/citygml/1.0}CityModel":
 		#-- Name spaces
 		ns_citygml="http://www.opengis.net/citygml/1.0"
 
@@ -367,7 +1631,6 @@ for f in files_found:
 
 	#--  This denotes the dictionaries in which the surfaces are put.
 	output = {}
-	vertices_output = {}
 	face_output = {}
 
 	#-- This denotes the dictionaries in which all surfaces are put. It is later ignored in the semantic option was invoked.
@@ -375,20 +1638,22 @@ for f in files_found:
 	output['All'].append(header)
 	if ATTRIBUTE:
 		output['All'].append("mtllib colormap.mtl\n")
-	vertices_output['All'] = []
+	if TEXTURES:
+		output['All'].append("mtllib " + FILENAME + ".mtl\n")
 	face_output['All'] = []
 
+	#-- Easy to modify list of thematic boundaries
+	semanticSurfaces = ['GroundSurface', 'WallSurface', 'RoofSurface', 'ClosureSurface', 'CeilingSurface', 'InteriorWallSurface', 'FloorSurface', 'OuterCeilingSurface', 'OuterFloorSurface', 'Door', 'Window']
 	#-- If the semantic option was invoked, this part adds additional dictionaries.
 	if SEMANTICS:
-		#-- Easy to modify list of thematic boundaries
-		semanticSurfaces = ['GroundSurface', 'WallSurface', 'RoofSurface', 'ClosureSurface', 'CeilingSurface', 'InteriorWallSurface', 'FloorSurface', 'OuterCeilingSurface', 'OuterFloorSurface', 'Door', 'Window']
 		for semanticSurface in semanticSurfaces:
 			output[semanticSurface] = []
 			output[semanticSurface].append(header)
 			#-- Add the material library
 			if ATTRIBUTE:
 				output[semanticSurface].append("mtllib colormap.mtl\n")
-			vertices_output[semanticSurface] = []
+			if TEXTURES:
+				output[semanticSurface].append("mtllib " + FILENAME + ".mtl\n")
 			face_output[semanticSurface] = []
 
 
@@ -399,12 +1664,115 @@ for f in files_found:
 		for semanticSurface in semanticSurfaces:
 			vertices[semanticSurface] = []
 	vertices['Other'] = []
+	#-- Buildings which are not watertight, written separately
+	if WATERTIGHT == 3:
+		output['Open'] = []
+		output['Open'].append(header)
+		if ATTRIBUTE:
+			output['Open'].append("mtllib colormap.mtl\n")
+		if TEXTURES:
+			output['Open'].append("mtllib " + FILENAME + ".mtl\n")
+		face_output['Open'] = []
+		vertices['Open'] = []
+	#-- LOD1 blocks of the buildings
+	if BLOCKS:
+		output['LOD1'] = []
+		output['LOD1'].append(header)
+		face_output['LOD1'] = []
+		vertices['LOD1'] = []
+	#-- Texture coordinates of the faces (u, v and the image) and their index, by class
+	texcoords = {}
+	texcoord_index = {}
+	for cl in vertices:
+		texcoords[cl] = []
+		texcoord_index[cl] = {}
 	face_output['Other'] = []
 	output['Other'] = []
+	#-- Number of near-identical points snapped to an existing vertex
+	welded = 0
+	#-- Dataset-level spatial hash of the vertices for the global welding
+	grid = {}
+	for cl in vertices:
+		grid[cl] = {}
+	#-- Classes whose spatial hash exceeded the size cap, they are deduplicated with an external sort after the extraction
+	spilled = set()
+	#-- Indices in the vertices of each class of the vertices of the CityJSON file
+	vertex_map = {}
+	for cl in vertices:
+		vertex_map[cl] = {}
+
+	#-- Index of the geometries referenced through XLinks, and the polygons which can be shared by several objects
+	if CITYJSON:
+		index = {}
+		shared = set()
+	else:
+		index = markup3dmodule.idIndex(root)
+		shared = markup3dmodule.sharedPolygons(index)
+	#-- Textures and materials of the polygons, and the names of the materials
+	if TEXTURES and not CITYJSON:
+		appearance = markup3dmodule.appearances(root, THEME)
+	else:
+		appearance = {}
+	materials = {}
+	#-- Triangles of the polygons of the current object, and of the shared ones
+	triangles = {}
+	shared_triangles = {}
+	#-- Triangulated prototypes of the implicit geometries, and the number of their instances
+	prototypes = {}
+	ninstances = 0
+	#-- Number of objects without geometry in the selected level of detail
+	nolod = 0
+
+	#-- Parsed polygons of the current object, the invalid ones, and the report of the validation
+	parsed = {}
+	invalid = set()
+	validation_report = []
+
+	#-- Number of the polygons of each class of each building, for the index
+	object_classes = {}
+
+	#-- Objects of the file (identifier, type, yearly irradiation and number of polygons of each class), and the object, class and attributes of each face, for the cache
+	cache_objects = []
+	cache_faces = {'All' : [], 'Other' : []}
+
+	#-- Number of the triangles reordered for the vertex cache, and their cache misses before and after
+	acmr = {'triangles' : 0, 'before' : 0, 'after' : 0}
+
+	#-- Polygons which failed the triangulation or ran out of the time budget
+	triangulation_report = []
+
+	#-- Report of the topology of the buildings, and the number of the watertight ones
+	watertight_report = []
+	nwatertight = 0
+
+	#-- Coincident polygons with opposite orientations, and the number of their faces by class
+	coincident = {}
+	ncoincident = {}
+	ninvalid = 0
+
+	#-- Polygons waiting for the metrics, and the columns of the table of the metrics
+	metrics_pending = []
+	metrics = {}
+	for column in ['object', 'polygon', 'class', 'area', 'nx', 'ny', 'nz', 'azimuth', 'tilt']:
+		metrics[column] = []
+
+	#-- Polygons of the current object waiting for the simplification, the ones written as they are, and the triangle counts
+	pending = {}
+	pending_kept = []
+	ntriangles = 0
+	ntriangles_before = 0
+	ntriangles_after = 0
+	nsimplify_failed = 0
 
 	#-- Find all instances of cityObjectMember and put them in a list
-	for obj in root.getiterator('{%s}cityObjectMember'% ns_citygml):
-		cityObjects.append(obj)
+	if CITYJSON:
+		cityObjects = list(CITYGML.cityobjects)
+	else:
+		for obj in root.getiterator('{%s}cityObjectMember'% ns_citygml):
+			cityObjects.append(obj)
+	#-- A shard converts only its range of the city objects
+	if OBJECTRANGE is not None:
+		cityObjects = cityObjects[OBJECTRANGE[0]:OBJECTRANGE[1]]
 
 	print FILENAME
 
@@ -413,17 +1781,43 @@ for f in files_found:
 		#-- Report the progress and contents of the CityGML file
 		print "\tThere are", len(cityObjects), "cityObject(s) in this CityGML file."
 		#-- Store each building separately
-		for cityObject in cityObjects:
-			for child in cityObject.getchildren():
-				if child.tag == '{%s}Building' %ns_bldg:
-					buildings.append(child)
-		for cityObject in cityObjects:
-			for child in cityObject.getchildren():
-				if child.tag == '{%s}Road' %ns_tran or child.tag == '{%s}PlantCover' %ns_veg or \
-				child.tag == '{%s}GenericCityObject' %ns_gen or child.tag == '{%s}CityFurniture' %ns_frn or \
-				child.tag == '{%s}Relief' %ns_dem or child.tag == '{%s}Tunnel' %ns_tun or \
-				child.tag == '{%s}WaterBody' %ns_wtr or child.tag == '{%s}Bridge' %ns_brid:
-					other.append(child)
+		if CITYJSON:
+			for cityObject in cityObjects:
+				if cityObject.type == 'Building':
+					buildings.append(cityObject)
+				elif cityObject.type in ['Road', 'PlantCover', 'GenericCityObject', 'CityFurniture', 'TINRelief', 'Tunnel', 'WaterBody', 'Bridge', 'SolitaryVegetationObject']:
+					other.append(cityObject)
+			ntemplated = sum(o.count_instances() for o in buildings + other)
+			if ntemplated:
+				print "\t%d instance(s) of geometry templates are not converted." % ntemplated
+			if TEXTURES:
+				print "\tThe appearances of CityJSON are not converted."
+		else:
+			for cityObject in cityObjects:
+				for child in cityObject.getchildren():
+					if child.tag == '{%s}Building' %ns_bldg:
+						buildings.append(child)
+			for cityObject in cityObjects:
+				for child in cityObject.getchildren():
+					if child.tag == '{%s}Road' %ns_tran or child.tag == '{%s}PlantCover' %ns_veg or \
+					child.tag == '{%s}GenericCityObject' %ns_gen or child.tag == '{%s}CityFurniture' %ns_frn or \
+					child.tag == '{%s}Relief' %ns_dem or child.tag == '{%s}Tunnel' %ns_tun or \
+					child.tag == '{%s}WaterBody' %ns_wtr or child.tag == '{%s}Bridge' %ns_brid or \
+					child.tag == '{%s}SolitaryVegetationObject' %ns_veg:
+						other.append(child)
+
+		#-- Compare the triangulation backends on all polygons of the file instead of converting it
+		if BENCHMARK:
+			benchmark(buildings + other)
+			if AUTO:
+				plan_report[FILENAME] = (time.time() - file_start, peak_memory())
+			file_start = time.time()
+			continue
+
+		#-- Find the coincident polygons in the whole file before the extraction
+		if COINCIDENT:
+			coincident = find_coincident(buildings + other)
+			print "\tFound", len(coincident) // 2, "pair(s) of coincident polygons."
 
 		print "\tAnalysing objects and extracting the geometry..."
 
@@ -432,26 +1826,42 @@ for f in files_found:
 		b_total = len(buildings)
 
 		#-- Do each building separately
-		for b in buildings:
+		for b, lod, polys, parsed_ahead, tris in geometry(buildings):
 
 			#-- Build the local list of vertices to speed up the indexing
 			local_vertices = {}
 			local_vertices['All'] = []
+			#-- And its spatial hash
+			local_grid = {}
+			local_grid['All'] = {}
 			if SEMANTICS:
 				for semanticSurface in semanticSurfaces:
 					local_vertices[semanticSurface] = []
+					local_grid[semanticSurface] = {}
+			if BLOCKS:
+				local_vertices['LOD1'] = []
+				local_grid['LOD1'] = {}
+			#-- With the global welding the dataset-level lists are used instead, unless they exceeded the memory limit
+			#-- CityJSON always uses them, since its vertices are shared by all objects of the file
+			if GLOBALWELD or CITYJSON:
+				for cl in local_vertices:
+					if cl not in spilled:
+						local_vertices[cl] = vertices[cl]
+						local_grid[cl] = grid[cl]
 
 
 			#-- Increment the building counter
 			b_counter += 1
 
-			#-- If the object option is on, get the name for each building or create one
-			if OBJECTS:
-				ob = b.xpath("@g:id", namespaces={'g' : ns_gml})
-				if not ob:
-					ob = b_counter
-				else:
-					ob = ob[0]
+			#-- Where the faces of the building start in each class
+			start = {}
+			for cl in local_vertices:
+				start[cl] = len(face_output[cl])
+
+			#-- Get the name for each building or create one, it is used for the objects and the reports
+			ob = object_id(b)
+			if not ob:
+				ob = b_counter
 			
 			#-- Print progress for large files every 1000 buildings.
 			if b_counter == 1000:
@@ -466,15 +1876,45 @@ for f in files_found:
 				face_output['All'].append('o ' + str(ob) + '\n')
 
 			#-- Add the attribute for the building
-			if ATTRIBUTE:
+			if ATTRIBUTE and CITYJSON:
+				if 'yearlyIrradiation' in b.attributes:
+					bAttVal = float(b.attributes['yearlyIrradiation'])
+			elif ATTRIBUTE:
 				for ch in b.getchildren():
 					if ch.tag == "{%s}yearlyIrradiation" %ns_citygml:
 						bAttVal = float(ch.text)
 
 			#-- OBJ with all surfaces in the same bin
-			polys = markup3dmodule.polygonFinder(b)
+			#-- Parse and validate all polygons of the building at once
+			prepare_object(ob, polys, parsed_ahead)
+			if LODSELECT is not None and not polys:
+				nolod += 1
+			if tris:
+				pretriangulated(tris)
+			#-- Classes of the polygons of the building for the index
+			if INDEX:
+				object_classes[str(ob)] = {}
+				classes = classify_polygons(b)
+				for poly in polys:
+					if poly in classes:
+						object_classes[str(ob)][classes[poly]] = object_classes[str(ob)].get(classes[poly], 0) + 1
+			#-- Area, orientation and tilt of the surfaces
+			if METRICS:
+				collect_metrics(ob, polys, classify_polygons(b), 'None')
+				if METRICS == 2:
+					continue
+			#-- The object, class and attributes of the faces of each polygon, for the cache
+			if CACHE:
+				classes = classify_polygons(b)
+				counts = {}
+				for poly in polys:
+					if poly in classes:
+						counts[classes[poly]] = counts.get(classes[poly], 0) + 1
+				cache_objects.append((str(ob), 'Building', object_attribute(b, 'yearlyIrradiation'), counts))
+				object_faces = []
 			#-- Process each surface
 			for poly in polys:
+				nfaces = len(face_output['All'])
 				if ATTRIBUTE:
 					poly_to_obj(poly, 'All', bAttVal)
 					if ATTRIBUTE == 3:
@@ -482,16 +1922,43 @@ for f in files_found:
 				else:
 					#print etree.tostring(poly)
 					poly_to_obj(poly, 'All')
+				if CACHE:
+					if classes.get(poly) in semanticSurfaces:
+						k = semanticSurfaces.index(classes[poly])
+					else:
+						k = -1
+					object_faces.extend([(len(cache_objects) - 1, k, polygon_attribute(poly, 'irradiation'), polygon_attribute(poly, 'totalIrradiation'))] * new_faces('All', nfaces))
 					
+			#-- Semantic decomposition of CityJSON, where each surface has its class, also the openings
+			if SEMANTICS and CITYJSON:
+				classes = classify_polygons(b)
+				for cl in output:
+					firstF = True
+					for p in polys:
+						if classes.get(p) != cl:
+							continue
+						if OBJECTS and firstF:
+							face_output[cl].append('o ' + str(ob) + '\n')
+							firstF = False
+						attVal = None
+						if cl == 'RoofSurface' and ATTRIBUTE == 3:
+							attVal = bAttVal
+						elif cl == 'RoofSurface' and ATTRIBUTE:
+							attVal = p.semantics.get({1 : 'irradiation', 2 : 'totalIrradiation'}[ATTRIBUTE])
+							if attVal is not None:
+								attVal = float(attVal)
+								atts.append(attVal)
+						poly_to_obj(p, cl, attVal)
+
 			#-- Semantic decomposition, with taking special care about the openings
-			if SEMANTICS:
+			elif SEMANTICS:
 				#-- First take care about the openings since they can mix up
 				openings = []
 				openingpolygons = []
 				for child in b.getiterator():
 						if child.tag == '{%s}opening' %ns_bldg:
 							openings.append(child)
-							for o in child.findall('.//{%s}Polygon' %ns_gml):
+							for o in markup3dmodule.polygonFinder(child, index, lod):
 								openingpolygons.append(o)
 
 				#-- Process each opening
@@ -502,8 +1969,7 @@ for f in files_found:
 								t = 'Window'
 							else:
 								t = 'Door'
-							polys = markup3dmodule.polygonFinder(o)
-							for poly in polys:
+							for poly in markup3dmodule.polygonFinder(o, index, lod):
 								poly_to_obj(poly, t)
 
 				#-- Process other thematic boundaries
@@ -523,7 +1989,7 @@ for f in files_found:
 						if feature.tag == '{%s}Window' %ns_bldg or feature.tag == '{%s}Door' %ns_bldg:
 							continue
 						#-- Find all polygons in this semantic boundary hierarchy
-						for p in feature.findall('.//{%s}Polygon' %ns_gml):
+						for p in markup3dmodule.polygonFinder(feature, index, lod):
 							if ATTRIBUTE == 1 or ATTRIBUTE == 2:
 								#-- Flush the previous value
 								attVal = None
@@ -558,28 +2024,134 @@ for f in files_found:
 								#-- Finally process the polygon
 								poly_to_obj(p, cl, attVal)
 
+			#-- Merge the coplanar polygons of this building
+			if SIMPLIFY:
+				flush_simplified()
+
+			#-- Check the topology of the final faces of the building
+			removed = False
+			if WATERTIGHT:
+				removed = check_watertight(ob, start)
+			#-- Reorder the triangles for the vertex cache, and the records of the cache with them
+			if VERTEXCACHE:
+				order = optimise_vertex_cache(start)
+				if CACHE and len(order) == len(object_faces):
+					object_faces = [object_faces[k] for k in order]
+
+			#-- Unless its faces were removed or moved by the check
+			if CACHE and new_faces('All', start['All']) == len(object_faces):
+				cache_faces['All'].extend(object_faces)
+
+			#-- LOD1 block of the building, unless the building was removed by the check
+			if BLOCKS and not removed:
+				if OBJECTS:
+					face_output['LOD1'].append('o ' + str(ob) + '\n')
+				block_to_obj(b, polys, 'LOD1')
+
 			#-- Merge the local list of vertices to the global
 			for cl in local_vertices:
+				if local_vertices[cl] is vertices[cl]:
+					continue
 				for vertex in local_vertices[cl]:
 					vertices[cl].append(vertex)
 
+			#-- Release the spatial hashes which grew over the size cap, the vertices themselves stay in the memory
+			if GLOBALWELD and not CITYJSON:
+				for cl in local_vertices:
+					if cl not in spilled and len(vertices[cl]) * mesh3dmodule.HASH_BYTES_PER_VERTEX > WELDMEMORY:
+						print "\t\tThe spatial hash of %s exceeds the size cap. Continuing with an external sort." % cl
+						spilled.add(cl)
+						grid[cl] = {}
+
 		if len(other) > 0:
-			vertices_output['Other'] = []
 			local_vertices = {}
 			local_vertices['Other'] = []
-			for oth in other:
+			local_grid = {}
+			local_grid['Other'] = {}
+			if CITYJSON:
+				local_vertices['Other'] = vertices['Other']
+				local_grid['Other'] = grid['Other']
+			for oth, lod, polys, parsed_ahead, tris in geometry(other):
 				# local_vertices = {}
 				# local_vertices['All'] = []
-				polys = markup3dmodule.polygonFinder(oth)
+				oid = object_id(oth)
+				prepare_object(oid, polys, parsed_ahead)
+				if CITYJSON:
+					implicits = []
+				else:
+					implicits = markup3dmodule.implicitGeometries(oth, lod)
+				if LODSELECT is not None and not polys and not implicits:
+					nolod += 1
+				if tris:
+					pretriangulated(tris)
+				nfaces = len(face_output['Other'])
+				if METRICS:
+					if CITYJSON:
+						collect_metrics(oid, polys, {}, oth.type)
+					else:
+						collect_metrics(oid, polys, {}, oth.tag[oth.tag.index('}') + 1:])
+					if METRICS == 2:
+						continue
 				#-- Process each surface
 				for poly in polys:
 					poly_to_obj(poly, 'Other')
-			for vertex in local_vertices['Other']:
-				vertices['Other'].append(vertex)
+				if SIMPLIFY:
+					flush_simplified()
+				#-- Instances of implicit geometries, e.g. trees and lamp posts
+				for implicit in implicits:
+					implicit_to_obj(implicit, 'Other')
+				#-- The vertices of the other objects are in one list, so they keep their numbers
+				if VERTEXCACHE:
+					optimise_vertex_cache({'Other' : nfaces}, False)
+				if CACHE:
+					if CITYJSON:
+						cache_objects.append((oid, oth.type, object_attribute(oth, 'yearlyIrradiation'), {}))
+					else:
+						cache_objects.append((oid, oth.tag[oth.tag.index('}') + 1:], object_attribute(oth, 'yearlyIrradiation'), {}))
+					cache_faces['Other'].extend([(len(cache_objects) - 1, -1, None, None)] * new_faces('Other', nfaces))
+			if local_vertices['Other'] is not vertices['Other']:
+				for vertex in local_vertices['Other']:
+					vertices['Other'].append(vertex)
 
 
 		print "\tExtraction done. Sorting geometry and writing file(s)."
 
+		#-- Deduplicate the vertices of the classes which did not fit in the memory
+		for cl in spilled:
+			nvertices = len(vertices[cl])
+			vertices[cl], remap = mesh3dmodule.external_dedup(vertices[cl], WELDMEMORY / mesh3dmodule.HASH_BYTES_PER_VERTEX, WELD)
+			face_output[cl], dropped = mesh3dmodule.remap_faces(face_output[cl], remap)
+			print "\tExternal sort merged", nvertices - len(vertices[cl]), "vertices of", cl
+			if dropped:
+				print "\tDropped", len(dropped), "face(s) of", cl, "collapsed by the merging."
+				#-- The records of the cache follow the faces
+				if CACHE and cl == 'All':
+					dropped = set(dropped)
+					cache_faces['All'] = [r for k, r in enumerate(cache_faces['All']) if k not in dropped]
+			del remap
+
+		if nolod:
+			print "\t%d object(s) without geometry in LOD %s." % (nolod, LODSELECT)
+
+		if ninstances:
+			print "\tConverted", ninstances, "instance(s) of", len(prototypes), "implicit geometry prototype(s)."
+
+		if SIMPLIFY:
+			print "\tSimplification reduced an estimated", ntriangles_before, "triangles to", ntriangles_after, "(n - 2 + 2h for n points and h holes)."
+			if nsimplify_failed:
+				print "\t%d group(s) of coplanar polygons could not be merged, they were kept as they are." % nsimplify_failed
+
+		if WELD:
+			print "\tSnapped", welded, "near-identical point(s) to an existing vertex (tolerance %s)." % WELD
+
+		if VERTEXCACHE and acmr['triangles']:
+			print "\tVertex cache: ACMR %.3f before and %.3f after the reordering of %d triangles (cache of %d vertices)." % (acmr['before'] / float(acmr['triangles']), acmr['after'] / float(acmr['triangles']), acmr['triangles'], mesh3dmodule.VERTEX_CACHE_SIZE)
+
+		#-- Save the geometry for the export, before the translation
+		if CACHE:
+			write_cache(RESULT + FILENAME + cache3dmodule.CACHEextension)
+			print "\tCache of %d face(s) written to %s%s" % (len(cache_faces['All']) + len(cache_faces['Other']), FILENAME, cache3dmodule.CACHEextension)
+
 		#-- Translate (convert) the vertices to a local coordinate system
 		if TRANSLATE:
 			print "\tTranslating the coordinates of vertices."
@@ -594,33 +2166,125 @@ for f in files_found:
 			dz = smallest_vtx[2]
 			for cl in output:
 				if len(vertices[cl]) > 0:
+					#-- New lists, since the vertices of the shared triangles are the same objects in several classes
 					for idx, vtx in enumerate(vertices[cl]):
-						vertices[cl][idx][0] = vtx[0] - dx
-						vertices[cl][idx][1] = vtx[1] - dy
-						vertices[cl][idx][2] = vtx[2] - dz
+						vertices[cl][idx] = [vtx[0] - dx, vtx[1] - dy, vtx[2] - dz]
 
 
-		#-- Write the OBJ(s)
+		#-- Material library of the appearances
+		if TEXTURES:
+			nmaterials, npacked, natlases = write_materials(FULLPATH)
+			print "\t%d material(s) written to %s.mtl" % (nmaterials, FILENAME)
+			if ATLAS:
+				print "\t%d texture(s) packed in %d atlas(es)." % (npacked, natlases)
+
+		#-- Write the OBJ(s), in the background with the pipeline
 		os.chdir(RESULT)
 		#-- Theme by theme
 		for cl in output:
 			if len(vertices[cl]) > 0:
-				write_vertices(vertices[cl], cl)
-				output[cl].append("\n" + ''.join(vertices_output[cl]))
-				output[cl].append("\n" + ''.join(face_output[cl]))
 				if cl == 'All':
 					adj_suffix = ""
 				else:
 					adj_suffix = "-" + str(cl)
-				
-				with open(RESULT + FILENAME +  str(adj_suffix) + ".obj", "w") as obj_file:
-					obj_file.write(''.join(output[cl]))
+				if INDEX:
+					index_path = RESULT + FILENAME + str(adj_suffix) + ".index.json"
+				else:
+					index_path = None
+				WRITER.write(RESULT + FILENAME +  str(adj_suffix) + ".obj", obj_chunks, output[cl], vertices[cl], face_output[cl], texcoords[cl], index_path, object_classes)
 
-		print "\tOBJ file(s) written."
+		if METRICS != 2:
+			if PIPELINE:
+				print "\tOBJ file(s) queued for writing."
+			else:
+				print "\tOBJ file(s) written."
+
+		#-- Write the table of the metrics of the surfaces
+		if METRICS:
+			write_metrics(RESULT + FILENAME + "-metrics")
+			print "\tMetrics of %d surface(s) written." % len(metrics['object'])
+
+		#-- Write the report of the invalid polygons
+		if VALIDATION:
+			with open(RESULT + FILENAME + "-validation.csv", "wb") as report_file:
+				report = csv.writer(report_file)
+				report.writerow(['object', 'polygon', 'ring', 'reason'])
+				report.writerows(validation_report)
+			print "\t%d invalid polygon(s) skipped, see %s-validation.csv" % (ninvalid, FILENAME)
+
+		#-- Write the report of the topology of the buildings
+		if WATERTIGHT:
+			with open(RESULT + FILENAME + "-watertight.csv", "wb") as report_file:
+				report = csv.writer(report_file)
+				report.writerow(['object', 'faces', 'edges', 'boundary edges', 'non-manifold edges', 'orientation conflicts', 'watertight'])
+				report.writerows(watertight_report)
+			print "\t%d of %d building(s) are watertight, see %s-watertight.csv" % (nwatertight, len(watertight_report), FILENAME)
+			if WATERTIGHT == 2:
+				print "\tSkipped %d building(s) which are not watertight." % (len(watertight_report) - nwatertight)
+			elif WATERTIGHT == 3:
+				print "\t%d building(s) which are not watertight written to %s-Open.obj" % (len(watertight_report) - nwatertight, FILENAME)
+
+		#-- Write the report of the polygons which failed the triangulation
+		if BUDGET:
+			with open(RESULT + FILENAME + "-triangulation.csv", "wb") as report_file:
+				report = csv.writer(report_file)
+				report.writerow(['object', 'polygon', 'points', 'reason', 'fallback', 'triangles'])
+				report.writerows(triangulation_report)
+			print "\t%d polygon(s) failed the triangulation, see %s-triangulation.csv" % (len(triangulation_report), FILENAME)
+
+		#-- Write the report of the coincident polygons
+		if COINCIDENT:
+			with open(RESULT + FILENAME + "-coincident.csv", "wb") as report_file:
+				report = csv.writer(report_file)
+				report.writerow(['object', 'polygon', 'coincident object', 'coincident polygon'])
+				written = set()
+				for poly, (oid, other_poly, other_oid) in coincident.items():
+					#-- Each pair once
+					if other_poly in written:
+						continue
+					written.add(poly)
+					report.writerow([oid, polygon_id(poly), other_oid, polygon_id(other_poly)])
+			for cl in sorted(ncoincident):
+				if COINCIDENT == 1:
+					print "\tRemoved %d coincident polygon(s) of %s." % (ncoincident[cl], cl)
+				else:
+					print "\tFound %d coincident polygon(s) of %s." % (ncoincident[cl], cl)
 
 		#-- Print the range of attributes. Useful for defining the range of the colorbar.
 		if ATTRIBUTE:
 			print '\tRange of attributes:', min(atts), '--', max(atts)
 
 	else:
-		print "\tThere is a problem with this file: no cityObjects have been found. Please check if the file complies to CityGML."
\ No newline at end of file
+		print "\tThere is a problem with this file: no cityObjects have been found. Please check if the file complies to CityGML."
+
+	#-- The time of a file includes its parsing, unless it was parsed ahead by the pipeline
+	if AUTO:
+		plan_report[FILENAME] = (time.time() - file_start, peak_memory())
+	file_start = time.time()
+
+#-- Wait until the writer of the pipeline is done and stop the workers
+WRITER.close()
+if POOL is not None:
+	POOL.close()
+	POOL.join()
+if BUDGET:
+	WATCHDOG.close()
+if PIPELINE:
+	print "All OBJ file(s) written."
+
+#-- Compare the plan with the actual time and memory
+if AUTO:
+	with open(RESULT + "auto-plan.csv", "wb") as report_file:
+		report = csv.writer(report_file)
+		report.writerow(['file', 'objects', 'polygons', 'coordinates', 'estimated memory (MB)', 'estimated time (s)', 'time (s)', 'peak memory of the main process so far (MB)'])
+		for (name, path, member), scan, (memory, triangulation, rest) in zip(files_found, scans, estimates):
+			seconds, peak = plan_report.get(name, (None, None))
+			if seconds is not None:
+				seconds = round(seconds, 2)
+			report.writerow([name, scan['objects'], scan['polygons'], scan['coordinates'], round((pipeline3dmodule.BASEbytes + memory) / 1048576.0, 1), round(rest + triangulation / max(WORKERS, 1), 2), seconds, peak])
+	print "Estimated peak memory %d MB and time %.0f s, actual %s MB (main process) and %.0f s, see auto-plan.csv" % (planned_memory / 1048576, planned_time, peak_memory(), time.time() - run_start)
+
+#-- Mark the shard as converted, the merge checks that all shards have the same options
+if SHARD:
+	shard3dmodule.finish_shard(SHARD, dict((k, v) for k, v in ARGS.items() if k not in ['directory', 'results', 'plan', 'shard', 'merge', 'pipeline', 'workers', 'queue_size']))
+	print "Shard converted."
@@ -0,0 +1,119 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+
+# This code is part of the CityGML2OBJs package
+
+# Copyright (c) 2014 
+# Filip Biljecki
+# Delft University of Technology
+# fbiljecki@gmail.com
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import os
+import glob
+import json
+import itertools
+import numpy as np
+
+#-- Extension of the directory of the cache of a file, e.g. Delft.cache
+CACHEextension = '.cache'
+#-- Metadata of the cache: the source, the classes, and the identifiers, types and attributes of the objects
+METAfile = 'meta.json'
+#-- Columns of the faces and their types. The class is the index in the classes of the metadata, -1 for none,
+#-- and missing attributes are NaN
+COLUMNS = [('object', np.int32), ('class', np.int8), ('irradiation', np.float64), ('totalIrradiation', np.float64)]
+
+
+def write(directory, parts, columns, meta):
+    """Writes a cache of converted geometry in the directory, as one NumPy array (.npy) per column, which can be memory-mapped.
+    The parts are (vertices, faces) with the faces as lists of one-based indices in their vertices, as in the OBJs.
+    Their vertices are concatenated in vertices.npy, and the faces are stored as the flat zero-based indices of their
+    vertices (indices.npy) with the position where each face starts (offsets.npy, one more than the faces),
+    so triangles and polygons are stored alike. The columns are the values of each face (see COLUMNS)."""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    vertices = []
+    lengths = []
+    indices = []
+    shift = 0
+    for part_vertices, faces in parts:
+        vertices.append(np.asarray(part_vertices, dtype=np.float64).reshape(-1, 3))
+        lengths.extend(len(f) for f in faces)
+        indices.append(np.fromiter(itertools.chain.from_iterable(faces), dtype=np.int64) + (shift - 1))
+        shift += len(vertices[-1])
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    #-- 32-bit indices unless there are too many vertices
+    if shift < 2 ** 31:
+        itype = np.int32
+    else:
+        itype = np.int64
+    np.save(os.path.join(directory, 'vertices.npy'), np.concatenate(vertices))
+    np.save(os.path.join(directory, 'indices.npy'), np.concatenate(indices).astype(itype))
+    np.save(os.path.join(directory, 'offsets.npy'), offsets)
+    for name, dtype in COLUMNS:
+        np.save(os.path.join(directory, name + '.npy'), np.asarray(columns[name], dtype=dtype))
+    with open(os.path.join(directory, METAfile), 'w') as meta_file:
+        json.dump(meta, meta_file)
+
+
+def read(directory):
+    """Memory-maps the arrays of a cache written by write(), and reads its metadata.
+    Returns the vertices, the indices and offsets of the faces, the columns (dict) and the metadata."""
+    def load(name):
+        return np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+    with open(os.path.join(directory, METAfile)) as meta_file:
+        meta = json.load(meta_file)
+    columns = {}
+    for name, dtype in COLUMNS:
+        columns[name] = load(name)
+    return load('vertices'), load('indices'), load('offsets'), columns, meta
+
+
+def caches(directory):
+    """Caches in the directory, as (name, path) sorted by name, e.g. ('Delft', '/data/Delft.cache')."""
+    found = []
+    for path in sorted(glob.glob(os.path.join(directory, '*' + CACHEextension))):
+        if os.path.isfile(os.path.join(path, METAfile)):
+            found.append((os.path.basename(path)[:-len(CACHEextension)], os.path.abspath(path)))
+    return found
+
+
+def face_vertices(indices, offsets, selected):
+    """Zero-based indices of the vertices of the selected faces (an array of their numbers) as one flat array,
+    with the number of vertices of each face."""
+    starts = np.asarray(offsets[selected], dtype=np.int64)
+    lengths = np.asarray(offsets[selected + 1], dtype=np.int64) - starts
+    #-- Position of each vertex of the selected faces in the indices
+    positions = np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return np.asarray(indices[positions], dtype=np.int64), lengths
+
+
+def compact(flat):
+    """Renumbers the zero-based indices of the vertices of faces so only the used vertices are kept, in the order
+    they are first used (as the converter numbers them). Returns the used vertices (their old indices) and the new
+    one-based indices."""
+    used, first, inverse = np.unique(flat, return_index=True, return_inverse=True)
+    order = np.argsort(first, kind='mergesort')
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return used[order], rank[inverse.ravel()] + 1
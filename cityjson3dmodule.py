@@ -0,0 +1,267 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+
+# This code is part of the CityGML2OBJs package
+
+# Copyright (c) 2014 
+# Filip Biljecki
+# Delft University of Technology
+# fbiljecki@gmail.com
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import json
+import array
+import collections
+import decimal
+import numpy as np
+import mesh3dmodule
+try:
+    import ijson
+    from ijson.common import ObjectBuilder
+except ImportError:
+    ijson = None
+
+#-- Relative distance (to the size of the surface) within which a point of a triangle is matched to a vertex of the surface
+MATCHtolerance = 1e-3
+
+
+class Surface(object):
+    """A surface of a CityJSON geometry: its rings as lists of indices of the vertices of the file,
+    its semantic surface (None if it has none), identifier and level of detail."""
+    __slots__ = ('rings', 'semantics', 'id', 'lod', 'vertices')
+
+    def __init__(self, rings, semantics, sid, lod, vertices):
+        self.rings = rings
+        self.semantics = semantics
+        self.id = sid
+        self.lod = lod
+        self.vertices = vertices
+
+    def points(self):
+        """Coordinates of the rings, closed (the last point is equal to the first one) like the ones of CityGML."""
+        return [self.vertices[ring + ring[:1]].tolist() for ring in self.rings if ring]
+
+    def vertex_ids(self, points):
+        """Indices of the vertices of the file at the points (e.g. of the triangles of the surface), found among the vertices of the rings.
+        The points are matched by their coordinates, and the ones the triangulation moved slightly to the nearest vertex,
+        found in a spatial hash (see mesh3dmodule.grid_key()). None for the points far from all of them."""
+        ids = [v for ring in self.rings for v in ring]
+        candidates = self.vertices[ids].tolist()
+        exact = {}
+        for v, c in zip(ids, candidates):
+            exact.setdefault(tuple(c), v)
+        found = [exact.get(tuple(p)) for p in points]
+        missing = [n for n, v in enumerate(found) if v is None]
+        if not missing or not candidates:
+            return found
+        extent = max(max(c[k] for c in candidates) - min(c[k] for c in candidates) for k in range(3))
+        tolerance = MATCHtolerance * extent
+        if tolerance <= 0:
+            return found
+        grid = {}
+        for k, c in enumerate(candidates):
+            grid.setdefault(mesh3dmodule.grid_key(c, tolerance), []).append(k)
+        for n in missing:
+            p = points[n]
+            cx, cy, cz = mesh3dmodule.grid_key(p, tolerance)
+            best = tolerance ** 2
+            for dx, dy, dz in mesh3dmodule.NEIGHBOURS:
+                for k in grid.get((cx + dx, cy + dy, cz + dz), ()):
+                    c = candidates[k]
+                    d = (c[0] - p[0])**2 + (c[1] - p[1])**2 + (c[2] - p[2])**2
+                    if d <= best:
+                        best = d
+                        found[n] = ids[k]
+        return found
+
+
+class CityObject(object):
+    """A CityJSON city object: its identifier, type, attributes, surfaces and children (e.g. BuildingParts)."""
+
+    def __init__(self, oid, data, vertices):
+        self.id = oid
+        self.type = data.get('type')
+        self.attributes = data.get('attributes') or {}
+        self.children = []
+        self.surfaces = []
+        #-- Instances of the geometry templates, which are not converted
+        self.instances = 0
+        for g, geometry in enumerate(data.get('geometry') or []):
+            if geometry.get('type') == 'GeometryInstance':
+                self.instances += 1
+                continue
+            lod = geometry.get('lod')
+            if lod is not None:
+                lod = int(float(lod))
+            semantics = geometry.get('semantics') or {}
+            classes = semantics.get('surfaces') or []
+            for s, (boundary, value) in enumerate(flatten(geometry, semantics.get('values'))):
+                if value is not None and value < len(classes):
+                    semantic = classes[value]
+                else:
+                    semantic = None
+                self.surfaces.append(Surface(boundary, semantic, '%s:%d:%d' % (oid, g, s), lod, vertices))
+
+    def polygons(self, lod=None):
+        """Surfaces of the city object and of its children, with a lod only the ones in that level of detail."""
+        found = [s for s in self.surfaces if lod is None or s.lod == lod]
+        for child in self.children:
+            found.extend(child.polygons(lod))
+        return found
+
+    def highest_lod(self):
+        """Highest level of detail of the surfaces of the city object and of its children, or None if it is not known."""
+        lods = set(s.lod for s in self.polygons())
+        lods.discard(None)
+        if not lods:
+            return None
+        return max(lods)
+
+    def count_instances(self):
+        """Number of the instances of geometry templates of the city object and of its children."""
+        return self.instances + sum(child.count_instances() for child in self.children)
+
+
+class CityModel(object):
+    """A CityJSON file: the top-level city objects (the ones without parents), in the order of the file,
+    and the vertices as an array, with the transform of the quantised coordinates applied."""
+
+    def __init__(self, objects, vertices, transform=None):
+        if transform:
+            vertices = vertices * np.array(transform['scale'], dtype=np.float64) + np.array(transform['translate'], dtype=np.float64)
+        self.vertices = vertices
+        wrapped = collections.OrderedDict()
+        for oid, data in objects.items():
+            wrapped[oid] = CityObject(oid, data, vertices)
+        for oid, data in objects.items():
+            wrapped[oid].children = [wrapped[c] for c in data.get('children') or [] if c in wrapped]
+        self.cityobjects = [wrapped[oid] for oid, data in objects.items() if not data.get('parents')]
+
+
+def flatten(geometry, values):
+    """Yields the surfaces of a CityJSON geometry (MultiSurface, CompositeSurface, Solid, MultiSolid or CompositeSolid)
+    with their semantic values, as (rings, value). The other geometries have no surfaces."""
+    depth = {'MultiSurface' : 0, 'CompositeSurface' : 0, 'Solid' : 1, 'MultiSolid' : 2, 'CompositeSolid' : 2}.get(geometry.get('type'))
+    if depth is None:
+        return []
+    return _flatten(geometry.get('boundaries') or [], values, depth)
+
+def _flatten(boundaries, values, depth):
+    for n, boundary in enumerate(boundaries):
+        if values is not None and n < len(values):
+            value = values[n]
+        else:
+            value = None
+        if depth == 0:
+            yield boundary, value
+        else:
+            for item in _flatten(boundary, value, depth - 1):
+                yield item
+
+
+def read(source):
+    """Reads a CityJSON file opened with markup3dmodule.GMLopen() (a path or a file object) into a CityModel.
+    With ijson the file is streamed: the coordinates go straight into an array, without a list for each vertex, but the
+    city objects are all kept as dicts until the CityModel is built. Otherwise the whole file is loaded with json."""
+    if isinstance(source, basestring):
+        with open(source, 'rb') as f:
+            return read(f)
+    if ijson is None:
+        data = json.load(source, object_pairs_hook=collections.OrderedDict)
+        vertices = np.array(data.get('vertices') or [], dtype=np.float64).reshape(-1, 3)
+        return CityModel(data.get('CityObjects') or {}, vertices, data.get('transform'))
+    objects = collections.OrderedDict()
+    members = {}
+    coordinates = array.array('d')
+    builder = None
+    for prefix, event, value in ijson.parse(source):
+        #-- ijson gives the non-integer numbers as Decimal
+        if event == 'number' and isinstance(value, decimal.Decimal):
+            value = float(value)
+        if builder is not None:
+            #-- Building a city object or a member of the root, until its value is complete
+            builder.event(event, value)
+            if event in ('start_map', 'start_array'):
+                depth += 1
+            elif event in ('end_map', 'end_array'):
+                depth -= 1
+            if depth == 0:
+                target[key] = builder.value
+                builder = None
+        elif prefix == 'vertices.item.item':
+            coordinates.append(value)
+        elif event == 'map_key' and prefix == 'CityObjects':
+            builder, depth, target, key = ObjectBuilder(), 0, objects, value
+        elif event == 'map_key' and prefix == '' and value == 'transform':
+            builder, depth, target, key = ObjectBuilder(), 0, members, value
+    if coordinates:
+        vertices = np.frombuffer(coordinates, dtype=np.float64).reshape(-1, 3)
+    else:
+        vertices = np.zeros((0, 3))
+    return CityModel(objects, vertices, members.get('transform'))
+
+
+def scan(source):
+    """Counts the city objects (the top-level ones), the surfaces and the coordinate values of their rings (three per
+    vertex index) of a CityJSON file opened with markup3dmodule.GMLopen(), for markup3dmodule.scanSource().
+    With ijson the file is streamed through its events without building the city objects, otherwise it is read()."""
+    counts = {'objects' : 0, 'polygons' : 0, 'coordinates' : 0}
+    if ijson is None:
+        model = read(source)
+        counts['objects'] = len(model.cityobjects)
+        for o in model.cityobjects:
+            for surface in o.polygons():
+                counts['polygons'] += 1
+                counts['coordinates'] += 3 * sum(len(ring) for ring in surface.rings)
+        return counts
+    if isinstance(source, basestring):
+        with open(source, 'rb') as f:
+            return scan(f)
+    oid = None
+    #-- The arrays open in the boundaries of a geometry: 0 unknown, 1 a ring (of vertex indices), 2 a surface (of rings)
+    stack = None
+    for prefix, event, value in ijson.parse(source):
+        if stack is not None:
+            if event == 'start_array':
+                stack.append(0)
+            elif event == 'number' and stack:
+                stack[-1] = 1
+                #-- The vertex index of a geometry instance is not in a ring
+                if len(stack) > 1:
+                    counts['coordinates'] += 3
+            elif event == 'end_array':
+                kind = stack.pop()
+                if kind == 2:
+                    counts['polygons'] += 1
+                if kind == 1 and len(stack) > 1:
+                    stack[-1] = 2
+                if not stack:
+                    stack = None
+        elif event == 'map_key' and prefix == 'CityObjects':
+            counts['objects'] += 1
+            oid = value
+        elif event == 'map_key' and value == 'parents' and prefix == 'CityObjects.' + oid:
+            #-- The children are converted with their parents
+            counts['objects'] -= 1
+        elif event == 'map_key' and value == 'boundaries' and prefix.endswith('.geometry.item'):
+            stack = []
+    return counts
@@ -29,6 +29,14 @@
 # THE SOFTWARE.
 
 from lxml import etree
+import os
+import glob
+import gzip
+import bz2
+import zipfile
+import contextlib
+import re
+import cityjson3dmodule
 
 #-- Name spaces
 ns_citygml="http://www.opengis.net/citygml/2.0"
@@ -50,6 +58,137 @@ nsmap = {
     'dem' : ns_dem
 }
 
+#-- Supported extensions, plain and compressed
+GMLextensions = ('.gml', '.xml')
+JSONextensions = ('.json',)
+COMPRESSIONextensions = ('.gz', '.bz2')
+
+#-- Bytes read from the start of a .json file to tell CityJSON from the other JSON files (e.g. the indices and the manifests of the shards)
+SNIFFbytes = 64 * 1024
+
+#-- Properties of the geometries in a level of detail, e.g. lod2MultiSurface and lod1Solid
+LODproperty = re.compile(r'^(?:\{[^}]*\})?lod([0-4])[A-Z]')
+
+def GMLsources(directory):
+    """Finds the CityGML (and CityJSON) files in a directory, also compressed (.gml.gz, .xml.bz2, .json.gz, ...) and in ZIP archives.
+    Returns a list of (name, path, member) tuples, where member is the file in the ZIP archive or None.
+    The names of the files in the folders of a ZIP archive are qualified with the folders (e.g. sub_Delft for sub/Delft.gml),
+    so the files with the same name in different folders are not written to the same OBJ.
+    The .json files which are not CityJSON (see sniffCityJSON()) are left out."""
+    extensions = GMLextensions + JSONextensions
+    sources = []
+    for path in sorted(glob.glob(os.path.join(directory, '*'))):
+        f = os.path.basename(path)
+        lower = f.lower()
+        if lower.endswith(extensions):
+            sources.append((f[:f.rfind('.')], path, None))
+        elif lower.endswith(COMPRESSIONextensions) and lower[:lower.rfind('.')].endswith(extensions):
+            stem = f[:f.rfind('.')]
+            sources.append((stem[:stem.rfind('.')], path, None))
+        elif lower.endswith('.zip'):
+            with zipfile.ZipFile(path) as archive:
+                for member in archive.namelist():
+                    if member.lower().endswith(extensions):
+                        m = member[:member.rfind('.')].strip('/')
+                        sources.append((m.replace('/', '_'), path, member))
+    return [(name, path, member) for name, path, member in sources if not isCityJSON(path, member) or sniffCityJSON(path, member)]
+
+
+@contextlib.contextmanager
+def GMLopen(path, member=None):
+    """Opens a CityGML file found by GMLsources() for the parser.
+    Compressed files are decompressed on the fly while they are parsed.
+    Uncompressed files are passed as a path, which lxml reads itself, without copying them through Python."""
+    lower = path.lower()
+    if member is not None:
+        archive = zipfile.ZipFile(path)
+        try:
+            source = archive.open(member)
+            try:
+                yield source
+            finally:
+                source.close()
+        finally:
+            archive.close()
+    elif lower.endswith('.gz'):
+        source = gzip.open(path, 'rb')
+        try:
+            yield source
+        finally:
+            source.close()
+    elif lower.endswith('.bz2'):
+        source = bz2.BZ2File(path, 'rb')
+        try:
+            yield source
+        finally:
+            source.close()
+    else:
+        yield path
+
+
+def isCityJSON(path, member=None):
+    """Checks if a file found by GMLsources() is a CityJSON file, from its extension."""
+    name = (member or path).lower()
+    if name.endswith(COMPRESSIONextensions):
+        name = name[:name.rfind('.')]
+    return name.endswith(JSONextensions)
+
+
+def sniffCityJSON(path, member=None):
+    """Checks if a .json file found by GMLsources() is CityJSON from its first bytes, which have its "type" : "CityJSON",
+    or its "CityObjects" if the members are sorted. The other JSON files, e.g. the ones written by the tool, are not."""
+    with GMLopen(path, member) as source:
+        if isinstance(source, basestring):
+            with open(source, 'rb') as f:
+                head = f.read(SNIFFbytes)
+        else:
+            head = source.read(SNIFFbytes)
+    return b'"CityJSON"' in head or b'"CityObjects"' in head
+
+
+def countMembers(path, member=None):
+    """Counts the cityObjectMembers of a CityGML file found by GMLsources(), streaming through it without building the tree.
+    For CityJSON the top-level city objects are counted."""
+    count = 0
+    with GMLopen(path, member) as source:
+        if isCityJSON(path, member):
+            return len(cityjson3dmodule.read(source).cityobjects)
+        for event, element in etree.iterparse(source, events=('end',), tag='{*}cityObjectMember'):
+            count += 1
+            #-- Free the parsed members
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+    return count
+
+
+def scanSource(path, member=None):
+    """Counts the cityObjectMembers, the polygons and the coordinate values of a file found by GMLsources(), for planning
+    the conversion. CityGML is streamed through and each counted element is freed once parsed, so the tree is never built, and
+    the coordinates are counted as words without converting them to floats. CityJSON is streamed through its events
+    (see cityjson3dmodule.scan()). Returns a dict with the objects, polygons and coordinates."""
+    scan = {'objects' : 0, 'polygons' : 0, 'coordinates' : 0}
+    with GMLopen(path, member) as source:
+        if isCityJSON(path, member):
+            return cityjson3dmodule.scan(source)
+        for event, element in etree.iterparse(source, events=('end',), tag=('{*}cityObjectMember', '{*}Polygon', '{*}posList', '{*}pos', '{*}coordinates')):
+            tag = element.tag[element.tag.rfind('}') + 1:]
+            if tag == 'Polygon':
+                scan['polygons'] += 1
+            elif tag == 'cityObjectMember':
+                scan['objects'] += 1
+            elif tag in ('posList', 'pos', 'coordinates') and element.text:
+                #-- The tuples of gml:coordinates are separated by commas
+                scan['coordinates'] += len(element.text.replace(',', ' ').split())
+            #-- Free the element and its parsed siblings, so at most the elements around the current polygon are kept
+            element.clear()
+            parent = element.getparent()
+            if parent is not None:
+                while element.getprevious() is not None:
+                    del parent[0]
+    return scan
+
+
 def polydecomposer(polygon):
     """Extracts the <gml:exterior> and <gml:interior> of a <gml:Polygon>."""
     exter = polygon.findall('.//{%s}exterior' %ns_gml)
@@ -57,12 +196,212 @@ def polydecomposer(polygon):
     return exter, inter
 
 
-def polygonFinder(GMLelement):
-    """Find the <gml:polygon> element."""
+def polygonFinder(GMLelement, index=None, lod=None):
+    """Find the <gml:polygon> element.
+    With the index of gml:ids (see idIndex) also the polygons referenced through xlink:href are found.
+    Each polygon is returned once, even if it is both inline and referenced.
+    With a lod only the polygons in that level of detail are found (see LOD)."""
     polygonsLocal = GMLelement.findall('.//{%s}Polygon' %ns_gml)
+    if lod is not None:
+        polygonsLocal = [p for p in polygonsLocal if LOD(p, GMLelement) == lod]
+    #-- The prototypes of implicit geometries are in local coordinates, see implicitGeometry()
+    excluded = set()
+    for relative in GMLelement.iterfind('.//{*}relativeGMLGeometry'):
+        excluded.update(relative.iter())
+    if excluded:
+        polygonsLocal = [p for p in polygonsLocal if p not in excluded]
+    if not index:
+        return polygonsLocal
+    found = set(polygonsLocal)
+    for ref in GMLelement.iterfind('.//*[@{%s}href]' %ns_xlink):
+        if ref in excluded:
+            continue
+        #-- The level of detail of a referenced polygon is the one of the reference
+        if lod is not None and LOD(ref, GMLelement) != lod:
+            continue
+        for p in resolveXlink(ref, index):
+            if p not in found:
+                found.add(p)
+                polygonsLocal.append(p)
     return polygonsLocal
 
 
+def idIndex(root):
+    """Index of the elements referenced through xlink:href, by their gml:id.
+    Only the referenced ids are stored, so the index is small and it is built with one pass over the tree."""
+    hrefs = set()
+    for href in root.xpath('//@xlink:href', namespaces={'xlink' : ns_xlink}):
+        hrefs.add(href[href.rfind('#') + 1:])
+    index = {}
+    if not hrefs:
+        return index
+    for element in root.iter():
+        gid = element.get('{%s}id' %ns_gml)
+        if gid is not None and gid in hrefs:
+            index[gid] = element
+    return index
+
+
+def resolveXlink(ref, index, visited=None):
+    """Polygons of the geometry referenced by the xlink:href of the element ref, following nested references."""
+    if visited is None:
+        visited = set()
+    href = ref.get('{%s}href' %ns_xlink)
+    gid = href[href.rfind('#') + 1:]
+    target = index.get(gid)
+    #-- Only geometries are resolved, not other city objects
+    if target is None or gid in visited or not target.tag.startswith('{%s}' %ns_gml):
+        return []
+    visited.add(gid)
+    if target.tag == '{%s}Polygon' %ns_gml:
+        return [target]
+    polygons = target.findall('.//{%s}Polygon' %ns_gml)
+    for nested in target.iterfind('.//*[@{%s}href]' %ns_xlink):
+        polygons.extend(resolveXlink(nested, index, visited))
+    return polygons
+
+
+def sharedPolygons(index):
+    """Polygons which are referenced through xlink:href, and can therefore be used by several objects."""
+    shared = set()
+    for gid in index:
+        target = index[gid]
+        if target.tag == '{%s}Polygon' %ns_gml:
+            shared.add(target)
+        elif target.tag.startswith('{%s}' %ns_gml):
+            shared.update(target.findall('.//{%s}Polygon' %ns_gml))
+    return shared
+
+
+def implicitGeometries(GMLelement, lod=None):
+    """Find the <ImplicitGeometry> elements of a city object, with a lod only the ones in that level of detail."""
+    implicits = GMLelement.findall('.//{*}ImplicitGeometry')
+    if lod is not None:
+        implicits = [i for i in implicits if LOD(i, GMLelement) == lod]
+    return implicits
+
+
+def LOD(element, top=None):
+    """Level of detail of a geometry element, from the nearest lodX property (e.g. lod2MultiSurface) above it,
+    up to the top element. Terrain (dem) has the level of detail in a <dem:lod> element instead.
+    Returns None if the level of detail is not known."""
+    ancestor = element
+    while ancestor is not None:
+        if isinstance(ancestor.tag, basestring):
+            match = LODproperty.match(ancestor.tag)
+            if match:
+                return int(match.group(1))
+        if ancestor is top:
+            break
+        ancestor = ancestor.getparent()
+    ancestor = element
+    while ancestor is not None:
+        lod = ancestor.find('{*}lod')
+        if lod is not None and lod.text and lod.text.strip().isdigit():
+            return int(lod.text)
+        if ancestor is top:
+            break
+        ancestor = ancestor.getparent()
+    return None
+
+
+def highestLOD(GMLelement, index=None):
+    """Highest level of detail of the polygons and implicit geometries of a city object, or None if it is not known."""
+    lods = set()
+    for p in polygonFinder(GMLelement):
+        lods.add(LOD(p, GMLelement))
+    if index:
+        for ref in GMLelement.iterfind('.//*[@{%s}href]' %ns_xlink):
+            lods.add(LOD(ref, GMLelement))
+    for i in implicitGeometries(GMLelement):
+        lods.add(LOD(i, GMLelement))
+    lods.discard(None)
+    if not lods:
+        return None
+    return max(lods)
+
+
+def implicitGeometry(implicit, index=None):
+    """Extracts the prototype geometry (<relativeGMLGeometry>, inline or referenced through xlink:href),
+    the 4x4 <transformationMatrix> (row by row) and the <referencePoint> of an <ImplicitGeometry>.
+    The real-world coordinates of a point p of the prototype are matrix * p + reference point."""
+    prototype = None
+    relative = implicit.find('{*}relativeGMLGeometry')
+    if relative is not None:
+        href = relative.get('{%s}href' %ns_xlink)
+        if href is not None:
+            if index:
+                prototype = index.get(href[href.rfind('#') + 1:])
+        elif len(relative):
+            prototype = relative[0]
+    matrix = [1.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0, 1.0]
+    transformation = implicit.find('{*}transformationMatrix')
+    if transformation is not None and transformation.text:
+        matrix = [float(m) for m in transformation.text.split()]
+        assert(len(matrix) == 16)
+    matrix = [matrix[0:4], matrix[4:8], matrix[8:12], matrix[12:16]]
+    referencepoint = [0.0, 0.0, 0.0]
+    pos = implicit.find('{*}referencePoint/{%s}Point/{%s}pos' % (ns_gml, ns_gml))
+    if pos is not None:
+        referencepoint = [float(c) for c in pos.text.split()[:3]]
+    return prototype, matrix, referencepoint
+
+
+def appearances(root, theme=None):
+    """Reads the textures (<app:ParameterizedTexture>) and materials (<app:X3DMaterial>) of the appearances of a theme,
+    by default of the first theme found. Returns {polygon: (material, rings)}, where material is ('texture', image URI) or
+    ('x3d', (diffuse, specular, emissive, ambientIntensity, shininess, transparency)), and rings are the texture coordinates
+    of a texture by the gml:id of the ring, {ring id: [[u, v], ...]}, or None for a material.
+    The targets may be polygons or surfaces containing them. Textures generated with <app:TexCoordGen> are not supported."""
+    targets = {}
+    for appearance in root.iter('{*}Appearance'):
+        t = appearance.findtext('{*}theme')
+        if theme is None:
+            theme = t
+        if t != theme:
+            continue
+        for texture in appearance.iter('{*}ParameterizedTexture'):
+            image = texture.findtext('{*}imageURI')
+            if not image:
+                continue
+            for target in texture.iter('{*}target'):
+                uri = target.get('uri')
+                if not uri:
+                    continue
+                rings = {}
+                for coordinates in target.iter('{*}textureCoordinates'):
+                    values = [float(c) for c in coordinates.text.split()]
+                    rings[coordinates.get('ring', '').lstrip('#')] = [values[k:k + 2] for k in range(0, len(values) - 1, 2)]
+                if rings:
+                    targets[uri.lstrip('#')] = (('texture', image.strip()), rings)
+        for material in appearance.iter('{*}X3DMaterial'):
+            properties = []
+            for name, default in [('diffuseColor', '0.8 0.8 0.8'), ('specularColor', '1 1 1'), ('emissiveColor', '0 0 0'),
+                                  ('ambientIntensity', '0.2'), ('shininess', '0.2'), ('transparency', '0')]:
+                values = tuple(float(c) for c in (material.findtext('{*}' + name) or default).split())
+                if len(values) == 1:
+                    values = values[0]
+                properties.append(values)
+            for target in material.iter('{*}target'):
+                if target.text:
+                    #-- Textures take precedence over the materials
+                    targets.setdefault(target.text.strip().lstrip('#'), (('x3d', tuple(properties)), None))
+    polygons = {}
+    if not targets:
+        return polygons
+    for element in root.iter():
+        gid = element.get('{%s}id' %ns_gml)
+        if gid not in targets:
+            continue
+        if element.tag == '{%s}Polygon' %ns_gml:
+            polygons[element] = targets[gid]
+        else:
+            #-- The polygon itself can be the target of another appearance, it comes later in the document
+            for p in element.iter('{%s}Polygon' %ns_gml):
+                polygons.setdefault(p, targets[gid])
+    return polygons
+
+
 def GMLpoints(ring):
     "Extract points from a <gml:LinearRing>."
     #-- List containing points
@@ -0,0 +1,325 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+
+# This code is part of the CityGML2OBJs package
+
+# Copyright (c) 2014 
+# Filip Biljecki
+# Delft University of Technology
+# fbiljecki@gmail.com
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import math
+import copy
+import os
+import heapq
+import shutil
+import tempfile
+import collections
+import numpy as np
+
+#-- Size of the simulated post-transform vertex cache, and the scores of the vertices in Forsyth's optimisation
+VERTEX_CACHE_SIZE = 32
+CACHE_DECAY_POWER = 1.5
+LAST_TRIANGLE_SCORE = 0.75
+VALENCE_BOOST_SCALE = 2.0
+VALENCE_BOOST_POWER = 0.5
+
+#-- Offsets of the cells neighbouring (and including) a cell of the spatial hash
+NEIGHBOURS = [(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)]
+
+def grid_key(point, tolerance=None):
+    """Key of the point in the spatial hash.
+    Without a tolerance the point itself is the key (exact matching), otherwise the cell of the grid with the size of the tolerance."""
+    if not tolerance:
+        return (point[0], point[1], point[2])
+    return (int(math.floor(point[0] / tolerance)), int(math.floor(point[1] / tolerance)), int(math.floor(point[2] / tolerance)))
+
+def weld_lookup(point, grid, list_vertices, tolerance=None):
+    """Finds the index of the vertex in list_vertices which is within the tolerance of the point, None if there is none.
+    The grid is the spatial hash of list_vertices built with weld_insert(). With a tolerance the neighbouring cells are checked as well."""
+    if not tolerance:
+        return grid.get(grid_key(point))
+    cx, cy, cz = grid_key(point, tolerance)
+    tolerance2 = tolerance * tolerance
+    for dx, dy, dz in NEIGHBOURS:
+        for idx in grid.get((cx + dx, cy + dy, cz + dz), ()):
+            q = list_vertices[idx]
+            if (q[0] - point[0])**2 + (q[1] - point[1])**2 + (q[2] - point[2])**2 <= tolerance2:
+                return idx
+    return None
+
+def weld_insert(point, grid, list_vertices, tolerance=None):
+    """Appends the point to list_vertices and registers it in the spatial hash. Returns its (zero-based) index."""
+    idx = len(list_vertices)
+    list_vertices.append(point)
+    if not tolerance:
+        grid[grid_key(point)] = idx
+    else:
+        grid.setdefault(grid_key(point, tolerance), []).append(idx)
+    return idx
+
+#-- Rough estimate of the size of one entry (the key, the slot and the index) in the spatial hash, in bytes, for the cap of --weld-memory
+HASH_BYTES_PER_VERTEX = 200
+
+def external_dedup(list_vertices, chunk_size, tolerance=None):
+    """Deduplicates the vertices with an external sort, for when their spatial hash would grow over its size cap.
+    The keys of the vertices are sorted in chunks of chunk_size, which are spilled to disk and merged. It replaces only the
+    spatial hash: the vertices, the unique vertices and the remapping are in the memory.
+    Returns the list of unique vertices and the remapping of the old (zero-based) indices to the new ones.
+    With a tolerance the vertices are matched by their cell of the grid, which approximates the welding of weld_lookup()."""
+    nvertices = len(list_vertices)
+    chunk_size = max(int(chunk_size), 1)
+    tmpdir = tempfile.mkdtemp(prefix='citygml2objs-')
+    try:
+        #-- Sort each chunk and spill it to disk
+        chunks = []
+        for start in range(0, nvertices, chunk_size):
+            keys = np.array([grid_key(v, tolerance) for v in list_vertices[start:start + chunk_size]], dtype=np.float64)
+            order = np.lexsort((keys[:, 2], keys[:, 1], keys[:, 0]))
+            records = np.empty((len(order), 4), dtype=np.float64)
+            records[:, :3] = keys[order]
+            records[:, 3] = order + start
+            chunkpath = os.path.join(tmpdir, 'chunk%d.npy' % len(chunks))
+            np.save(chunkpath, records)
+            chunks.append(chunkpath)
+            del keys, records
+        #-- Merge the sorted chunks and number the unique vertices
+        def read_chunk(chunkpath):
+            for r in np.load(chunkpath, mmap_mode='r'):
+                yield (r[0], r[1], r[2]), int(r[3])
+        remap = np.empty(nvertices, dtype=np.int64)
+        unique_vertices = []
+        previous = None
+        for key, idx in heapq.merge(*[read_chunk(c) for c in chunks]):
+            if key != previous:
+                unique_vertices.append(list_vertices[idx])
+                previous = key
+            remap[idx] = len(unique_vertices) - 1
+    finally:
+        shutil.rmtree(tmpdir)
+    return unique_vertices, remap
+
+def remap_faces(lines, remap):
+    """Renumbers the (one-based) indices of the OBJ faces in lines with the remapping from external_dedup().
+    The faces are lists of indices, the other lines (e.g. o and usemtl) are kept as they are.
+    Faces with texture coordinates keep them. Faces left with fewer than three distinct vertices, whose vertices were
+    merged within the weld tolerance, are dropped, as in the conversion.
+    Returns the lines and the positions of the dropped faces among the faces."""
+    remapped = []
+    dropped = []
+    nfaces = 0
+    for line in lines:
+        if isinstance(line, list):
+            face = copy.copy(line)
+            face[:] = [int(remap[v - 1]) + 1 for v in line]
+            if len(set(face)) < 3:
+                dropped.append(nfaces)
+            else:
+                remapped.append(face)
+            nfaces += 1
+        else:
+            remapped.append(line)
+    return remapped, dropped
+
+def edge_topology(faces):
+    """Checks if the faces (lists of vertex indices) form a closed 2-manifold shell, with a hash map of their directed edges,
+    in time linear in the number of edges. An edge of a closed shell is used by two faces, once in each direction.
+    Returns the number of edges, of boundary edges (used by one face), of non-manifold edges (used by more than two faces)
+    and of orientation conflicts (edges used by two faces in the same direction)."""
+    directed = {}
+    for face in faces:
+        n = len(face)
+        for k in range(n):
+            a = face[k]
+            b = face[(k + 1) % n]
+            if a != b:
+                directed[(a, b)] = directed.get((a, b), 0) + 1
+    nedges = 0
+    boundary = 0
+    nonmanifold = 0
+    conflicts = 0
+    for (a, b), forward in directed.items():
+        backward = directed.get((b, a), 0)
+        #-- Each edge is counted once, from its smaller vertex if it is used in both directions
+        if backward and a > b:
+            continue
+        nedges += 1
+        if forward + backward == 1:
+            boundary += 1
+        elif forward + backward > 2:
+            nonmanifold += 1
+        elif forward == 2 or backward == 2:
+            conflicts += 1
+    return nedges, boundary, nonmanifold, conflicts
+
+def cache_misses(faces, cache_size=VERTEX_CACHE_SIZE):
+    """Number of vertices of the faces (lists of vertex indices), drawn in their order, which miss an LRU post-transform
+    vertex cache of cache_size vertices, the cache simulated by forsyth_order(). Divided by the number of triangles it is
+    the average cache miss ratio (ACMR)."""
+    cache = collections.OrderedDict()
+    misses = 0
+    for face in faces:
+        for v in face:
+            if v in cache:
+                del cache[v]
+            else:
+                misses += 1
+            cache[v] = True
+            if len(cache) > cache_size:
+                cache.popitem(last=False)
+    return misses
+
+def _vertex_score(position, valence, cache_size):
+    """Score of a vertex in Forsyth's optimisation from its position in the cache (-1 if not in it), and the number of
+    the remaining faces which use it."""
+    if valence == 0:
+        return -1.0
+    if position < 0:
+        score = 0.0
+    elif position < 3:
+        #-- The vertices of the last face score the same, so its neighbours are not favoured by their position in it
+        score = LAST_TRIANGLE_SCORE
+    else:
+        score = (1.0 - (position - 3) / float(cache_size - 3)) ** CACHE_DECAY_POWER
+    return score + VALENCE_BOOST_SCALE * valence ** -VALENCE_BOOST_POWER
+
+def forsyth_order(faces, cache_size=VERTEX_CACHE_SIZE):
+    """Order of the faces (lists of vertex indices) which reuses the vertices in the post-transform vertex cache, with
+    Tom Forsyth's linear-speed vertex cache optimisation. The next face is the one with the highest score among the faces
+    of the vertices in a simulated LRU cache, where a vertex scores by its position in the cache and by the number of the
+    remaining faces which use it (so the isolated ones are done first). When no face of the cache remains, the next face
+    is the first remaining one. Returns the indices of the faces in the new order."""
+    nfaces = len(faces)
+    unique = [list(collections.OrderedDict.fromkeys(face)) for face in faces]
+    uses = {}
+    for t, face in enumerate(unique):
+        for v in face:
+            uses.setdefault(v, []).append(t)
+    position = dict((v, -1) for v in uses)
+    score = dict((v, _vertex_score(-1, len(uses[v]), cache_size)) for v in uses)
+    face_score = [sum(score[v] for v in face) for face in unique]
+    added = [False] * nfaces
+    order = []
+    cache = []
+    best = None
+    if nfaces:
+        best = max(range(nfaces), key=lambda t: face_score[t])
+    remaining = 0
+    while best is not None:
+        order.append(best)
+        added[best] = True
+        face = unique[best]
+        for v in face:
+            uses[v].remove(best)
+        #-- The vertices of the face move to the front of the cache, the last ones drop out
+        cache = face + [v for v in cache if v not in face]
+        evicted = cache[cache_size:]
+        cache = cache[:cache_size]
+        for v in evicted:
+            position[v] = -1
+            score[v] = _vertex_score(-1, len(uses[v]), cache_size)
+        for k, v in enumerate(cache):
+            position[v] = k
+            score[v] = _vertex_score(k, len(uses[v]), cache_size)
+        best = None
+        best_score = None
+        for v in cache + evicted:
+            for t in uses[v]:
+                face_score[t] = sum(score[u] for u in unique[t])
+                if position[v] >= 0:
+                    if best_score is None or face_score[t] > best_score:
+                        best = t
+                        best_score = face_score[t]
+        if best is None:
+            while remaining < nfaces and added[remaining]:
+                remaining += 1
+            if remaining < nfaces:
+                best = remaining
+    return order
+
+def vertex_cache_order(lines, cache_size=VERTEX_CACHE_SIZE):
+    """Reorders the triangles in the lines (in the format of remap_faces()) with forsyth_order(), within each run of
+    triangles between the other lines (o, usemtl), so the objects and the materials of the faces are kept.
+    The runs with other faces (polygons) are kept as they are, and so are the runs with at most cache_size vertices,
+    whose vertices miss the cache once in any order, and the runs whose cache misses the new order does not reduce.
+    Returns the new lines, the order of the faces (the indices of the faces of the lines), the number of the reordered
+    triangles, and their cache misses (see cache_misses()) before and after."""
+    reordered = []
+    order = []
+    counts = [0, 0, 0]
+    run = []
+
+    def flush(run):
+        first = len(order)
+        run_order = range(len(run))
+        if all(len(face) == 3 for face in run):
+            misses = cache_misses(run, cache_size)
+            counts[0] += len(run)
+            counts[1] += misses
+            if len(set(v for face in run for v in face)) > cache_size:
+                new_order = forsyth_order(run, cache_size)
+                new_misses = cache_misses([run[k] for k in new_order], cache_size)
+                #-- The heuristic may lose on small or odd runs, then their order is kept
+                if new_misses < misses:
+                    run_order = new_order
+                    misses = new_misses
+            counts[2] += misses
+        reordered.extend(run[k] for k in run_order)
+        order.extend(first + k for k in run_order)
+
+    for line in lines:
+        if isinstance(line, list):
+            run.append(line)
+        else:
+            if run:
+                flush(run)
+                run = []
+            reordered.append(line)
+    if run:
+        flush(run)
+    return reordered, order, counts[0], counts[1], counts[2]
+
+def renumber_first_use(lines, shift, nvertices):
+    """Renumbers the vertices shift + 1 ... shift + nvertices (one-based indices) used by the faces in the lines
+    (in the format of remap_faces()) in the order they are first used, and the unused ones after them.
+    Returns the new lines, and the old positions (zero-based, from shift) of the vertices in the new order."""
+    remap = {}
+    old = []
+    for line in lines:
+        if isinstance(line, list):
+            for v in line:
+                if shift < v <= shift + nvertices and v not in remap:
+                    remap[v] = shift + len(old) + 1
+                    old.append(v - shift - 1)
+    used = set(old)
+    old.extend(k for k in range(nvertices) if k not in used)
+    renumbered = []
+    for line in lines:
+        if isinstance(line, list):
+            face = copy.copy(line)
+            face[:] = [remap.get(v, v) for v in line]
+            renumbered.append(face)
+        else:
+            renumbered.append(line)
+    return renumbered, old
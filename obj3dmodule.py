@@ -0,0 +1,242 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+
+# This code is part of the CityGML2OBJs package
+
+# Copyright (c) 2014 
+# Filip Biljecki
+# Delft University of Technology
+# fbiljecki@gmail.com
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import collections
+import numpy as np
+
+#-- Number of vertices or faces formatted at once
+CHUNK = 65536
+
+def vertex_template(precision=None):
+    """Format of one vertex. Without a precision the coordinates are written with 12 significant digits (like str()),
+    otherwise with a fixed number of decimals, e.g. 3 for millimetres."""
+    if precision is None:
+        return "v %.12g %.12g %.12g\n"
+    return "v %%.%df %%.%df %%.%df\n" % (precision, precision, precision)
+
+def format_vertices(list_vertices, precision=None):
+    """Formats the vertices in OBJ in bulk, applying the template to chunks of the array of coordinates at once.
+    With a precision the coordinates are first rounded (half to even), so the output is deterministic."""
+    if len(list_vertices) == 0:
+        return ""
+    coords = np.asarray(list_vertices, dtype=np.float64).reshape(-1, 3)
+    if precision is not None:
+        coords = np.round(coords, precision)
+    #-- Adding zero gets rid of the negative zeros
+    coords = coords + 0.0
+    template = vertex_template(precision)
+    chunks = []
+    for start in range(0, len(coords), CHUNK):
+        chunk = coords[start:start + CHUNK]
+        chunks.append((template * len(chunk)) % tuple(chunk.ravel().tolist()))
+    return "".join(chunks)
+
+class TexturedFace(list):
+    """Face with texture coordinates: a list of one-based indices of the vertices, with the one-based indices
+    of the texture coordinates (vt) of its vertices in texcoords."""
+
+    def __init__(self, vertices, texcoords):
+        list.__init__(self, vertices)
+        self.texcoords = texcoords
+
+def format_texcoords(list_texcoords):
+    """Formats the texture coordinates ([u, v] lists) in OBJ in bulk."""
+    if len(list_texcoords) == 0:
+        return ""
+    uvs = np.asarray([uv[:2] for uv in list_texcoords], dtype=np.float64) + 0.0
+    chunks = []
+    for start in range(0, len(uvs), CHUNK):
+        chunk = uvs[start:start + CHUNK]
+        chunks.append(("vt %.9g %.9g\n" * len(chunk)) % tuple(chunk.ravel().tolist()))
+    return "".join(chunks)
+
+def format_faces(lines):
+    """Formats the faces in OBJ in bulk. The lines are either faces (lists of one-based indices of the vertices,
+    or TexturedFaces) or other statements as strings (e.g. o and usemtl), which are written as they are.
+    Consecutive faces with the same number of vertices are formatted at once with one template."""
+    chunks = []
+    run = []
+
+    def flush(run):
+        n = len(run[0])
+        if isinstance(run[0], TexturedFace):
+            template = "f" + " %d/%d" * n + "\n"
+        else:
+            template = "f" + " %d" * n + "\n"
+        for start in range(0, len(run), CHUNK):
+            part = run[start:start + CHUNK]
+            indices = np.asarray(part, dtype=np.int64)
+            if isinstance(run[0], TexturedFace):
+                indices = np.dstack((indices, np.asarray([f.texcoords for f in part], dtype=np.int64)))
+            chunks.append((template * len(part)) % tuple(indices.ravel().tolist()))
+
+    for line in lines:
+        if not isinstance(line, list):
+            if run:
+                flush(run)
+                run = []
+            chunks.append(line)
+        else:
+            if run and (len(line) != len(run[0]) or isinstance(line, TexturedFace) != isinstance(run[0], TexturedFace)):
+                flush(run)
+                run = []
+            run.append(line)
+    if run:
+        flush(run)
+    return "".join(chunks)
+
+def group_materials(lines):
+    """Groups the faces of each object (between o statements) by their material, so each material is set once per object
+    with one usemtl statement. The faces without a material come first, then the materials in the order they first appear.
+    The lines are in the format of format_faces()."""
+    grouped = []
+    groups = collections.OrderedDict()
+    groups[None] = []
+    material = None
+
+    def flush(groups):
+        for m in groups:
+            if groups[m]:
+                if m is not None:
+                    grouped.append(m)
+                grouped.extend(groups[m])
+        groups.clear()
+        groups[None] = []
+
+    for line in lines:
+        if isinstance(line, list):
+            groups.setdefault(material, []).append(line)
+        elif line.startswith('usemtl '):
+            material = line
+        else:
+            flush(groups)
+            grouped.append(line)
+    flush(groups)
+    return grouped
+
+def line_offsets(text, offset=0):
+    """Byte offsets in the file of the starts of the lines of a text which starts at offset, followed by the end of the text.
+    Line j of the text spans [starts[j], starts[j + 1])."""
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    ends = np.flatnonzero(np.frombuffer(text, dtype=np.uint8) == ord('\n')) + 1
+    if len(ends) and ends[-1] == len(text):
+        return np.concatenate(([0], ends)) + offset
+    return np.concatenate(([0], ends, [len(text)])) + offset
+
+def object_index(lines, face_starts, vertex_starts, list_vertices, classes=None):
+    """Index of the objects (o statements) of an OBJ, for loading single objects without parsing the whole file.
+    The lines are the faces in the format of format_faces(), and face_starts and vertex_starts the line_offsets() of the text
+    of the faces and of the vertices, both starting with an empty line. For each object its name, the byte ranges [start, end)
+    of its faces (with its o and usemtl statements) and of the vertices they use, the ranges of the (one-based) indices
+    of its faces and vertices, its bounding box and the counts of its classes (from classes, by the name of the object)."""
+    objects = []
+    #-- Adding zero gets rid of the negative zeros
+    coords = np.asarray(list_vertices, dtype=np.float64).reshape(-1, 3) + 0.0
+    nfaces = 0
+
+    def flush(current, last):
+        if current is None:
+            return
+        name, first, first_face, used = current
+        entry = {'id' : name, 'face_bytes' : [int(face_starts[first + 1]), int(face_starts[last + 2])]}
+        if used:
+            used = np.unique(np.asarray(used, dtype=np.int64))
+            box = coords[used - 1]
+            entry['vertex_bytes'] = [int(vertex_starts[used[0]]), int(vertex_starts[used[-1] + 1])]
+            entry['vertex_range'] = [int(used[0]), int(used[-1])]
+            entry['face_range'] = [first_face, nfaces]
+            entry['bbox'] = box.min(axis=0).tolist() + box.max(axis=0).tolist()
+        if classes is not None:
+            entry['classes'] = classes.get(name, {})
+        objects.append(entry)
+
+    current = None
+    for k, line in enumerate(lines):
+        if isinstance(line, list):
+            nfaces += 1
+            if current is not None:
+                current[3].extend(line)
+        elif line.startswith('o '):
+            flush(current, k - 1)
+            current = (line[2:].strip(), k, nfaces + 1, [])
+    flush(current, len(lines) - 1)
+    return objects
+
+def offset_face(line, offsets):
+    """Offsets the indices of the vertices (v/vt/vn) of a face statement."""
+    tokens = line.split()
+    for n in range(1, len(tokens)):
+        refs = tokens[n].split('/')
+        for k, key in enumerate(('v', 'vt', 'vn')[:len(refs)]):
+            if refs[k]:
+                refs[k] = str(int(refs[k]) + offsets[key])
+        tokens[n] = '/'.join(refs)
+    return ' '.join(tokens) + '\n'
+
+def merge_objs(paths, target):
+    """Concatenates the OBJs into one, offsetting the indices of the faces by the vertices of the previous OBJs.
+    The header (comments and material libraries) is taken from the first OBJ, then come the vertices of all OBJs,
+    and then their faces. The OBJs are streamed line by line, in two passes."""
+    keys = ('v', 'vt', 'vn')
+    with open(target, 'w') as out:
+        #-- Header of the first OBJ, up to its first vertex
+        with open(paths[0]) as f:
+            for line in f:
+                if line.split(' ', 1)[0] in keys:
+                    break
+                out.write(line)
+        #-- Vertices
+        offsets = []
+        total = dict((key, 0) for key in keys)
+        for path in paths:
+            offsets.append(dict(total))
+            with open(path) as f:
+                for line in f:
+                    key = line.split(' ', 1)[0]
+                    if key in total:
+                        total[key] += 1
+                        out.write(line)
+        out.write("\n")
+        #-- Faces and the other statements after the header
+        for path, offset in zip(paths, offsets):
+            header = True
+            with open(path) as f:
+                for line in f:
+                    key = line.split(' ', 1)[0]
+                    if key in keys:
+                        header = False
+                    elif header or not line.strip():
+                        continue
+                    elif key == 'f':
+                        out.write(offset_face(line, offset))
+                    else:
+                        out.write(line)
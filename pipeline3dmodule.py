@@ -0,0 +1,233 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+
+# This code is part of the CityGML2OBJs package
+
+# Copyright (c) 2014 
+# Filip Biljecki
+# Delft University of Technology
+# fbiljecki@gmail.com
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import threading
+import collections
+import Queue
+import multiprocessing
+import polygon3dmodule
+
+#-- Marks the end of a queue
+DONE = object()
+
+#-- Rough costs of the conversion for the planner, measured on LoD2 buildings: the memory (bytes) of the interpreter
+#-- and of a worker process, and per city object, polygon and coordinate value (the tree and the output)
+BASEbytes = 32 * 1024 * 1024
+WORKERbytes = 64 * 1024 * 1024
+OBJECTbytes = 2048
+POLYGONbytes = 1024
+COORDINATEbytes = 120
+#-- And the time (s) to triangulate a polygon and to parse and index a coordinate value
+POLYGONseconds = 1.7e-4
+COORDINATEseconds = 4e-6
+#-- Time of triangulation which pays off starting a worker
+WORKERseconds = 2.0
+
+#-- Spare processes of the watchdog started up front, for when they cannot be forked later (see Watchdog)
+WATCHDOGspares = 4
+
+
+def prefetch(iterable, size=1):
+    """Consumes the iterable in a background thread and yields its items in order, with at most size items ahead of the
+    consumer, counting the one being produced (e.g. a file being parsed) with the ones waiting.
+    An exception raised by the iterable is raised again in the consumer."""
+    q = Queue.Queue()
+    slots = threading.Semaphore(size)
+    def produce():
+        try:
+            iterator = iter(iterable)
+            while True:
+                slots.acquire()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                q.put((item, None))
+        except Exception as e:
+            q.put((DONE, e))
+            return
+        q.put((DONE, None))
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    while True:
+        item, error = q.get()
+        slots.release()
+        if error is not None:
+            raise error
+        if item is DONE:
+            break
+        yield item
+
+
+class Writer(object):
+    """Single writer of files in the order they are submitted. With a size, the files are written by a background thread
+    with at most size files waiting, otherwise they are written immediately."""
+
+    def __init__(self, size=0):
+        self.error = None
+        self.thread = None
+        if size:
+            self.queue = Queue.Queue(maxsize=size)
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            if job is DONE:
+                return
+            #-- After a failure the remaining files are dropped, the error is raised in the main thread
+            if self.error is not None:
+                continue
+            try:
+                self.dump(*job)
+            except Exception as e:
+                self.error = e
+
+    def dump(self, path, function, args):
+        #-- The text is produced in chunks by function(*args)
+        with open(path, 'w') as f:
+            for chunk in function(*args):
+                f.write(chunk)
+
+    def write(self, path, function, *args):
+        """Writes the chunks of text produced by function(*args) to the path."""
+        if self.error is not None:
+            raise self.error
+        if self.thread is None:
+            self.dump(path, function, args)
+        else:
+            self.queue.put((path, function, args))
+
+    def close(self):
+        """Waits until all files are written."""
+        if self.thread is not None:
+            self.queue.put(DONE)
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            raise self.error
+
+
+def triangulate_rings(polygons, backend=None):
+    """Triangulates the polygons given as (exterior, interiors) tuples. A polygon which fails gets None instead of its
+    triangles, so it can be triangulated again (and reported) by the converter."""
+    triangles = []
+    for e, i in polygons:
+        try:
+            triangles.append(polygon3dmodule.triangulation(e, i, backend))
+        except Exception:
+            triangles.append(None)
+    return triangles
+
+
+class Watchdog(object):
+    """Runs functions in a separate process with a time limit, so a function which stalls (e.g. the triangulation of a
+    pathological polygon) does not stall the conversion. The process is started at once, before the threads of the pipeline.
+    A process which runs out of time is killed and replaced. Forking is not safe once the threads of the pipeline run
+    (they may hold locks), so with fork=False the replacements are the spare processes started up front, and when they
+    run out the functions are not run any more (RuntimeError)."""
+
+    def __init__(self, spares=0, fork=True):
+        self.fork = fork
+        self.pools = collections.deque(multiprocessing.Pool(1) for k in range(1 + spares))
+
+    def run(self, timeout, function, *args):
+        """Returns function(*args), or raises multiprocessing.TimeoutError if it does not finish within timeout seconds,
+        in which case the process is killed and replaced. The exceptions of the function are raised again here."""
+        if not self.pools:
+            raise RuntimeError("no watchdog process left")
+        result = self.pools[0].apply_async(function, args)
+        try:
+            return result.get(timeout)
+        except multiprocessing.TimeoutError:
+            pool = self.pools.popleft()
+            pool.terminate()
+            pool.join()
+            if not self.pools and self.fork:
+                self.pools.append(multiprocessing.Pool(1))
+            raise
+
+    def close(self):
+        """Stops the processes."""
+        for pool in self.pools:
+            pool.close()
+            pool.join()
+
+
+def ordered_map(pool, function, jobs, size, *args):
+    """Applies function(payload, *args) to the (context, payload) jobs in a pool of worker processes,
+    and yields the (context, result) tuples in the order of the jobs, with at most size jobs in flight.
+    The context stays in this process, so it does not need to be picklable."""
+    window = collections.deque()
+    for context, payload in jobs:
+        window.append((context, pool.apply_async(function, (payload,) + args)))
+        if len(window) >= size:
+            context, result = window.popleft()
+            yield context, result.get()
+    while window:
+        context, result = window.popleft()
+        yield context, result.get()
+
+
+def estimate(scan):
+    """Estimated memory (bytes) of the conversion of a file from its scan (see markup3dmodule.scanSource()),
+    and its time (s) split into the triangulation, which the workers share, and the rest."""
+    memory = scan['objects'] * OBJECTbytes + scan['polygons'] * POLYGONbytes + scan['coordinates'] * COORDINATEbytes
+    return memory, scan['polygons'] * POLYGONseconds, scan['coordinates'] * COORDINATEseconds
+
+
+def forecast(estimates, workers, pipeline):
+    """Estimated peak memory (bytes) and time (s) of the conversion of the files with the estimates (see estimate()),
+    with the workers and with or without the pipeline, which parses the next file while the current one is converted."""
+    memories = [e[0] for e in estimates] or [0]
+    if pipeline and len(memories) > 1:
+        peak = max(a + b for a, b in zip(memories, memories[1:]))
+    else:
+        peak = max(memories)
+    seconds = sum(e[2] + e[1] / max(workers, 1) for e in estimates)
+    return BASEbytes + peak + workers * WORKERbytes, seconds
+
+
+def tune(estimates, budget, cpus):
+    """Chooses the number of workers and the pipeline for the files with the estimates (see estimate()) within the memory
+    budget (bytes). The workers are used when there is enough triangulation to share and memory for at least two of them,
+    and the pipeline when there are several files and memory for two of them at once.
+    Returns (workers, pipeline, queue), with the queue size covering the workers."""
+    triangulation = sum(e[1] for e in estimates)
+    single = forecast(estimates, 0, False)[0]
+    workers = min(cpus, int(triangulation / WORKERseconds), int(max(budget - single, 0) / WORKERbytes))
+    if workers < 2:
+        workers = 0
+    pipeline = len(estimates) > 1 and forecast(estimates, workers, True)[0] <= budget
+    queue = min(16, max(4, 2 * workers))
+    return workers, pipeline, queue
@@ -30,11 +30,17 @@
 
 import math
 import markup3dmodule
+import mesh3dmodule
 from lxml import etree
 import copy
 import triangle
 import numpy as np
 import shapely
+import time
+try:
+    import mapbox_earcut
+except ImportError:
+    mapbox_earcut = None
 
 def getAreaOfGML(poly, height=True):
     """Function which reads <gml:Polygon> and returns its area.
@@ -92,13 +98,81 @@ def isPolyValid(polypoints, output=True):
                 print "\t\tA degenerate polygon. There are identical points."
             valid = False
     #-- Check if the polygon does not have self-intersections
-    #-- Disabled, something doesn't work here, will work on this later.
-    #if not isPolySimple(polypoints):
-    #    print "A degenerate polygon. The edges are intersecting."
-    #    valid = False
+    if valid and not isPolySimple(polypoints):
+        if output:
+            print "\t\tA degenerate polygon. The edges are intersecting."
+        valid = False
     return valid
 
 
+#-- Reason codes of the invalid rings, named after the errors of val3dity
+TOO_FEW_POINTS = 'TOO_FEW_POINTS'
+CONSECUTIVE_POINTS_SAME = 'CONSECUTIVE_POINTS_SAME'
+RING_NOT_CLOSED = 'RING_NOT_CLOSED'
+RING_SELF_INTERSECTION = 'RING_SELF_INTERSECTION'
+NON_PLANAR_POLYGON_DISTANCE_PLANE = 'NON_PLANAR_POLYGON_DISTANCE_PLANE'
+DEGENERATE_NORMAL = 'DEGENERATE_NORMAL'
+
+def validate_rings(rings, eps=0.01):
+    """Checks a batch of rings (e.g. all rings of a building) at once, the vectorised counterpart of isPolyValid().
+    Returns for each ring the list of the reason codes of its errors, an empty list if the ring is valid.
+    The planarity is the distance of the points to the plane through the centroid with the Newell normal."""
+    reasons = [[] for r in rings]
+    lengths = np.array([len(r) for r in rings], dtype=np.int64)
+    for idx in np.nonzero(lengths == 0)[0]:
+        reasons[idx].append(TOO_FEW_POINTS)
+    nonempty = np.nonzero(lengths > 0)[0]
+    if len(nonempty) == 0:
+        return reasons
+    pts = np.array([p for idx in nonempty for p in rings[idx]], dtype=np.float64).reshape(-1, 3)
+    lengths = lengths[nonempty]
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    ends = starts + lengths - 1
+    #-- Closure and the number of points (four because the first point is doubled as the last one)
+    not_closed = np.any(pts[starts] != pts[ends], axis=1)
+    too_few = lengths < 4
+    #-- Identical consecutive points
+    same = np.zeros(len(pts), dtype=bool)
+    same[1:] = np.all(pts[1:] == pts[:-1], axis=1)
+    same[starts] = False
+    repeated = np.logical_or.reduceat(same, starts)
+    #-- Newell normals
+    nxt = np.arange(1, len(pts) + 1)
+    nxt[ends] = starts
+    c = pts
+    n = pts[nxt]
+    newell = np.empty((len(nonempty), 3))
+    newell[:, 0] = np.add.reduceat((c[:, 1] - n[:, 1]) * (c[:, 2] + n[:, 2]), starts)
+    newell[:, 1] = np.add.reduceat((c[:, 2] - n[:, 2]) * (c[:, 0] + n[:, 0]), starts)
+    newell[:, 2] = np.add.reduceat((c[:, 0] - n[:, 0]) * (c[:, 1] + n[:, 1]), starts)
+    magnitude = np.sqrt((newell**2).sum(axis=1))
+    degenerate = magnitude <= 1e-12
+    normals = newell / np.where(degenerate, 1.0, magnitude)[:, np.newaxis]
+    #-- Distance of the points to the plane
+    centroids = np.add.reduceat(pts, starts) / lengths[:, np.newaxis]
+    distances = np.abs(((pts - np.repeat(centroids, lengths, axis=0)) * np.repeat(normals, lengths, axis=0)).sum(axis=1))
+    non_planar = (np.maximum.reduceat(distances, starts) > eps) & ~degenerate
+    for k, idx in enumerate(nonempty):
+        if not_closed[k]:
+            reasons[idx].append(RING_NOT_CLOSED)
+        if too_few[k]:
+            reasons[idx].append(TOO_FEW_POINTS)
+        if repeated[k]:
+            reasons[idx].append(CONSECUTIVE_POINTS_SAME)
+        if degenerate[k]:
+            reasons[idx].append(DEGENERATE_NORMAL)
+        if non_planar[k]:
+            reasons[idx].append(NON_PLANAR_POLYGON_DISTANCE_PLANE)
+        #-- The self-intersections are tested only for the otherwise valid rings
+        if not reasons[idx]:
+            drop = int(np.argmax(np.abs(normals[k])))
+            axes = [a for a in range(3) if a != drop]
+            ring = pts[starts[k]:ends[k], axes].tolist()
+            if not sweep_simple([tuple(p) for p in ring]):
+                reasons[idx].append(RING_SELF_INTERSECTION)
+    return reasons
+
+
 def isPolyPlanar(polypoints):
     """Checks if a polygon is planar."""
     #-- Normal of the polygon from the first three points
@@ -120,61 +194,136 @@ def isPolyPlanar(polypoints):
 
 def isPolySimple(polypoints):
     """Checks if the polygon is simple, i.e. it does not have any self-intersections.
-    Inspired by http://www.win.tue.nl/~vanwijk/2IV60/2IV60_exercise_3_answers.pdf"""
-    npolypoints = len(polypoints)
-    #-- Check if the polygon is vertical, i.e. a projection cannot be made.
-    #-- First copy the list so the originals are not modified
-    temppolypoints = copy.deepcopy(polypoints)
-    newpolypoints = copy.deepcopy(temppolypoints)
-    #-- If the polygon is vertical
-    if math.fabs(unit_normal(temppolypoints[0], temppolypoints[1], temppolypoints[2])[2]) < 10e-6:
-        vertical = True
-    else:
-        vertical = False
-    #-- We want to project the vertical polygon to the XZ plane
-    #-- If a polygon is parallel with the YZ plane that will not be possible
-    YZ = True
-    for i in range(1, npolypoints):
-        if temppolypoints[i][0] != temppolypoints[0][0]:
-            YZ = False
-            continue
-    #-- Project the plane in the special case
-    if YZ:
-        for i in range(0, npolypoints):
-            newpolypoints[i][0] = temppolypoints[i][1]
-            newpolypoints[i][1] = temppolypoints[i][2]
-    #-- Project the plane
-    elif vertical:
-        for i in range(0, npolypoints):
-            newpolypoints[i][1] = temppolypoints[i][2]
-    else:
-        pass #-- No changes here
-    #-- Check for the self-intersection edge by edge
-    for i in range(0, npolypoints-3):
-        if i == 0:
-            m = npolypoints - 3
+    The ring is projected to the plane along which it is the least steep, and its edges are tested with a sweep line
+    (Shamos-Hoey), so only the neighbouring edges in the sweep are compared. See sweep_simple() for its complexity."""
+    try:
+        normal = newell_normal(polypoints)
+    except ValueError:
+        return False
+    drop = max(range(3), key=lambda k: math.fabs(normal[k]))
+    axes = [k for k in range(3) if k != drop]
+    ring = [(p[axes[0]], p[axes[1]]) for p in polypoints]
+    #-- Without the doubled last point
+    if ring[0] == ring[-1]:
+        ring = ring[:-1]
+    return sweep_simple(ring)
+
+def sweep_simple(ring):
+    """Sweep line test of the simplicity of a 2D ring (without the doubled last point).
+    Edges sharing a vertex are allowed to touch only in that vertex.
+    The sweep status is a plain list: an edge is inserted at the position found with a binary search, but the insertions
+    and the removals (which look the edge up with list.index) take time linear in the number of the edges crossing the
+    sweep line. So the test takes O(n log n) for the usual rings and O(n^2) in the worst case, when most edges cross the
+    sweep line at once (e.g. a comb). The linear steps run in C, which is cheap for the rings of buildings."""
+    nedges = len(ring)
+    if nedges < 3:
+        return False
+    #-- Edges with their endpoints ordered from left to right
+    edges = []
+    for i in range(nedges):
+        a = ring[i]
+        b = ring[(i + 1) % nedges]
+        if a == b:
+            return False
+        edges.append((a, b) if a < b else (b, a))
+    #-- Events: (point, 0 for the left endpoint or 1 for the right one, edge)
+    events = []
+    for i in range(nedges):
+        events.append((edges[i][0], 0, i))
+        events.append((edges[i][1], 1, i))
+    events.sort()
+
+    def y_at(i, x):
+        (x1, y1), (x2, y2) = edges[i]
+        if x1 == x2:
+            return y1
+        return y1 + (y2 - y1) * float(x - x1) / (x2 - x1)
+
+    def slope(i):
+        (x1, y1), (x2, y2) = edges[i]
+        if x1 == x2:
+            return float('inf')
+        return float(y2 - y1) / (x2 - x1)
+
+    def key(i, x):
+        return (y_at(i, x), slope(i))
+
+    def crossing(i, j):
+        adjacent = (j == (i + 1) % nedges) or (i == (j + 1) % nedges)
+        return intersection(edges[i][0], edges[i][1], edges[j][0], edges[j][1], adjacent)
+
+    #-- Edges crossing the sweep line, ordered from the bottom to the top
+    status = []
+    for point, kind, i in events:
+        x = point[0]
+        if kind == 0:
+            k = key(i, x)
+            pos = _bisect_key(status, k, x, key)
+            status.insert(pos, i)
+            if pos > 0 and crossing(status[pos - 1], i):
+                return False
+            if pos < len(status) - 1 and crossing(i, status[pos + 1]):
+                return False
         else:
-            m = npolypoints - 2
-        for j in range (i + 2, m):
-            if intersection(newpolypoints[i], newpolypoints[i+1], newpolypoints[j%npolypoints], newpolypoints[(j+1)%npolypoints]):
+            pos = status.index(i)
+            if 0 < pos < len(status) - 1 and crossing(status[pos - 1], status[pos + 1]):
                 return False
+            del status[pos]
     return True
 
-def intersection(p, q, r, s):
-    """Check if two line segments (pq and rs) intersect. Computation is in 2D.
-    Inspired by http://www.win.tue.nl/~vanwijk/2IV60/2IV60_exercise_3_answers.pdf"""
-
-    eps = 10e-6
+def _bisect_key(status, k, x, key):
+    """Binary search of the position of the key k in the sweep status."""
+    lo = 0
+    hi = len(status)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if key(status[mid], x) < k:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
 
-    V = [q[0] - p[0], q[1] - p[1]]
-    W = [r[0] - s[0], r[1] - s[1]]
+def orientation(p, q, r):
+    """Orientation of the 2D points p, q and r: 1 counter-clockwise, -1 clockwise, 0 collinear."""
+    d = (q[0] - p[0]) * (r[1] - p[1]) - (q[1] - p[1]) * (r[0] - p[0])
+    if d > 0:
+        return 1
+    elif d < 0:
+        return -1
+    return 0
 
-    d = V[0]*W[1] - W[0]*V[1]
+def on_segment(p, q, r):
+    """Checks if the point r, collinear with p and q, lies on the segment pq."""
+    return min(p[0], q[0]) <= r[0] <= max(p[0], q[0]) and min(p[1], q[1]) <= r[1] <= max(p[1], q[1])
 
-    if math.fabs(d) < eps:
+def intersection(p, q, r, s, adjacent=False):
+    """Check if two line segments (pq and rs) intersect. Computation is in 2D.
+    Adjacent segments share an endpoint, so they intersect only if they overlap."""
+    o1 = orientation(p, q, r)
+    o2 = orientation(p, q, s)
+    o3 = orientation(r, s, p)
+    o4 = orientation(r, s, q)
+    if adjacent:
+        #-- Collinear and folding back over each other
+        if o1 == 0 and o2 == 0:
+            shared = [a for a in (p, q) if a in (r, s)]
+            others = [a for a in (p, q, r, s) if a not in shared]
+            if not others:
+                return True
+            return any([on_segment(p, q, a) for a in others if a not in (p, q)]) or \
+                   any([on_segment(r, s, a) for a in others if a not in (r, s)])
         return False
-    else:
+    if o1 != o2 and o3 != o4:
+        return True
+    if o1 == 0 and on_segment(p, q, r):
+        return True
+    if o2 == 0 and on_segment(p, q, s):
+        return True
+    if o3 == 0 and on_segment(r, s, p):
         return True
+    if o4 == 0 and on_segment(r, s, q):
+        return True
+    return False
 #------------------------------------------
 
 def collinear(p0, p1, p2):
@@ -368,11 +517,119 @@ def reverse_vertices(vertices):
         reversed_vertices.append(vertices[i])
     return reversed_vertices
 
-def triangulation(e, i):
-    """Triangulate the polygon with the exterior and interior list of points. Works only for convex polygons.
+def keyhole(e, i):
+    """Joins the interior rings of a polygon to its exterior with bridge (keyhole) edges, so a polygon with holes can be
+    written as one face without the triangulation. The rings are projected to the plane of the two axes along which the polygon
+    is the least steep. The holes are bridged from their rightmost point, the rightmost hole first, to the nearest visible point
+    found by casting a ray along the x axis (David Eberly's method, as in earcut).
+    Returns the points of the face without the doubled last point, in the orientation of the exterior."""
+    points = list(e[:-1])
+    if not i:
+        return points
+    normal = newell_normal(e)
+    drop = max(range(3), key=lambda k: math.fabs(normal[k]))
+    axes = [k for k in range(3) if k != drop]
+    outer = list(range(len(points)))
+    holes = []
+    for hole in i:
+        first = len(points)
+        points.extend(hole[:-1])
+        if len(hole) > 3:
+            holes.append(list(range(first, len(points))))
+    xy = [(p[axes[0]], p[axes[1]]) for p in points]
+    #-- Mirror the projection so the exterior is counter-clockwise, and the holes are clockwise
+    if _signed_area(xy, outer) < 0:
+        xy = [(x, -y) for x, y in xy]
+    for hole in sorted(holes, key=lambda hole: -max(xy[k][0] for k in hole)):
+        if _signed_area(xy, hole) > 0:
+            hole.reverse()
+        m = max(range(len(hole)), key=lambda k: xy[hole[k]])
+        hole = hole[m:] + hole[:m]
+        k = _bridge(xy, outer, hole[0])
+        #-- Around the hole from its rightmost point, and back along the bridge
+        outer = outer[:k + 1] + hole + [hole[0], outer[k]] + outer[k + 1:]
+    return [points[k] for k in outer]
+
+def _signed_area(xy, ring):
+    """Twice the signed area of a ring of the projected points, positive if it is counter-clockwise."""
+    area = 0.0
+    n = len(ring)
+    for k in range(n):
+        a = xy[ring[k]]
+        b = xy[ring[(k + 1) % n]]
+        area += a[0] * b[1] - b[0] * a[1]
+    return area
+
+def _cross(o, a, b):
+    return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+def _locally_inside(xy, outer, k, m):
+    """Checks if the point m is inside the angle of the counter-clockwise ring at its position k."""
+    a = xy[outer[k - 1]]
+    p = xy[outer[k]]
+    b = xy[outer[(k + 1) % len(outer)]]
+    if _cross(a, p, b) >= 0:
+        return _cross(a, p, m) >= 0 and _cross(p, b, m) >= 0
+    return _cross(a, p, m) >= 0 or _cross(p, b, m) >= 0
+
+def _bridge(xy, outer, m):
+    """Position in the counter-clockwise ring of the point to which the point m of a hole inside it is bridged."""
+    mx, my = xy[m]
+    n = len(outer)
+    #-- Nearest edge hit by the ray from m along the x axis, where the ring goes up since m is inside it
+    hit = None
+    hx = float('inf')
+    for k in range(n):
+        a = xy[outer[k]]
+        b = xy[outer[(k + 1) % n]]
+        if not (a[1] <= my <= b[1]) or a[1] == b[1]:
+            continue
+        x = a[0] + (my - a[1]) * (b[0] - a[0]) / (b[1] - a[1])
+        if mx <= x < hx:
+            hx = x
+            hit = k
+    if hit is None:
+        #-- Degenerate rings, the nearest point is taken
+        return min(range(n), key=lambda k: (xy[outer[k]][0] - mx)**2 + (xy[outer[k]][1] - my)**2)
+    #-- The endpoint of the edge with the largest x
+    if xy[outer[(hit + 1) % n]][0] > xy[outer[hit]][0]:
+        hit = (hit + 1) % n
+    p = xy[outer[hit]]
+    if hx == mx or p[1] == my:
+        return hit
+    #-- A point of the ring inside the triangle (m, hit, p) may block the view, then the one with the smallest angle to the ray is taken
+    best = hit
+    best_key = None
+    i = (hx, my)
+    for k in range(n):
+        r = xy[outer[k]]
+        if not (mx <= r[0] <= p[0]) or r == xy[m]:
+            continue
+        c1 = _cross(xy[m], i, r)
+        c2 = _cross(i, p, r)
+        c3 = _cross(p, xy[m], r)
+        if not ((c1 >= 0 and c2 >= 0 and c3 >= 0) or (c1 <= 0 and c2 <= 0 and c3 <= 0)):
+            continue
+        if r[0] == mx:
+            continue
+        key = (math.fabs(my - r[1]) / (r[0] - mx), r[0] - mx)
+        if (best_key is None or key < best_key) and _locally_inside(xy, outer, k, xy[m]):
+            best = k
+            best_key = key
+    return best
+
+def triangulation(e, i, backend=None):
+    """Triangulate the polygon with the exterior and interior list of points, with the backend
+    (one of TRIANGULATORS, BACKEND by default). Returns the list of triangles."""
+    if backend is None:
+        backend = BACKEND
+    return TRIANGULATORS[backend](e, i)
+
+def triangulation_triangle(e, i):
+    """Triangulate the polygon with the exterior and interior list of points with Triangle. Works only for convex polygons.
     Assumes planarity. Projects to a 2D plane and goes back to 3D."""
     vertices = []
-    holes = []
+    hole_ranges = []
     segments = []
     index_point = 0
     #-- Slope computation points
@@ -399,20 +656,14 @@ def triangulation(e, i):
                 segments.append([index_point, index_point+1])
             index_point += 1
             vertices.append(hole[p])
-        #-- A more robust way to get the point inside the hole, should work for non-convex interior polygons
-        holes.append(point_inside(hole[:-1]))
-        #-- Alternative, use centroid
-        # holes.append(centroid(hole[:-1]))
+        hole_ranges.append((first_point_in_hole, index_point))
 
     #-- Project to 2D since the triangulation cannot be done in 3D with the library that is used
     npolypoints = len(vertices)
-    nholes = len(holes)
     #-- Check if the polygon is vertical, i.e. a projection cannot be made.
     #-- First copy the list so the originals are not modified
     temppolypoints = copy.deepcopy(vertices)
     newpolypoints = copy.deepcopy(vertices)
-    tempholes = copy.deepcopy(holes)
-    newholes = copy.deepcopy(holes)
     #-- Compute the normal of the polygon for detecting vertical polygons and
     #-- for the correct orientation of the new triangulated faces
     #-- If the polygon is vertical
@@ -433,28 +684,21 @@ def triangulation(e, i):
         for i in range(0, npolypoints):
             newpolypoints[i][0] = temppolypoints[i][1]
             newpolypoints[i][1] = temppolypoints[i][2]
-        for i in range(0, nholes):
-            newholes[i][0] = tempholes[i][1]
-            newholes[i][1] = tempholes[i][2]
     #-- Project the plane
     elif vertical:
         for i in range(0, npolypoints):
             newpolypoints[i][1] = temppolypoints[i][2]
-        for i in range(0, nholes):
-            newholes[i][1] = tempholes[i][2]
     else:
         pass #-- No changes here
 
-    #-- Drop the last point (identical to first)
+    #-- Drop the z coordinate of the projected points
     for p in newpolypoints:
         p.pop(-1)
 
-    #-- If there are no holes
-    if len(newholes) == 0:
-        newholes = None
-    else:
-        for h in newholes:
-            h.pop(-1)
+    #-- A point inside each hole, found in the projection so it works also for vertical and non-convex interior polygons
+    newholes = []
+    for first, last in hole_ranges:
+        newholes.append(list(point_inside(newpolypoints[first:last])[0]))
 
     #-- Plane information (assumes planarity)
     a = e[0]
@@ -464,7 +708,10 @@ def triangulation(e, i):
     pl = plane(a, b, c)
  
     #-- Prepare the polygon to be triangulated
-    poly = {'vertices' : np.array(newpolypoints), 'segments' : np.array(segments), 'holes' : np.array(newholes)}
+    poly = {'vertices' : np.array(newpolypoints), 'segments' : np.array(segments)}
+    #-- If there are holes
+    if newholes:
+        poly['holes'] = np.array(newholes)
     # print poly
     #-- Triangulate
     t = triangle.triangulate(poly, "pQjz")
@@ -499,4 +746,429 @@ def triangulation(e, i):
             else:
                 tri_points_tmp = reverse_vertices(tri_points_tmp)
                 tri_points.append(tri_points_tmp)
-    return tri_points
\ No newline at end of file
+    return tri_points
+
+def triangulation_earcut(e, i):
+    """Triangulate the polygon with the exterior and interior list of points with earcut (mapbox_earcut).
+    The rings are passed as one flat buffer of projected coordinates with the offsets of the ends of the rings,
+    so no points inside the holes are needed. The triangles reuse the original 3D points."""
+    if mapbox_earcut is None:
+        raise ImportError("The earcut triangulation requires the mapbox_earcut package.")
+    #-- Without the doubled last points
+    points = list(e[:-1])
+    ends = [len(points)]
+    for hole in i:
+        points.extend(hole[:-1])
+        ends.append(len(points))
+    normal = newell_normal(e)
+    #-- Project to the plane of the two axes along which the polygon is the least steep
+    drop = max(range(3), key=lambda k: math.fabs(normal[k]))
+    axes = [k for k in range(3) if k != drop]
+    coords = np.array(points, dtype=np.float64)
+    flat = np.ascontiguousarray(coords[:, axes])
+    tris = mapbox_earcut.triangulate_float64(flat, np.array(ends, dtype=np.uint32)).reshape(-1, 3)
+    #-- Orient the triangles along the normal: counter-clockwise in the projection is along the normal,
+    #-- except when the y axis is dropped (z x x = y)
+    a = flat[tris[:, 0]]
+    b = flat[tris[:, 1]]
+    c = flat[tris[:, 2]]
+    signed = (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0])
+    direction = normal[drop] if drop != 1 else -normal[drop]
+    flip = signed * direction < 0
+    tris[flip] = tris[flip][:, ::-1]
+    return [[points[v] for v in tri] for tri in tris.tolist()]
+
+def triangulation_fan(e, i):
+    """Triangulate the polygon as a fan from its first point. It takes linear time, so it is the last resort for the
+    polygons which the backends cannot triangulate, but a fan is only correct for convex polygons: polygons with holes,
+    concave polygons and polygons without area raise ValueError."""
+    if i:
+        raise ValueError("a polygon with holes is not a fan")
+    normal = newell_normal(e)
+    points = e[:-1]
+    n = len(points)
+    for k in range(n):
+        a = points[k - 1]
+        b = points[k]
+        c = points[(k + 1) % n]
+        ab = [b[j] - a[j] for j in range(3)]
+        bc = [c[j] - b[j] for j in range(3)]
+        turn = cross(ab, bc)
+        #-- A reflex corner turns against the normal, beyond the rounding of nearly collinear points
+        if sum(turn[j] * normal[j] for j in range(3)) < -1e-9 * math.sqrt(sum(x**2 for x in ab) * sum(x**2 for x in bc)):
+            raise ValueError("the polygon is not convex")
+    return [[points[0], points[k], points[k + 1]] for k in range(1, n - 1)]
+
+#-- Available triangulation backends, and the default one
+TRIANGULATORS = {'triangle' : triangulation_triangle, 'earcut' : triangulation_earcut}
+BACKEND = 'triangle'
+
+def benchmark_triangulation(polygons, backends=None):
+    """Triangulates the polygons, given as (exterior, interiors) tuples, with each backend and compares them.
+    Returns for each backend the time in seconds, the number of triangles, the number of failed polygons,
+    and the area of the triangles relative to the area of the polygons (1.0 when the output covers the polygons)."""
+    if backends is None:
+        backends = sorted(TRIANGULATORS)
+    if polygons:
+        areas = surface_metrics(polygons)[0]
+    results = {}
+    for backend in backends:
+        ntris = 0
+        nfailed = 0
+        area = 0.0
+        expected = 0.0
+        #-- Time only the triangulation, the area of its triangles is summed in a second pass
+        elapsed = 0.0
+        output = []
+        for idx, (e, i) in enumerate(polygons):
+            start = time.time()
+            try:
+                tris = triangulation(e, i, backend)
+            except Exception:
+                elapsed += time.time() - start
+                nfailed += 1
+                continue
+            elapsed += time.time() - start
+            output.append((idx, tris))
+        for idx, tris in output:
+            ntris += len(tris)
+            expected += areas[idx]
+            for tri in tris:
+                area += 0.5 * math.sqrt(sum([c**2 for c in cross([tri[1][k] - tri[0][k] for k in range(3)], [tri[2][k] - tri[0][k] for k in range(3)])]))
+        if expected > 0:
+            coverage = area / expected
+        else:
+            coverage = 0.0
+        results[backend] = (elapsed, ntris, nfailed, coverage)
+    return results
+
+def newell_normal(polypoints):
+    """Unit normal of a polygon with Newell's method. Unlike getNormal() it does not depend on the first three points,
+    so it works also for concave polygons and collinear points."""
+    nx = 0.0
+    ny = 0.0
+    nz = 0.0
+    npolypoints = len(polypoints)
+    for i in range(npolypoints):
+        c = polypoints[i]
+        n = polypoints[(i + 1) % npolypoints]
+        nx += (c[1] - n[1]) * (c[2] + n[2])
+        ny += (c[2] - n[2]) * (c[0] + n[0])
+        nz += (c[0] - n[0]) * (c[1] + n[1])
+    magnitude = (nx**2 + ny**2 + nz**2)**.5
+    if magnitude == 0.0:
+        raise ValueError("The normal of the polygon has no magnitude. Check the polygon.")
+    return (nx/magnitude, ny/magnitude, nz/magnitude)
+
+def coplanar_groups(polygons, eps=0.01):
+    """Groups the polygons, given as (exterior, interiors) tuples, by their plane.
+    Two polygons are in the same plane if their normals are equal (see compare_normals) and
+    all points of one are within eps of the plane of the other. Returns lists of indices of the polygons."""
+    groups = []
+    for idx, (e, i) in enumerate(polygons):
+        try:
+            normal = newell_normal(e)
+        except ValueError:
+            groups.append((None, None, [idx]))
+            continue
+        found = False
+        for gnormal, gpoint, members in groups:
+            if gnormal is None or not compare_normals(normal, gnormal):
+                continue
+            if all([math.fabs(dot([p[0] - gpoint[0], p[1] - gpoint[1], p[2] - gpoint[2]], gnormal)) <= eps for p in e]):
+                members.append(idx)
+                found = True
+                break
+        if not found:
+            groups.append((normal, e[0], [idx]))
+    return [members for gnormal, gpoint, members in groups]
+
+def merge_coplanar(polygons, keep=()):
+    """Merges coplanar polygons, given as (exterior, interiors) tuples, into as few polygons as possible.
+    Adjacent polygons are dissolved into one outline in a 2D projection, and lifted back to the plane of the group.
+    The points in keep (tuples, e.g. the points shared with other faces) keep their original coordinates and are not
+    removed, so the neighbours of the group get no T-junctions. The other collinear points on the outlines are removed."""
+    if len(polygons) < 2:
+        return polygons
+    #-- The plane of the group: the mean normal of the polygons, through the mean of their points
+    normals = [newell_normal(e) for e, i in polygons]
+    normal = [sum(n[k] for n in normals) for k in range(3)]
+    magnitude = (normal[0]**2 + normal[1]**2 + normal[2]**2)**.5
+    normal = [c / magnitude for c in normal]
+    points = [p for e, i in polygons for p in e[:-1]]
+    origin = [sum(p[k] for p in points) / float(len(points)) for k in range(3)]
+    #-- Project to the plane of the two axes along which the polygon is the least steep
+    drop = max(range(3), key=lambda k: math.fabs(normal[k]))
+    axes = [k for k in range(3) if k != drop]
+    keep = set(keep)
+    #-- Original 3D points of the projected ones
+    lookup = {}
+    shapes = []
+    for e, i in polygons:
+        rings = []
+        for ring in [e] + list(i):
+            ring2d = []
+            for p in ring:
+                p2d = (p[axes[0]], p[axes[1]])
+                lookup[p2d] = p
+                ring2d.append(p2d)
+            rings.append(ring2d)
+        shape = shapely.Polygon(rings[0], rings[1:])
+        if not shape.is_valid:
+            shape = shape.buffer(0)
+        shapes.append(shape)
+    merged = shapely.unary_union(shapes)
+    if merged.geom_type == 'Polygon':
+        merged = [merged]
+    else:
+        merged = [g for g in getattr(merged, 'geoms', []) if g.geom_type == 'Polygon']
+
+    def kept(p2d):
+        return p2d in lookup and tuple(lookup[p2d]) in keep
+
+    def prune(ring2d):
+        """Removes the collinear points of the closed ring, except the kept ones."""
+        ring2d = ring2d[:-1]
+        removed = True
+        while removed and len(ring2d) > 3:
+            removed = False
+            for s in range(len(ring2d)):
+                a, b, c = ring2d[s - 1], ring2d[s], ring2d[(s + 1) % len(ring2d)]
+                if kept(b):
+                    continue
+                if (b[0] - a[0]) * (c[1] - b[1]) - (b[1] - a[1]) * (c[0] - b[0]) == 0.0:
+                    del ring2d[s]
+                    removed = True
+                    break
+        return ring2d + [ring2d[0]]
+
+    def lift(ring2d):
+        ring = []
+        for p2d in ring2d:
+            if kept(p2d):
+                ring.append(lookup[p2d])
+            else:
+                #-- Get the dropped coordinate from the plane, also for the original points which are within eps of it
+                p = [0.0, 0.0, 0.0]
+                p[axes[0]] = p2d[0]
+                p[axes[1]] = p2d[1]
+                p[drop] = origin[drop] - (normal[axes[0]] * (p2d[0] - origin[axes[0]]) + normal[axes[1]] * (p2d[1] - origin[axes[1]])) / normal[drop]
+                ring.append(p)
+        return ring
+
+    def orient(ring, outer):
+        """Orients the ring along the normal (outer) or against it (inner), starting at a convex point."""
+        if (dot(newell_normal(ring[:-1]), normal) > 0) != outer:
+            ring = reverse_vertices(ring)
+        ring = ring[:-1]
+        for s in range(len(ring)):
+            a, b, c = ring[s - 1], ring[s], ring[(s + 1) % len(ring)]
+            turn = cross([b[0] - a[0], b[1] - a[1], b[2] - a[2]], [c[0] - b[0], c[1] - b[1], c[2] - b[2]])
+            if dot(turn, normal) > 0:
+                ring = ring[s - 1:] + ring[:s - 1] if s > 0 else ring[-1:] + ring[:-1]
+                break
+        return ring + [ring[0]]
+
+    result = []
+    for m in merged:
+        if m.is_empty or m.area == 0.0:
+            continue
+        e = orient(lift(prune(list(m.exterior.coords))), True)
+        i = [orient(lift(prune(list(r.coords))), False) for r in m.interiors]
+        result.append((e, i))
+    return result
+
+def simplify_coplanar(polygons, eps=0.01, outside=()):
+    """Groups the polygons by plane and merges the adjacent coplanar ones. See coplanar_groups() and merge_coplanar().
+    The points of a group shared with the other groups or with the outside polygons (other faces of the same building)
+    are kept. The polygons of a group which cannot be merged are kept as they are.
+    Returns the polygons and the number of the groups which failed."""
+    simplified = []
+    failed = 0
+    groups = coplanar_groups(polygons, eps)
+    #-- The group of each point, None if it is shared
+    owner = {}
+    for g, members in enumerate(groups):
+        for idx in members:
+            e, i = polygons[idx]
+            for ring in [e] + list(i):
+                for p in ring:
+                    p = tuple(p)
+                    if owner.get(p, g) != g:
+                        owner[p] = None
+                    else:
+                        owner[p] = g
+    for e, i in outside:
+        for ring in [e] + list(i):
+            for p in ring:
+                owner[tuple(p)] = None
+    shared = set(p for p in owner if owner[p] is None)
+    for members in groups:
+        group = [polygons[idx] for idx in members]
+        try:
+            simplified.extend(merge_coplanar(group, shared))
+        except Exception:
+            failed += 1
+            simplified.extend(group)
+    return simplified, failed
+
+def footprint(polygons, points=None):
+    """Footprint of a building in the xy plane: the union of the polygons, given as (exterior, interiors) tuples (e.g. its
+    ground surfaces), or without them the convex hull of the points. Returns the polygons of the footprint as
+    (exterior, interiors) tuples of 2D rings without the doubled last point, the exterior counter-clockwise and the
+    interiors clockwise."""
+    shapes = []
+    for e, i in polygons:
+        shape = shapely.Polygon([p[:2] for p in e], [[p[:2] for p in r] for r in i])
+        if not shape.is_valid:
+            shape = shape.buffer(0)
+        shapes.append(shape)
+    if shapes:
+        merged = shapely.unary_union(shapes).simplify(0)
+    elif points:
+        merged = shapely.MultiPoint([p[:2] for p in points]).convex_hull
+    else:
+        return []
+    if merged.geom_type == 'Polygon':
+        merged = [merged]
+    else:
+        merged = [g for g in getattr(merged, 'geoms', []) if g.geom_type == 'Polygon']
+
+    def orient(coords, ccw):
+        ring = [tuple(c[:2]) for c in coords][:-1]
+        area = sum(ring[k - 1][0] * ring[k][1] - ring[k][0] * ring[k - 1][1] for k in range(len(ring)))
+        if (area > 0) != ccw:
+            ring.reverse()
+        return ring
+
+    result = []
+    for m in merged:
+        if m.is_empty or m.area == 0.0:
+            continue
+        result.append((orient(m.exterior.coords, True), [orient(r.coords, False) for r in m.interiors]))
+    return result
+
+def extrude(exterior, interiors, base, top):
+    """Walls of the prism of a 2D polygon of footprint() from the height base up to top, as triangles facing out."""
+    walls = []
+    for ring in [exterior] + list(interiors):
+        for k in range(len(ring)):
+            a = ring[k]
+            b = ring[(k + 1) % len(ring)]
+            a0 = [a[0], a[1], base]
+            b0 = [b[0], b[1], base]
+            a1 = [a[0], a[1], top]
+            b1 = [b[0], b[1], top]
+            walls.append([a0, b0, b1])
+            walls.append([b1, a1, a0])
+    return walls
+
+def triangle_count(e, i):
+    """Number of triangles of the triangulation of a polygon without additional points (n - 2 + 2h)."""
+    npoints = len(e) - 1
+    for iring in i:
+        npoints += len(iring) - 1
+    return npoints - 2 + 2 * len(i)
+
+def surface_metrics(polygons):
+    """Area, normal, azimuth and tilt of a batch of polygons, given as (exterior, interiors) tuples, computed at once.
+    The vectorised counterpart of getAreaOfGML(), getNormal() and getAngles(): the area is the magnitude of the Newell vector
+    of the exterior minus the ones of the interiors, and the normal is the one of the exterior.
+    Returns four arrays: areas (n), normals (n x 3), azimuths (n) and tilts (n)."""
+    npolygons = len(polygons)
+    rings = []
+    owners = []
+    exterior = []
+    for idx, (e, i) in enumerate(polygons):
+        for ring in [e] + list(i):
+            rings.append(ring)
+            owners.append(idx)
+            exterior.append(ring is e)
+    lengths = np.array([len(r) for r in rings], dtype=np.int64)
+    pts = np.array([p for r in rings for p in r], dtype=np.float64).reshape(-1, 3)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.int64)
+    ends = starts + lengths - 1
+    nxt = np.arange(1, len(pts) + 1)
+    nxt[ends] = starts
+    c = pts
+    n = pts[nxt]
+    newell = np.empty((len(rings), 3))
+    newell[:, 0] = np.add.reduceat((c[:, 1] - n[:, 1]) * (c[:, 2] + n[:, 2]), starts)
+    newell[:, 1] = np.add.reduceat((c[:, 2] - n[:, 2]) * (c[:, 0] + n[:, 0]), starts)
+    newell[:, 2] = np.add.reduceat((c[:, 0] - n[:, 0]) * (c[:, 1] + n[:, 1]), starts)
+    ringareas = 0.5 * np.sqrt((newell**2).sum(axis=1))
+    owners = np.array(owners, dtype=np.int64)
+    exterior = np.array(exterior, dtype=bool)
+    #-- Account for the interior
+    areas = np.zeros(npolygons)
+    np.add.at(areas, owners, np.where(exterior, ringareas, -ringareas))
+    normals = np.zeros((npolygons, 3))
+    normals[owners[exterior]] = newell[exterior] / np.where(ringareas[exterior] == 0.0, 1.0, 2.0 * ringareas[exterior])[:, np.newaxis]
+    #-- Convert from polar system to azimuth, and the tilt is 0 for flat roof, 90 for wall
+    azimuths = np.mod(90.0 - np.degrees(np.arctan2(normals[:, 1], normals[:, 0])), 360.0)
+    t = np.sqrt(normals[:, 0]**2 + normals[:, 1]**2)
+    tilts = np.zeros(npolygons)
+    sloped = t > 0
+    tilts[sloped] = 90.0 - np.degrees(np.arctan(normals[sloped, 2] / t[sloped]))
+    tilts = np.round(tilts, 3)
+    return areas, normals, azimuths, tilts
+
+def texture_coordinates(points, ring_points, ring_uvs, eps=1e-6):
+    """Texture coordinates of points of a polygon, e.g. the vertices of its triangles: the ones of the same point of the rings,
+    otherwise (points added by the triangulation) interpolated with the affine mapping fitted to the points of the rings."""
+    points = np.asarray(points, dtype=np.float64)
+    ring_points = np.asarray(ring_points, dtype=np.float64)
+    ring_uvs = np.asarray(ring_uvs, dtype=np.float64)
+    distances = ((points[:, np.newaxis, :] - ring_points[np.newaxis, :, :])**2).sum(axis=2)
+    nearest = distances.argmin(axis=1)
+    uvs = ring_uvs[nearest]
+    far = distances[np.arange(len(points)), nearest] > eps**2
+    if far.any():
+        coefficients = np.linalg.lstsq(np.column_stack((ring_points, np.ones(len(ring_points)))), ring_uvs, rcond=-1)[0]
+        uvs[far] = np.column_stack((points[far], np.ones(far.sum()))).dot(coefficients)
+    return uvs.tolist()
+
+def canonical_key(e, i, tolerance=None, grid=None, representatives=None):
+    """Key of a polygon which does not depend on the first point and on the orientation of its rings:
+    the sorted vertices of each ring (without the doubled last point). With a tolerance each point is welded to the first
+    representative point within the tolerance (see mesh3dmodule.weld_lookup()), or becomes one, and the ring is keyed by the
+    indices of the representatives. The grid and the representatives are shared by the polygons to compare."""
+    rings = []
+    for ring in [e] + list(i):
+        if tolerance:
+            points = []
+            for p in ring[:-1]:
+                idx = mesh3dmodule.weld_lookup(p, grid, representatives, tolerance)
+                if idx is None:
+                    idx = mesh3dmodule.weld_insert(p, grid, representatives, tolerance)
+                points.append(idx)
+        else:
+            points = [(p[0], p[1], p[2]) for p in ring[:-1]]
+        rings.append(tuple(sorted(set(points))))
+    return (rings[0], tuple(sorted(rings[1:])))
+
+def coincident_pairs(polygons, tolerance=None):
+    """Finds the pairs of coincident polygons with opposite orientations, e.g. the party walls of adjacent buildings.
+    The polygons, (exterior, interiors) tuples, can be streamed. They are matched through a hash map of their canonical keys,
+    so only the keys (and not the polygons) are kept. Each polygon is in at most one pair.
+    Returns the pairs of indices of the polygons."""
+    buckets = {}
+    pairs = []
+    #-- The welded points, shared by all polygons so the ones near the edges of the cells match too
+    grid = {}
+    representatives = []
+    for idx, (e, i) in enumerate(polygons):
+        try:
+            normal = newell_normal(e[:-1])
+        except ValueError:
+            continue
+        key = canonical_key(e, i, tolerance, grid, representatives)
+        bucket = buckets.setdefault(key, [])
+        for n, (other, other_normal) in enumerate(bucket):
+            if normal[0] * other_normal[0] + normal[1] * other_normal[1] + normal[2] * other_normal[2] < 0:
+                pairs.append((other, idx))
+                del bucket[n]
+                break
+        else:
+            bucket.append((idx, normal))
+    return pairs
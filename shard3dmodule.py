@@ -0,0 +1,198 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+
+# This code is part of the CityGML2OBJs package
+
+# Copyright (c) 2014 
+# Filip Biljecki
+# Delft University of Technology
+# fbiljecki@gmail.com
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import os
+import glob
+import json
+import shutil
+import zipfile
+import collections
+import markup3dmodule
+import obj3dmodule
+try:
+    import pyarrow
+    import pyarrow.parquet
+    import pyarrow.feather
+except ImportError:
+    pyarrow = None
+
+#-- Written in the directory of a shard when its conversion is finished
+DONEfile = 'done.json'
+
+
+def source_size(path, member=None):
+    """Size in bytes of a CityGML file found by GMLsources(), uncompressed for the ones in ZIP archives."""
+    if member is not None:
+        with zipfile.ZipFile(path) as archive:
+            return archive.getinfo(member).file_size
+    return os.path.getsize(path)
+
+
+def plan(sources, nshards):
+    """Splits the CityGML files found by GMLsources() into at most nshards shards of about the same size.
+    With at least as many files as shards, whole files are distributed, the largest first to the least loaded shard.
+    Otherwise the files are split by their cityObjectMembers, in proportion to their size.
+    Returns the shards as lists of parts: dicts with the name, path and member of the file, and the range
+    [start, end) of its cityObjectMembers, or None for the whole file."""
+    sizes = [source_size(path, member) for name, path, member in sources]
+    shards = [[] for k in range(nshards)]
+    if len(sources) >= nshards:
+        loads = [0] * nshards
+        assigned = [[] for k in range(nshards)]
+        for idx in sorted(range(len(sources)), key=lambda idx: -sizes[idx]):
+            k = loads.index(min(loads))
+            loads[k] += sizes[idx]
+            assigned[k].append(idx)
+        for k in range(nshards):
+            for idx in sorted(assigned[k]):
+                shards[k].append(part(sources[idx], None))
+    else:
+        #-- Each file gets one shard, the others go to the files with the largest size per shard
+        counts = [1] * len(sources)
+        for extra in range(nshards - len(sources)):
+            idx = max(range(len(sources)), key=lambda idx: sizes[idx] / float(counts[idx]))
+            counts[idx] += 1
+        k = 0
+        for idx, source in enumerate(sources):
+            if counts[idx] == 1:
+                shards[k].append(part(source, None))
+                k += 1
+                continue
+            nmembers = markup3dmodule.countMembers(source[1], source[2])
+            for j in range(counts[idx]):
+                shards[k].append(part(source, [nmembers * j // counts[idx], nmembers * (j + 1) // counts[idx]]))
+                k += 1
+    return [shard for shard in shards if shard]
+
+
+def part(source, objects):
+    """Part of a shard: a CityGML file, or a range of its cityObjectMembers."""
+    name, path, member = source
+    return {'name' : name, 'path' : os.path.abspath(path), 'member' : member, 'objects' : objects}
+
+
+def write_manifests(shards, directory):
+    """Writes the manifest of each shard to the directory, as shard-0000.json, ... Returns their paths."""
+    paths = []
+    for k, shard in enumerate(shards):
+        path = os.path.join(directory, 'shard-%04d.json' % k)
+        with open(path, 'w') as f:
+            json.dump({'shard' : k, 'shards' : len(shards), 'sources' : shard}, f, indent=1)
+        paths.append(path)
+    return paths
+
+
+def read_manifest(path):
+    """Reads the manifest of a shard."""
+    with open(path) as f:
+        return json.load(f)
+
+
+def shard_directory(path):
+    """Directory with the output of the shard, next to its manifest."""
+    return os.path.splitext(path)[0]
+
+
+def start_shard(path):
+    """Prepares the directory of the shard. The outputs of a previous conversion of the shard are removed,
+    so the shard is not merged until it is converted again."""
+    directory = shard_directory(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    done = os.path.join(directory, DONEfile)
+    if os.path.exists(done):
+        with open(done) as f:
+            files = json.load(f)['files']
+        os.remove(done)
+        for name in files:
+            if os.path.exists(os.path.join(directory, name)):
+                os.remove(os.path.join(directory, name))
+    return os.path.join(directory, '')
+
+
+def finish_shard(path, options):
+    """Marks the shard as converted, with the options of the conversion, which have to be the same for all shards."""
+    directory = shard_directory(path)
+    files = sorted(f for f in os.listdir(directory) if f != DONEfile)
+    with open(os.path.join(directory, DONEfile), 'w') as f:
+        json.dump({'options' : options, 'files' : files}, f, indent=1)
+
+
+def merge(directory):
+    """Merges the outputs of the shards planned in the directory into it, in the order of the shards.
+    The OBJs are concatenated with the offsets of the vertex indices, and the tables (CSV, and Parquet and Feather with pyarrow)
+    with one header.
+    Raises an IOError if a shard is not converted yet, and a ValueError if the shards were converted with different options.
+    Returns the merged files and the skipped ones (other files found in several shards)."""
+    manifests = sorted(glob.glob(os.path.join(directory, 'shard-*.json')))
+    if not manifests:
+        raise IOError("no shards are planned in %s" % directory)
+    missing = []
+    options = None
+    outputs = collections.OrderedDict()
+    for manifest in manifests:
+        done = os.path.join(shard_directory(manifest), DONEfile)
+        if not os.path.exists(done):
+            missing.append(os.path.basename(manifest))
+            continue
+        with open(done) as f:
+            done = json.load(f)
+        if options is None:
+            options = done['options']
+        elif done['options'] != options:
+            raise ValueError("the shard %s was converted with different options" % os.path.basename(manifest))
+        for name in done['files']:
+            outputs.setdefault(name, []).append(os.path.join(shard_directory(manifest), name))
+    if missing:
+        raise IOError("shard(s) not converted yet: %s" % ', '.join(missing))
+    merged = []
+    skipped = []
+    for name, paths in outputs.items():
+        target = os.path.join(directory, name)
+        if len(paths) == 1:
+            shutil.copyfile(paths[0], target)
+        elif name.endswith('.obj'):
+            obj3dmodule.merge_objs(paths, target)
+        elif name.endswith('.csv'):
+            with open(target, 'wb') as out:
+                for n, path in enumerate(paths):
+                    with open(path, 'rb') as f:
+                        if n:
+                            f.readline()
+                        shutil.copyfileobj(f, out)
+        elif name.endswith('.parquet') and pyarrow is not None:
+            pyarrow.parquet.write_table(pyarrow.concat_tables([pyarrow.parquet.read_table(path) for path in paths]), target)
+        elif name.endswith('.feather') and pyarrow is not None:
+            pyarrow.feather.write_feather(pyarrow.concat_tables([pyarrow.feather.read_table(path) for path in paths]), target)
+        else:
+            skipped.append(name)
+            continue
+        merged.append(name)
+    return merged, skipped
@@ -0,0 +1,123 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# The MIT License (MIT)
+
+# This code is part of the CityGML2OBJs package
+
+# Copyright (c) 2014 
+# Filip Biljecki
+# Delft University of Technology
+# fbiljecki@gmail.com
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import os
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+#-- Pixels around each image in an atlas, against the bleeding of the neighbouring images
+PADDING = 2
+#-- Tolerance of the texture coordinates, outside [0, 1] the texture is repeated and it cannot be packed in an atlas
+UVtolerance = 1e-3
+
+
+def packable(uvs):
+    """Checks if an image with these texture coordinates can be packed in an atlas, i.e. the texture is not repeated."""
+    for u, v in uvs:
+        if u < -UVtolerance or u > 1 + UVtolerance or v < -UVtolerance or v > 1 + UVtolerance:
+            return False
+    return True
+
+
+def shelf_pack(sizes, atlas_size, padding=PADDING):
+    """Places the images of the (width, height) sizes on shelves of square atlases of atlas_size pixels, the tallest first.
+    Returns for each image its (atlas, x, y) or None if it is larger than the atlas, and the used height of each atlas."""
+    placements = [None] * len(sizes)
+    heights = []
+    x = y = shelf = 0
+    for idx in sorted(range(len(sizes)), key=lambda idx: -sizes[idx][1]):
+        w = sizes[idx][0] + 2 * padding
+        h = sizes[idx][1] + 2 * padding
+        if w > atlas_size or h > atlas_size:
+            continue
+        if not heights:
+            heights.append(0)
+        #-- Next shelf, or next atlas
+        if x + w > atlas_size:
+            x = 0
+            y += shelf
+            shelf = 0
+        if y + h > atlas_size:
+            heights.append(0)
+            x = y = shelf = 0
+        placements[idx] = (len(heights) - 1, x + padding, y + padding)
+        x += w
+        shelf = max(shelf, h)
+        heights[-1] = max(heights[-1], y + h)
+    return placements, heights
+
+
+def build_atlases(paths, atlas_size, prefix, padding=PADDING):
+    """Packs the images into atlases, written as prefix-0.png, ... (JPEG if all images are JPEG).
+    Returns the file names of the atlases and for each image (atlas, x, y, width, height, atlas width, atlas height),
+    or None if it was not packed (missing or larger than the atlas)."""
+    sizes = []
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                sizes.append(Image.open(f).size)
+        except IOError:
+            sizes.append((atlas_size + 1, atlas_size + 1))
+    placements, heights = shelf_pack(sizes, atlas_size, padding)
+    jpeg = all(path.lower().endswith(('.jpg', '.jpeg')) for path in paths)
+    atlases = []
+    for a, height in enumerate(heights):
+        atlas = Image.new('RGB' if jpeg else 'RGBA', (atlas_size, height))
+        for path, size, placement in zip(paths, sizes, placements):
+            if placement is None or placement[0] != a:
+                continue
+            image = Image.open(path).convert(atlas.mode)
+            x, y = placement[1], placement[2]
+            atlas.paste(image, (x, y))
+            #-- Repeat the edges in the padding
+            if padding:
+                w, h = size
+                atlas.paste(image.crop((0, 0, w, 1)).resize((w, padding)), (x, y - padding))
+                atlas.paste(image.crop((0, h - 1, w, h)).resize((w, padding)), (x, y + h))
+                atlas.paste(atlas.crop((x, y - padding, x + 1, y + h + padding)).resize((padding, h + 2 * padding)), (x - padding, y - padding))
+                atlas.paste(atlas.crop((x + w - 1, y - padding, x + w, y + h + padding)).resize((padding, h + 2 * padding)), (x + w, y - padding))
+        name = '%s-%d.%s' % (prefix, a, 'jpg' if jpeg else 'png')
+        atlas.save(name)
+        atlases.append(os.path.basename(name))
+    result = []
+    for size, placement in zip(sizes, placements):
+        if placement is None:
+            result.append(None)
+        else:
+            result.append((placement[0], placement[1], placement[2], size[0], size[1], atlas_size, heights[placement[0]]))
+    return atlases, result
+
+
+def atlas_uv(uv, placement):
+    """Texture coordinates of an image in its atlas (the v axis of OBJ goes up, the rows of the images go down)."""
+    a, x, y, w, h, aw, ah = placement
+    return [(x + uv[0] * w) / float(aw), 1.0 - (y + (1.0 - uv[1]) * h) / float(ah)]